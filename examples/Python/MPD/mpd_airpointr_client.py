@@ -8,21 +8,26 @@ previous track) via gesture input from the connected AirPointr Service
 @package mpd_airpointr_client
 '''
 
-import socket
-import time
-import threading
-import json
-
-import mpd
-
-# Interface IP for the communiation with the AirPointr Service
-# set to "0.0.0.0" on UNIX and to "<ip_of_ethernet_interface>" on Windows
-LOCAL_INTERFACE_IP = "127.0.0.1"
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "client_library"))
+import airpointr
+import airpointr_log
+import airpointr_media
+import airpointr_metrics
+import airpointr_mpd
+import airpointr_record
+import airpointr_stats
 
 MPD_HOST = "localhost"
 MPD_PORT = "6600"
 MPD_PASSWORD = None
 
+# the volume is sent to mpd at most every ... seconds while circling
+VOLUME_WINDOW = 0.1
+
 # IP Address of the machine that should provide the AirPointr service
 # set to <"127.0.0.1"> if AirPointr runs on same machine
 # set to <None> if machine is addressed by AIRPOINTR_HOSTNAME
@@ -31,303 +36,64 @@ AIRPOINTR_HOST_IP = "127.0.0.1"
 # Hostname of the machine that runs the AirPointr service
 # only needed if AIRPOINTR_HOST_IP = None, otherwise set to <None> 
 AIRPOINTR_HOSTNAME = None
-AIRPOINTR_DISCOVERY_PORT = 8980
 AIRPOINTR_GESTURE_PORT = 8981
 
+# set to <True> to use all discovered AirPointr services, e.g. several
+# cameras in one room: the one someone gestures in front of has the control
+AIRPOINTR_ALL_SERVICES = False
 
-"""
-some globals for the mpd control
-"""
-mpd_client = None
-mpd_state = "stop"
-volume_change_active = False
-last_segment = 0
-
-airpointr_services_list = []
-sock = None
-http_client = None
-  
-def do_every(interval, worker_func, iterations = 0):
-    """
-    helper function to create periodically executed threads
-    """
-    if iterations != 1:
-        threading.Timer(
-                        interval,
-                        do_every, [interval, worker_func, 0 if iterations == 0 else iterations-1]
-                        ).start()
-    worker_func()
-                    
-def register_to_gesture_server(ip, port):
-    """
-    Sends the registration request to the specefied address
-    """
-    try:
-        sock.sendto("register",(ip,port))
-    except socket.error as e:
-        print e
-        print (ip,port)    
-
-def keep_alive_airpointr_service():
-    """
-    Lists the discovered AirPointr Server and sends a keep alive message to
-    the one that should provide the control input
-    """
-    inactive_server = []
-    print "\nDiscovered Airpointr Server:"
-    for idx, server in enumerate(airpointr_services_list):
-        if server["last_packet"]+10 > time.clock():
-            if server["active"]:
-                register_to_gesture_server(*server["address"])
-                print "Address: " + (str(server["address"])
-                       + " | License Status: " + str(server["license_status"])
-                       + " | (active)")
-            else:
-                print str(server["address"])
-        else:
-            ip = server["address"][0]
-            if ip != "127.0.0.1" and ip != "127.0.1.1":
-                inactive_server.append(idx)
-            
-    for idx in sorted(inactive_server, reverse=True):
-        del airpointr_services_list[idx]
+# mapping file with what the gestures do, see airpointr_rules for the format
+# swipe right: play / next track, swipe left: pause / previous track,
+# circle: volume
+GESTURE_MAPPING = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "..", "mappings", "swipe.json")
 
-def handle_discovery_message(addr, json_data):
-    """
-    adds any new server address to airpointr_services_list and sends
-    registration message if the server should provide the control input
-    """
-    reception_time = time.clock()
-    ip = addr[0]
-    
-    not_in_list = True
-    for server in airpointr_services_list:
-        if server["address"] == addr:
-            server["last_packet"] = reception_time
-            not_in_list = False
-    
-    if not_in_list:
-        airpointr_services_list.append(dict(address=addr, 
-                                            active=False, 
-                                            license_status="demo",
-                                            last_packet=reception_time))
-        if ip == AIRPOINTR_HOST_IP:
-            register_to_gesture_server(*addr)
-        
-        print "\nreceived discovery message:"
-        for ka, va in json_data.iteritems():
-            if isinstance(va,dict):
-                print ka+": "
-                for kb, vb in va.iteritems():
-                    print "  "+kb+": "+str(vb)
-            else:
-                print ka+": "+str(va)
-        print "From Addresse", addr
-        print "\n"
-        
+# all datagrams received from the AirPointr service are recorded to this
+# file if set, see airpointr_record for replaying them
+RECORD_LOG = None
 
-def handle_pointer_message(addr, json_data):
-    """
-    checks if the received pointer message should be handled as control input
-    and starts the evalution of the pointer data
-    """
-    reception_time = time.clock()
-    ip = addr[0]
-    valid_input = False
-    for server in airpointr_services_list:
-        if ip == server["address"][0]:
-            server["active"] = True
-            server["license_status"] = json_data["license"]
-            if (server["license_status"] == "demo" or 
-                server["license_status"] == "licensed"):
-                    valid_input = True
-            else:
-                    print ("AirPointr Status " + 
-                           server["address"][0] + ":" +
-                           str(server["address"][1]) + " :" )
-                    print "Demo expired -> Pointer output is invalid!"
-            
-        server["last_packet"] = reception_time
+# the latencies from the reception of a frame to the answer of the player
+# are printed every ... seconds if set
+STATS_INTERVAL = None
 
+# counters and latencies are served for Prometheus on
+# http://localhost:<port>/metrics if set
+METRICS_PORT = None
 
-    if ip == AIRPOINTR_HOST_IP and valid_input:
-        handle_pointer_input(json_data)
-        
-def handle_op_message(addr, json_data):
-    """
-    Just displays if an registration operation has been successful
-    """
-    print "\nOperation-Status from: " + str(addr)
-    if json_data["success"]:
-        print ".."+str(json_data["op"]) + " --> success"
-    else:
-        print ".."+str(json_data["op"]) + " --> fail"       
-
-def handle_pointer_input(json_data):
-    """
-    evaluates the pointer data and changes the volume or the playback mode
-    accordingly
-    if volume control is active, playback mode is not changed
-    """
-    global volume_change_active
-    global last_segment
-    if json_data["circle"]["active"]:
-        if json_data["circle"]["direction"] != 0:
-            if volume_change_active:
-                segment = json_data["circle"]["segment"]
-                if segment != last_segment:
-                    seg_diff = segment - last_segment
-                    if seg_diff > 4:
-                        vol_change = seg_diff - 8
-                    elif seg_diff < -4:
-                        vol_change = seg_diff + 8
-                    else:
-                        vol_change = seg_diff
-                    set_volume_change(vol_change*2)
-                    last_segment = segment
-            else:
-                last_segment = json_data["circle"]["segment"]
-                volume_change_active = True
-        else:
-            volume_change_active = False
-    else:
-        volume_change_active = False
-        
-    if json_data["events"] and volume_change_active == False:
-        if json_data["events"] == [u'rwipe']:
-            print "\nevent occured: right swipe"
-            change_playback_mode("forward")
-        elif json_data["events"] == [u'lwipe']:
-            print "\nevent occured: left swipe"
-            change_playback_mode("backward")
-                
-    
-
-def connect_to_mpd():
-    """
-    Establishes TCP connection to mdp-host using  MPD_HOST, MPD_PORT.
-    Continuous attempts to connect every 5 seconds, if connection fails.
-    Also using MPD_PASSWORD if specified.
-    """
-    global mpd_client
-    
-    connected = False
-    while connected == False:
-            connected = True
-            try:
-                mpd_client.connect(MPD_HOST, MPD_PORT)
-            except socket.error as e:
-                connected = False
-                print e
-    
-            if connected == True and MPD_PASSWORD != None:
-                try:
-                    mpd_client.password(MPD_PASSWORD)
-    
-                except mpd.CommandError as e:
-                    connected = False
-    
-            if connected == False:
-                    print "Couldn't connect. Retrying"
-                    time.sleep(5)
-                    
-def set_volume_change(change):
-    """
-    Volume change is transmitted to the connected mpd-host
-    """
-    mpd_status = mpd_client.status()    
-    mpd_volume = float(mpd_status["volume"])
-    new_volume = min(100,max(0,mpd_volume+change))
-    mpd_client.setvol(int(new_volume))
-    print "MPD Status: Volume changed to: " +str(new_volume) + "%"
+def main():
+    # console output is written by a background thread, rate limited
+    pipeline = airpointr_log.LogPipeline()
+    pipeline.start()
+    backend = airpointr_mpd.MPDBackend(MPD_HOST, MPD_PORT, MPD_PASSWORD)
+    mapping = GESTURE_MAPPING
+    if len(sys.argv) > 1:
+        # another mapping file may be given on the command line
+        mapping = sys.argv[1]
+    recorder = None
+    if RECORD_LOG != None:
+        recorder = airpointr_record.Recorder(RECORD_LOG,
+                                             sched = airpointr.scheduler)
+    stats = None
+    if STATS_INTERVAL != None:
+        stats = airpointr_stats.LatencyStats()
+        stats.report_every(STATS_INTERVAL)
+    engine = airpointr_media.GestureEngine(backend, mapping,
+                                           host_ip = AIRPOINTR_HOST_IP,
+                                           hostname = AIRPOINTR_HOSTNAME,
+                                           gesture_port = AIRPOINTR_GESTURE_PORT,
+                                           volume_window = VOLUME_WINDOW,
+                                           all_services = AIRPOINTR_ALL_SERVICES,
+                                           recorder = recorder,
+                                           stats = stats)
+    if METRICS_PORT != None:
+        registry = airpointr_metrics.Registry()
+        airpointr_metrics.watch_engine(registry, engine)
+        airpointr_metrics.MetricsServer(registry, METRICS_PORT).start()
+    try:
+        engine.run()
+    finally:
+        pipeline.stop()
 
-        
-def change_playback_mode(direction):
-    """
-    depending on the current mpd state the client gives a specific control
-    command to the mpd in response to the swipe event
-    """
-    mpd_status_data = mpd_client.status()
-    mpd_state = mpd_status_data["state"]
-    if direction == "forward":
-        if mpd_state == "stop" or mpd_state == "pause":
-            mpd_client.play()
-        else:
-            mpd_client.next()
-    elif direction == "backward":
-        if mpd_state == "play":
-            mpd_client.pause()
-        elif mpd_state == "pause":
-            mpd_client.previous()
-        elif mpd_state == "stop":
-            mpd_client.play()
-            mpd_client.previous()
-        else:
-            mpd_client.play()
-    
-    mpd_status_data = mpd_client.status()
-    mpd_state = mpd_status_data["state"]
-    
-    print "Switched play-mode direction: "+direction
-    print "Current mpd state = "+mpd_state
-   
 
-def main():
-    global LOCAL_INTERFACE_IP
-    
-    global MPD_HOST
-    global MPD_PORT
-    global MPD_PASSWORD
-    
-    global AIRPOINTR_HOST_IP
-    global AIRPOINTR_HOSTNAME
-    global AIRPOINTR_DISCOVERY_PORT
-    global AIRPOINTR_GESTURE_PORT
-    
-    global sock
-    global mpd_client
-    
-    mpd_client = mpd.MPDClient()
-    
-    sock = socket.socket(socket.AF_INET, # Internet
-                         socket.SOCK_DGRAM) # UDP
-    
-    
-    sock.bind(('', 0))
-    
-    if AIRPOINTR_HOST_IP == None:
-        AIRPOINTR_HOST_IP = socket.gethostbyname_ex(AIRPOINTR_HOSTNAME)[2][0]
-    
-    connect_to_mpd()
-    print "Connection to mpd established"
-    
-    #discovery messages are not sent over the loopback interface, so if the
-    #service should run over this interface it has to be triggered directly
-    if AIRPOINTR_HOST_IP == "127.0.0.1" or AIRPOINTR_HOST_IP == "127.0.1.1":
-        register_to_gesture_server("127.0.0.1", AIRPOINTR_GESTURE_PORT)
-        airpointr_services_list.append(dict(address=("127.0.0.1", AIRPOINTR_GESTURE_PORT), 
-                                            active=False, 
-                                            license_status="demo",
-                                            last_packet=0))
-    
-    do_every(15, keep_alive_airpointr_service)
-    
-    while 1:
-        data, addr = sock.recvfrom(1024)
-        if data[0] == "{":
-            json_data = json.loads(data)
-            if "type" in json_data:
-                if json_data["type"] == "discovery":
-                    handle_discovery_message(addr, json_data)
-                        
-                elif json_data["type"] == "pointer" in data:
-                    handle_pointer_message(addr, json_data)
-                                
-            if "op" in json_data:
-                handle_op_message(addr, json_data)
-        else:
-            print "\nnot a JSON-Blob"
- 
-            
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
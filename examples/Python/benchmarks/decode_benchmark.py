@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+'''
+Microbenchmark of the json decoders available to the client library on
+pointer payloads. Compares the standard library, orjson and ujson (if
+installed), the PointerParser fast path for a few field subscriptions and
+the full PointerFrame decoding.
+
+Usage: decode_benchmark.py [payload_file] [iterations]
+
+payload_file holds one pointer datagram per line, without it a set of
+sample payloads in the format sent by the AirPointr service is used.
+
+@package decode_benchmark
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "client_library"))
+import airpointr
+
+SAMPLE_PAYLOADS = [
+    # idle pointer
+    b'{"type": "pointer", "x": 0.512734, "y": 0.498211, "active": false, '
+    b'"events": [], "circle": {"active": false, "direction": 0, '
+    b'"segment": 0, "turns": 0.0, "smart": {"enabled": true, '
+    b'"actionSelect": false, "actionSegment": 0}}, "license": "demo"}',
+    # moving pointer
+    b'{"type": "pointer", "x": 0.304117, "y": 0.671502, "active": true, '
+    b'"events": [], "circle": {"active": false, "direction": 0, '
+    b'"segment": 0, "turns": 0.0, "smart": {"enabled": true, '
+    b'"actionSelect": false, "actionSegment": 0}}, "license": "licensed"}',
+    # right swipe
+    b'{"type": "pointer", "x": 0.884012, "y": 0.512873, "active": true, '
+    b'"events": ["rwipe"], "circle": {"active": false, "direction": 0, '
+    b'"segment": 0, "turns": 0.0, "smart": {"enabled": true, '
+    b'"actionSelect": false, "actionSegment": 0}}, "license": "licensed"}',
+    # circle turning clockwise
+    b'{"type": "pointer", "x": 0.455001, "y": 0.401877, "active": true, '
+    b'"events": [], "circle": {"active": true, "direction": 1, '
+    b'"segment": 5, "turns": 2.375, "smart": {"enabled": true, '
+    b'"actionSelect": false, "actionSegment": 0}}, "license": "licensed"}',
+    # smart circle selection
+    b'{"type": "pointer", "x": 0.498732, "y": 0.212093, "active": true, '
+    b'"events": [], "circle": {"active": true, "direction": 0, '
+    b'"segment": 0, "turns": 0.25, "smart": {"enabled": true, '
+    b'"actionSelect": true, "actionSegment": 0}}, "license": "licensed"}',
+]
+
+SUBSCRIPTIONS = [
+    ('x', 'y'),
+    ('events', 'circle.smart.actionSelect', 'circle.smart.actionSegment'),
+    ('circle.active', 'circle.direction', 'circle.segment', 'circle.turns'),
+    airpointr.POINTER_FIELDS,
+]
+
+def load_payloads(path):
+    """
+    reads one datagram per line from path
+    """
+    with open(path, 'rb') as f:
+        return [l.strip() for l in f if l.strip()]
+
+def measure(func, payloads, iterations):
+    """
+    returns the best time per payload in microseconds
+    """
+    def run():
+        for p in payloads:
+            func(p)
+    best = min(timeit.repeat(run, number = iterations, repeat = 5))
+    return best / (iterations * len(payloads)) * 1e6
+
+def main():
+    payloads = SAMPLE_PAYLOADS
+    iterations = 2000
+    if len(sys.argv) > 1:
+        payloads = load_payloads(sys.argv[1])
+    if len(sys.argv) > 2:
+        iterations = int(sys.argv[2])
+
+    candidates = []
+    for name in sorted(airpointr.DECODERS):
+        candidates.append(("loads " + name, airpointr.DECODERS[name]))
+    for fields in SUBSCRIPTIONS:
+        label = "all fields" if fields is airpointr.POINTER_FIELDS \
+                else ",".join(fields)
+        candidates.append(("PointerParser " + label,
+                           airpointr.PointerParser(fields).parse))
+    candidates.append(("PointerFrame (" + airpointr.decoder_name + ")",
+                       lambda p: airpointr.PointerFrame.from_message(
+                           airpointr.loads(p))))
+
+    print("%d payloads, %d iterations, %s" % (len(payloads), iterations,
+                                              sys.version.split()[0]))
+    print("%-76s %10s %12s" % ("decoder", "us/frame", "frames/s"))
+    for label, func in candidates:
+        us = measure(func, payloads, iterations)
+        print("%-76s %10.2f %12.0f" % (label, us, 1e6 / us))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+'''
+Benchmark of the pointer wire formats: bytes on the wire and decode time
+per frame of the json messages of the service and of the binary frames of
+airpointr_wire, decoded to a message and to a PointerFrame.
+
+Usage: wire_benchmark.py [payload_file] [iterations]
+
+payload_file holds one pointer datagram per line, without it the sample
+payloads of decode_benchmark are used.
+
+@package wire_benchmark
+'''
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "client_library"))
+import airpointr
+import airpointr_wire
+
+from decode_benchmark import SAMPLE_PAYLOADS, load_payloads, measure
+
+def main():
+    payloads = SAMPLE_PAYLOADS
+    iterations = 2000
+    if len(sys.argv) > 1:
+        payloads = load_payloads(sys.argv[1])
+    if len(sys.argv) > 2:
+        iterations = int(sys.argv[2])
+
+    messages = [json.loads(p) for p in payloads]
+    compact = [json.dumps(j, separators = (',', ':')).encode()
+               for j in messages]
+    binary = [airpointr_wire.encode(j, airpointr_wire.BINARY)
+              for j in messages]
+    fallbacks = sum(1 for b in binary if not airpointr_wire.is_binary(b))
+
+    print("%d payloads, %d iterations, %s" % (len(payloads), iterations,
+                                              sys.version.split()[0]))
+    if fallbacks:
+        print("%d payloads cannot be sent binary and stay json" % fallbacks)
+    print("%-40s %10s" % ("format", "bytes/frame"))
+    for label, datagrams in (("json as sent", payloads),
+                             ("json compact", compact),
+                             (airpointr_wire.BINARY, binary)):
+        print("%-40s %10.1f" % (label, sum(len(d) for d in datagrams)
+                                       / float(len(datagrams))))
+    print("")
+
+    candidates = []
+    for name in sorted(airpointr.DECODERS):
+        candidates.append(("json loads " + name, payloads,
+                           airpointr.DECODERS[name]))
+    candidates.append(("json PointerFrame (" + airpointr.decoder_name + ")",
+                       payloads, lambda p: airpointr.PointerFrame.from_message(
+                           airpointr.loads(p))))
+    candidates.append((airpointr_wire.BINARY + " unpack", binary,
+                       airpointr_wire.unpack))
+    candidates.append((airpointr_wire.BINARY + " decode", binary,
+                       airpointr_wire.decode))
+    candidates.append((airpointr_wire.BINARY + " decode_frame", binary,
+                       airpointr_wire.decode_frame))
+    candidates.append((airpointr_wire.BINARY + " encode", messages,
+                       airpointr_wire.encode))
+
+    print("%-40s %10s %12s" % ("operation", "us/frame", "frames/s"))
+    for label, datagrams, func in candidates:
+        us = measure(func, datagrams, iterations)
+        print("%-40s %10.2f %12.0f" % (label, us, 1e6 / us))
+
+if __name__ == "__main__":
+    main()
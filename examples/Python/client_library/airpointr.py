@@ -1,15 +1,663 @@
-import asyncore
+try:
+    import asyncore
+except ImportError:
+    # asyncore is gone since Python 3.12, use airpointr_asyncio there
+    asyncore = None
+import heapq
 import json
+import logging
+import re
 import socket
+import sys
 import time
 
-def loop():
+_dispatcher = getattr(asyncore, 'dispatcher', object)
+_dispatcher_with_send = getattr(asyncore, 'dispatcher_with_send', object)
+
+log = logging.getLogger('airpointr')
+
+SERVICE_TIMEOUT = 10
+'''
+Seconds after which a service that stopped sending discovery messages is
+removed from the services dictionary.
+'''
+
+HEARTBEAT_INTERVAL = 5
+'''
+Seconds between two heart beat messages sent to a gesture service.
+'''
+
+VALID_LICENSES = (u'demo', u'licensed')
+'''
+License states of a service that deliver valid pointer output.
+'''
+
+_EMPTY_EVENTS = re.compile(br'"events"\s*:\s*\[\s*\]')
+_ACTION_SELECT = re.compile(br'"actionSelect"\s*:\s*true')
+
+def _available_decoders():
+    '''
+    Collect the json decoders that can be imported, fastest first.
+    '''
+    decoders = []
+    try:
+        import orjson
+        decoders.append(('orjson', orjson.loads))
+    except ImportError:
+        pass
+    try:
+        import ujson
+        decoders.append(('ujson', ujson.loads))
+    except ImportError:
+        pass
+    decoders.append(('json', json.loads))
+    return decoders
+
+_decoders = _available_decoders()
+
+DECODERS = dict(_decoders)
+'''
+Available json decoders by name.
+'''
+
+decoder_name, loads = _decoders[0]
+'''
+Name and loads function of the json decoder used for every datagram,
+orjson or ujson if installed and the standard library otherwise.
+'''
+
+def set_decoder(name):
+    '''
+    Select the json decoder by name, see DECODERS.
+    '''
+    global decoder_name, loads
+    if name not in DECODERS:
+        raise ValueError('json decoder %r is not available' % name)
+    decoder_name = name
+    loads = DECODERS[name]
+
+monotonic = time.monotonic
+'''
+Clock of all deadlines, heart beats and expiry in seconds. Unlike
+time.time() it never jumps, and unlike the old time.clock() it keeps
+running while the process sleeps.
+'''
+
+try:
+    perf_ns = time.perf_counter_ns
+except AttributeError:
+    # Python < 3.7
+    def perf_ns():
+        return int(time.perf_counter() * 1000000000)
+'''
+High resolution clock in integer nanoseconds for latency stamps.
+'''
+
+class Timer(object):
+    '''
+    Handle of a callback scheduled with Scheduler.call_later or
+    Scheduler.call_every.
+    '''
+
+    __slots__ = ('deadline', 'interval', 'func', 'args', 'cancelled')
+
+    def __init__(self, deadline, interval, func, args):
+        '''
+
+        '''
+        self.deadline = deadline
+        self.interval = interval
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        '''
+        Do not run the callback any more.
+        '''
+        self.cancelled = True
+
+class Scheduler(object):
     '''
-    Let asyncore do its job.
+    Timer heap that runs inside the receive loop of the client. Instead of
+    starting a thread per timer, the loop waits for datagrams at most until
+    the next deadline and then calls run_pending. Heart beats, service
+    expiry and reconnects are all driven from here, so they never race with
+    the datagram handlers.
     '''
-    asyncore.loop()
 
-class GestureListener(asyncore.dispatcher_with_send):
+    def __init__(self, clock = monotonic):
+        '''
+
+        '''
+        self.clock = clock
+        self._heap = []
+        self._seq = 0
+
+    def _push(self, timer):
+        self._seq += 1
+        heapq.heappush(self._heap, (timer.deadline, self._seq, timer))
+        return timer
+
+    def call_later(self, delay, func, *args):
+        '''
+        Call func(*args) once after delay seconds.
+        '''
+        return self._push(Timer(self.clock() + delay, None, func, args))
+
+    def call_every(self, interval, func, *args, **kwargs):
+        '''
+        Call func(*args) every interval seconds, the first time after the
+        keyword argument delay (default 0, i.e. on the next run_pending).
+        '''
+        if interval <= 0:
+            raise ValueError('interval must be positive, not %r' % interval)
+        delay = kwargs.get('delay', 0)
+        return self._push(Timer(self.clock() + delay, interval, func, args))
+
+    def timeout(self):
+        '''
+        Seconds until the next deadline, None if nothing is scheduled.
+        '''
+        heap = self._heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        return max(0.0, heap[0][0] - self.clock())
+
+    def run_pending(self):
+        '''
+        Run all callbacks whose deadline has passed.
+        '''
+        heap = self._heap
+        now = self.clock()
+        while heap and heap[0][0] <= now:
+            timer = heapq.heappop(heap)[2]
+            if timer.cancelled:
+                continue
+            if timer.interval != None:
+                # keep the schedule, but do not catch up on missed runs: the
+                # next run is always after this pass
+                timer.deadline += timer.interval
+                if timer.deadline <= now:
+                    timer.deadline = now + timer.interval
+                self._push(timer)
+            try:
+                timer.func(*timer.args)
+            except:
+                log.exception("timer %r failed", timer.func)
+
+scheduler = Scheduler()
+'''
+Default scheduler of the listeners, loop and recvfrom.
+'''
+
+def loop(sched = None):
+    '''
+    Let asyncore do its job, waking up for the timers of the scheduler.
+    '''
+    if asyncore is None:
+        raise RuntimeError('asyncore is not available, use airpointr_asyncio')
+    if sched == None:
+        sched = scheduler
+    while asyncore.socket_map:
+        t = sched.timeout()
+        asyncore.loop(timeout = 30.0 if t == None else t, count = 1)
+        sched.run_pending()
+
+def recvfrom(sock, bufsize, sched = None):
+    '''
+    Blocking sock.recvfrom(bufsize) for the plain socket loops of the
+    scripts, that runs the timers of the scheduler while waiting.
+    '''
+    if sched == None:
+        sched = scheduler
+    while True:
+        sched.run_pending()
+        sock.settimeout(sched.timeout())
+        try:
+            return sock.recvfrom(bufsize)
+        except (socket.timeout, BlockingIOError):
+            # a timer already due gives a timeout of 0, which makes the
+            # socket non-blocking: nothing queued raises BlockingIOError
+            pass
+
+def is_pointer_message(j):
+    '''
+    True if the parsed message j carries pointer data.
+    '''
+    return j.get(u'type') == u'pointer'
+
+def is_plain_pointer_datagram(data):
+    '''
+    True if the raw datagram is a pointer frame without discrete input, i.e.
+    without events and without smart circle action selection. Such frames
+    only carry an absolute cursor state and may be dropped unparsed if a
+    newer frame is available.
+    '''
+    return (_EMPTY_EVENTS.search(data) != None and
+            _ACTION_SELECT.search(data) == None)
+
+def merge_pointer_messages(j, events, select):
+    '''
+    Merge the discrete input of dropped pointer messages into j: events is
+    the list of all their events, select the smart circle dictionary of the
+    newest one that selected an action (or None).
+    '''
+    j[u'events'] = events
+    circle = j.get(u'circle')
+    if select != None and circle != None:
+        smart = circle.get(u'smart')
+        if smart == None:
+            circle[u'smart'] = dict(select)
+        elif not smart.get(u'actionSelect'):
+            smart[u'actionSelect'] = True
+            smart[u'actionSegment'] = select.get(u'actionSegment', 0)
+    return j
+
+class SmartCircleState(object):
+    '''
+    State of the smart circle.
+    '''
+
+    __slots__ = ('enabled', 'action_select', 'action_segment')
+
+    def __init__(self, enabled = False, action_select = False,
+                 action_segment = 0):
+        '''
+
+        '''
+        self.enabled = enabled
+        self.action_select = action_select
+        self.action_segment = action_segment
+
+    @classmethod
+    def from_message(cls, s):
+        '''
+        Build the state out of the "smart" dictionary of a pointer message.
+        '''
+        if s == None:
+            return cls()
+        return cls(s[u'enabled'], s[u'actionSelect'], s[u'actionSegment'])
+
+    def __repr__(self):
+        return ('SmartCircleState(enabled=%r, action_select=%r, '
+                'action_segment=%r)' % (self.enabled, self.action_select,
+                                        self.action_segment))
+
+class CircleState(object):
+    '''
+    State of the circle gesture.
+    '''
+
+    __slots__ = ('active', 'direction', 'segment', 'turns', 'smart')
+
+    def __init__(self, active = False, direction = 0, segment = 0, turns = 0,
+                 smart = None):
+        '''
+
+        '''
+        self.active = active
+        self.direction = direction
+        self.segment = segment
+        self.turns = turns
+        self.smart = smart if smart != None else SmartCircleState()
+
+    @classmethod
+    def from_message(cls, c):
+        '''
+        Build the state out of the "circle" dictionary of a pointer message.
+        '''
+        if c == None:
+            return cls()
+        return cls(c[u'active'], c[u'direction'], c[u'segment'], c[u'turns'],
+                   SmartCircleState.from_message(c.get(u'smart')))
+
+    def __repr__(self):
+        return ('CircleState(active=%r, direction=%r, segment=%r, turns=%r, '
+                'smart=%r)' % (self.active, self.direction, self.segment,
+                               self.turns, self.smart))
+
+class PointerFrame(object):
+    '''
+    One pointer message, decoded once per datagram and shared by every
+    handler. events is a tuple of event names, e.g. (u'rwipe',), recv_ns
+    the perf_ns() stamp of the reception of the datagram (or None).
+    '''
+
+    __slots__ = ('x', 'y', 'active', 'events', 'license', 'circle', 'recv_ns')
+
+    def __init__(self, x = 0.0, y = 0.0, active = False, events = (),
+                 license = None, circle = None, recv_ns = None):
+        '''
+
+        '''
+        self.x = x
+        self.y = y
+        self.active = active
+        self.events = events
+        self.license = license
+        self.circle = circle if circle != None else CircleState()
+        self.recv_ns = recv_ns
+
+    @classmethod
+    def from_message(cls, j, recv_ns = None):
+        '''
+        Build the frame out of a parsed pointer message.
+        '''
+        return cls(j[u'x'], j[u'y'], j[u'active'], tuple(j[u'events']),
+                   j.get(u'license'), CircleState.from_message(j.get(u'circle')),
+                   recv_ns)
+
+    @classmethod
+    def from_fields(cls, r, recv_ns = None):
+        '''
+        Build the frame out of the fields extracted by a PointerParser of
+        all POINTER_FIELDS.
+        '''
+        smart = SmartCircleState(r['circle.smart.enabled'],
+                                 r['circle.smart.actionSelect'],
+                                 r['circle.smart.actionSegment'])
+        circle = CircleState(r['circle.active'], r['circle.direction'],
+                             r['circle.segment'], r['circle.turns'], smart)
+        return cls(r['x'], r['y'], r['active'], tuple(r['events']),
+                   r['license'], circle, recv_ns)
+
+    @property
+    def licensed(self):
+        '''
+        True if the service license allows to use the pointer output.
+        '''
+        return self.license in VALID_LICENSES
+
+    @property
+    def engaged(self):
+        '''
+        True if someone is gesturing: the pointer or the circle is active or
+        the frame carries events or a smart circle selection.
+        '''
+        circle = self.circle
+        return bool(self.active or circle.active or self.events or
+                    circle.smart.action_select)
+
+    def __repr__(self):
+        return ('PointerFrame(x=%r, y=%r, active=%r, events=%r, license=%r, '
+                'circle=%r, recv_ns=%r)' % (self.x, self.y, self.active,
+                                            self.events, self.license,
+                                            self.circle, self.recv_ns))
+
+POINTER_FIELDS = ('x', 'y', 'active', 'events', 'license',
+                  'circle.active', 'circle.direction', 'circle.segment',
+                  'circle.turns', 'circle.smart.enabled',
+                  'circle.smart.actionSelect', 'circle.smart.actionSegment')
+'''
+Fields of a pointer message that PointerParser can extract.
+'''
+
+_POINTER_TYPE = re.compile(br'"type"\s*:\s*"pointer"')
+_CIRCLE = re.compile(br'"circle"\s*:\s*\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}')
+_VALUE = br'\s*:\s*(-?[0-9][0-9.eE+-]*|true|false|null|"[^"\\]*"|\[[^\]]*\])'
+
+def _value(raw):
+    '''
+    Convert a raw json scalar or flat array matched by _VALUE.
+    '''
+    c = raw[:1]
+    if c == b't':
+        return True
+    if c == b'f':
+        return False
+    if c == b'n':
+        return None
+    if c == b'"':
+        return raw[1:-1].decode('utf-8')
+    if c == b'[':
+        if raw.strip(b'[ \t\r\n]') == b'':
+            return []
+        return loads(raw)
+    if b'.' in raw or b'e' in raw or b'E' in raw:
+        return float(raw)
+    return int(raw)
+
+class PointerParser(object):
+    '''
+    Schema aware parser that extracts only the subscribed fields of a pointer
+    message from the raw datagram, without building the whole json document.
+
+    fields are dotted paths out of POINTER_FIELDS. parse returns a
+    dictionary keyed by these paths, or None if the datagram is no pointer
+    message. Apart from "active", which exists on the top level and in the
+    circle object, every key of a pointer message is unique, so most fields
+    are found with a single search. Datagrams that do not look as expected
+    are parsed with the regular json decoder.
+    '''
+
+    __slots__ = ('fields', '_unique', '_active', '_circle_active')
+
+    def __init__(self, fields = POINTER_FIELDS):
+        '''
+
+        '''
+        for f in fields:
+            if f not in POINTER_FIELDS:
+                raise ValueError('unknown pointer field %r' % f)
+        self.fields = tuple(fields)
+        self._unique = []
+        self._active = None
+        self._circle_active = None
+        for f in self.fields:
+            key = f.rsplit('.', 1)[-1]
+            pattern = re.compile(b'"' + key.encode('ascii') + b'"' + _VALUE)
+            if f == 'active':
+                self._active = pattern
+            elif f == 'circle.active':
+                self._circle_active = pattern
+            else:
+                self._unique.append((f, pattern))
+
+    def parse(self, data):
+        '''
+        Extract the subscribed fields of the pointer message in data.
+        '''
+        if _POINTER_TYPE.search(data) == None:
+            return None
+        r = {}
+        for f, pattern in self._unique:
+            m = pattern.search(data)
+            if m == None:
+                return self.parse_slow(data)
+            r[f] = _value(m.group(1))
+        if self._active != None or self._circle_active != None:
+            c = _CIRCLE.search(data)
+            if c == None:
+                return self.parse_slow(data)
+            start, end = c.span()
+            if self._active != None:
+                m = self._active.search(data, 0, start)
+                if m == None:
+                    m = self._active.search(data, end)
+                    if m == None:
+                        return self.parse_slow(data)
+                r['active'] = _value(m.group(1))
+            if self._circle_active != None:
+                m = self._circle_active.search(data, start, end)
+                if m == None:
+                    return self.parse_slow(data)
+                r['circle.active'] = _value(m.group(1))
+        return r
+
+    def parse_slow(self, data):
+        '''
+        Extract the subscribed fields after decoding the whole message.
+        '''
+        j = loads(data)
+        if not is_pointer_message(j):
+            return None
+        r = {}
+        for f in self.fields:
+            v = j
+            for k in f.split('.'):
+                v = v[k]
+            r[f] = v
+        return r
+
+_frame_parser = PointerParser()
+
+def service_from_discovery(j, ip):
+    '''
+    Build a service dictionary out of the parsed discovery message j
+    received from ip. Returns None if the message is not a discovery message
+    or the service does not offer an UDP port.
+    '''
+    if j.get(u'type') != u'discovery':
+        return None
+    # we only support UDP connects in our client library
+    # find UDP port
+    for u in j[u'services']:
+        if u.startswith(u'udp:'):
+            return { 'hostname': j[u'hostname'],
+                     'port': int(u[4:]),
+                     'host': ip }
+    return None
+
+class ServiceRegistry(object):
+    '''
+    Known AirPointr services keyed by host address. Expiry deadlines are
+    kept in a min-heap with at most one entry per service, so neither
+    lookups nor expiry scan all services, and refreshing a service on every
+    frame only stores its time. Listeners are called with the list of services only when the set of
+    services changes, not on every discovery message.
+
+    Services are dictionaries with at least the keys host, port and time
+    (time of the last message). Callers may store their own keys in them.
+    '''
+
+    services = None
+    '''
+    Services dictionary.
+    '''
+
+    def __init__(self, timeout = SERVICE_TIMEOUT, listener = None,
+                 clock = monotonic):
+        '''
+
+        '''
+        self.timeout = timeout
+        self.clock = clock
+        self.services = {}
+        self.listeners = []
+        if listener != None:
+            self.listeners.append(listener)
+        # (deadline, host) entries, pushed again in expire if the service
+        # was refreshed meanwhile
+        self._deadlines = []
+        self._queued = set()
+        self._pinned = set()
+
+    def __len__(self):
+        return len(self.services)
+
+    def __contains__(self, host):
+        return host in self.services
+
+    def __iter__(self):
+        return iter(list(self.services.values()))
+
+    def values(self):
+        '''
+        List of all services.
+        '''
+        return list(self.services.values())
+
+    def get(self, host):
+        '''
+        Service of host or None.
+        '''
+        return self.services.get(host)
+
+    def notify(self):
+        '''
+        Tell all listeners about the current list.
+        '''
+        l = self.values()
+        for listener in self.listeners:
+            listener(l)
+
+    def update(self, service, expires = True):
+        '''
+        Add or refresh a service, returns True if it was not known before.
+        Services added with expires = False are never expired.
+        '''
+        host = service['host']
+        known = self.services.get(host)
+        ts = self.clock()
+        if known == None:
+            service['time'] = ts
+            self.services[host] = service
+            changed = True
+        else:
+            changed = (known.get('port') != service.get('port') or
+                       known.get('hostname') != service.get('hostname'))
+            known.update(service)
+            known['time'] = ts
+        if expires:
+            self._pinned.discard(host)
+            self._queue(host, ts)
+        else:
+            self._pinned.add(host)
+        if changed:
+            self.notify()
+        return known == None
+
+    def touch(self, host):
+        '''
+        Refresh a known service, e.g. on a pointer message, returns it or
+        None if host is not known.
+        '''
+        service = self.services.get(host)
+        if service != None:
+            service['time'] = self.clock()
+        return service
+
+    def _queue(self, host, ts):
+        if host not in self._queued:
+            self._queued.add(host)
+            heapq.heappush(self._deadlines, (ts + self.timeout, host))
+
+    def remove(self, host):
+        '''
+        Forget a service.
+        '''
+        self._pinned.discard(host)
+        if self.services.pop(host, None) != None:
+            self.notify()
+
+    def expire(self):
+        '''
+        Remove all services whose deadline has passed, returns True if any
+        was removed.
+        '''
+        deadlines = self._deadlines
+        ts = self.clock()
+        removed = False
+        while deadlines and deadlines[0][0] < ts:
+            deadline, host = heapq.heappop(deadlines)
+            self._queued.discard(host)
+            service = self.services.get(host)
+            if service == None or host in self._pinned:
+                continue
+            if service['time'] + self.timeout >= ts:
+                # refreshed since the entry was pushed
+                self._queue(host, service['time'])
+                continue
+            del self.services[host]
+            removed = True
+        if removed:
+            self.notify()
+        return removed
+
+class GestureListener(_dispatcher_with_send):
     '''
     '''
 
@@ -27,11 +675,83 @@ class GestureListener(asyncore.dispatcher_with_send):
     Last heart beat.
     '''
 
-    def __init__(self, handler, service = None, host = None, port = 8981):
+    drain = False
+    '''
+    Drain mode, if set all queued datagrams are read in one burst and the
+    handler is called once per wakeup with the list of pointer messages.
+    '''
+
+    max_batch = 64
+    '''
+    Maximum number of datagrams read in one burst in drain mode.
+    '''
+
+    coalesce = False
+    '''
+    Latest wins mode, if set all queued datagrams are read in one burst and
+    only the newest pointer message is delivered. Events and smart circle
+    action selections of the dropped messages are merged into it.
+    '''
+
+    coalesced = 0
+    '''
+    Number of pointer messages dropped in latest wins mode.
+    '''
+
+    received = 0
+    '''
+    Number of datagrams received.
+    '''
+
+    decode_errors = 0
+    '''
+    Number of datagrams that could not be parsed.
+    '''
+
+    heartbeats = 0
+    '''
+    Number of heart beats sent.
+    '''
+
+    typed = False
+    '''
+    If set the handler is called with PointerFrame objects instead of the
+    parsed json.
+    '''
+
+    fast_parse = False
+    '''
+    If set together with typed, the fields of the PointerFrame are
+    extracted from the datagrams by a PointerParser, without decoding the
+    whole json document. Not used in latest wins mode, which merges the
+    messages.
+    '''
+
+    heartbeat_timer = None
+    '''
+    Scheduler timer sending the heart beats.
+    '''
+
+    recorder = None
+    '''
+    If set every received datagram is passed to its record method, see
+    airpointr_record.Recorder.
+    '''
+
+    stats = None
+    '''
+    If set the decode and handler latencies of every burst or datagram are
+    recorded to it, see airpointr_stats.LatencyStats.
+    '''
+
+    def __init__(self, handler, service = None, host = None, port = 8981,
+                 drain = False, max_batch = 64, coalesce = False,
+                 typed = False, sched = None, recorder = None, stats = None,
+                 fast_parse = False):
         '''
 
         '''
-        asyncore.dispatcher_with_send.__init__(self)        
+        _dispatcher_with_send.__init__(self)
         self.create_socket(socket.AF_INET, socket.SOCK_DGRAM)
         if service != None:
             self.service = (service['host'], service['port'])
@@ -39,39 +759,522 @@ class GestureListener(asyncore.dispatcher_with_send):
             self.service = (host, port)
         self.connect(self.service)
         self.listener = handler
-        self.send_heartbeat(time.clock())
+        self.drain = drain
+        self.max_batch = max(1, max_batch)
+        self.coalesce = coalesce
+        self.typed = typed
+        self.fast_parse = fast_parse
+        self.recorder = recorder
+        self.stats = stats
+        if sched == None:
+            sched = scheduler
+        self.send_heartbeat()
+        self.heartbeat_timer = sched.call_every(HEARTBEAT_INTERVAL,
+                                                self.send_heartbeat,
+                                                delay = HEARTBEAT_INTERVAL)
 
-    def send_heartbeat(self, tmr):
+    def send_heartbeat(self, tmr = None):
         '''
         Send heart beat message to service.
         '''
-        self.sendto('register', self.service)
-        self.last_heartbeat = tmr
+        self.socket.sendto(b'register', self.service)
+        self.heartbeats += 1
+        self.last_heartbeat = monotonic() if tmr == None else tmr
 
     def handle_read(self):
         '''
 
         '''
-        data = self.recv(2048)
+        stats = self.stats
+        if self.coalesce:
+            burst = self.recv_burst()
+            t = perf_ns()
+            j = self.coalesce_burst(burst)
+            if j != None:
+                j = self.convert(j, t)
+            if j != None:
+                if stats != None:
+                    stats.stamp('decode', t)
+                self.deliver([j] if self.drain else j)
+                if stats != None:
+                    stats.stamp('handler', t)
+        elif self.drain:
+            burst = self.recv_burst()
+            t = perf_ns()
+            batch = []
+            for data in burst:
+                j = self.parse(data, t)
+                if j != None:
+                    batch.append(j)
+            if batch:
+                if stats != None:
+                    stats.stamp('decode', t)
+                self.deliver(batch)
+                if stats != None:
+                    stats.stamp('handler', t)
+        else:
+            data = self.recv(2048)
+            t = perf_ns()
+            self.received += 1
+            if self.recorder != None:
+                self.recorder.record(data, self.service)
+            j = self.parse(data, t)
+            if j != None:
+                if stats != None:
+                    stats.stamp('decode', t)
+                self.deliver(j)
+                if stats != None:
+                    stats.stamp('handler', t)
+
+    def deliver(self, item):
+        '''
+        Call the handler. An exception it raises is logged, it must not reach
+        asyncore, which would close the listener for good.
+        '''
         try:
-            j = json.loads(data)
-            if j.has_key(u'type'):
-                if j[u'type'] == u'pointer':
-                    self.listener(j)
+            self.listener(item)
+        except Exception:
+            log.exception("gesture handler failed")
+
+    def recv_burst(self):
+        '''
+        Read all queued datagrams, up to max_batch, without blocking.
+        '''
+        burst = [self.recv(2048)]
+        while len(burst) < self.max_batch:
+            try:
+                burst.append(self.socket.recv(2048))
+            except OSError:
+                # nothing queued any more, errors are reported by the next
+                # regular read
+                break
+        self.received += len(burst)
+        if self.recorder != None:
+            for data in burst:
+                self.recorder.record(data, self.service)
+        return burst
+
+    def coalesce_burst(self, burst):
+        '''
+        Reduce a burst of datagrams to the newest pointer message. Frames
+        without discrete input are not parsed unless they are the newest.
+        '''
+        j = None
+        pending = None
+        received = 0
+        events = []
+        select = None
+        for data in burst:
+            if is_plain_pointer_datagram(data):
+                pending = data
+                received += 1
+                continue
+            m = self.decode(data)
+            if m == None:
+                continue
+            j = m
+            pending = None
+            received += 1
+            # circle and smart are optional, see CircleState
+            events.extend(m.get(u'events') or ())
+            smart = (m.get(u'circle') or {}).get(u'smart')
+            if smart and smart.get(u'actionSelect'):
+                select = smart
+        if pending != None:
+            m = self.decode(pending)
+            if m != None:
+                j = m
+        if j == None:
+            return None
+        self.coalesced += received - 1
+        return merge_pointer_messages(j, events, select)
+
+    def decode(self, data):
+        '''
+        Parse a datagram, returns the message if it carries pointer data.
+        '''
+        try:
+            j = loads(data)
+            if is_pointer_message(j):
+                return j
         except:
-            import sys
-            print sys.exc_info()
+            self.decode_errors += 1
+            log.warning("invalid datagram: %r", sys.exc_info()[1])
+        return None
 
-        t = time.time()
-        if t > self.last_heartbeat + 5:
-            self.send_heartbeat(t)
+    def parse(self, data, recv_ns = None):
+        '''
+        What the handler expects of a datagram, None if it carries no
+        pointer data.
+        '''
+        if self.fast_parse and self.typed and data[:1] == b'{':
+            try:
+                r = _frame_parser.parse(data)
+                if r != None:
+                    return PointerFrame.from_fields(r, recv_ns)
+            except (KeyError, TypeError, ValueError):
+                # e.g. no smart circle, decode tells if it is valid at all
+                pass
+        j = self.decode(data)
+        if j == None:
+            return None
+        return self.convert(j, recv_ns)
+
+    def convert(self, j, recv_ns = None):
+        '''
+        Turn a pointer message into what the handler expects, returns None
+        if it lacks fields of a PointerFrame.
+        '''
+        if not self.typed:
+            return j
+        try:
+            return PointerFrame.from_message(j, recv_ns)
+        except (KeyError, TypeError, ValueError):
+            # like a datagram that is no json, it must not reach asyncore
+            self.decode_errors += 1
+            log.warning("invalid pointer message: %r", sys.exc_info()[1])
+        return None
 
     def unregister(self):
         '''
         '''
-        self.sendto('unregister', self.service)
+        self.socket.sendto(b'unregister', self.service)
+
+    def close(self):
+        '''
+        Stop the heart beats and close the socket.
+        '''
+        if self.heartbeat_timer != None:
+            self.heartbeat_timer.cancel()
+            self.heartbeat_timer = None
+        _dispatcher_with_send.close(self)
 
-class DiscoveryListener(asyncore.dispatcher):
+class SourceState(object):
+    '''
+    Pointer input state of one gesture service.
+    '''
+
+    def __init__(self, address):
+        '''
+
+        '''
+        self.address = address
+        self.frame = None
+        self.frames = 0
+        self.last_seen = None
+        self.last_engaged = None
+
+    def update(self, frame, now):
+        '''
+        Take the newest frame of the service, received at now.
+        '''
+        self.frame = frame
+        self.frames += 1
+        self.last_seen = now
+        if frame.engaged:
+            self.last_engaged = now
+
+    def __repr__(self):
+        return 'SourceState(address=%r, frames=%r)' % (self.address,
+                                                      self.frames)
+
+class SourceArbiter(object):
+    '''
+    Decides which of several gesture services is in control, e.g. several
+    cameras looking at the same room.
+
+    The service in control keeps it while someone gestures in front of it
+    and for handover seconds after. Then, or when it stopped sending, the
+    next service with an engaged frame takes over. Looking up the state of a
+    service is one dictionary access, however many services there are.
+    '''
+
+    def __init__(self, handover = 0.5, timeout = SERVICE_TIMEOUT,
+                 clock = monotonic):
+        '''
+
+        '''
+        self.handover = handover
+        self.timeout = timeout
+        self.clock = clock
+        self.sources = {}
+        self.current = None
+        self.switches = 0
+
+    def update(self, address, frame):
+        '''
+        Record a frame of the service at address, returns True if the
+        service is in control.
+        '''
+        now = self.clock()
+        source = self.sources.get(address)
+        if source == None:
+            source = self.sources[address] = SourceState(address)
+        source.update(frame, now)
+        current = self.current
+        if current is source:
+            return True
+        if not frame.engaged:
+            return False
+        if current == None or now - current.last_seen > self.timeout or \
+           current.last_engaged == None or \
+           now - current.last_engaged >= self.handover:
+            self.current = source
+            self.switches += 1
+            return True
+        return False
+
+    def remove(self, address):
+        '''
+        Forget a service.
+        '''
+        source = self.sources.pop(address, None)
+        if source != None and source is self.current:
+            self.current = None
+
+    def expire(self):
+        '''
+        Forget the services that sent nothing for timeout seconds.
+        '''
+        now = self.clock()
+        for address, source in list(self.sources.items()):
+            if now - source.last_seen > self.timeout:
+                self.remove(address)
+
+SELECT = u'select'
+'''
+Kind of the gestures selecting a smart circle segment.
+'''
+
+GESTURE_REFRACTORY = 0.3
+'''
+Seconds after a gesture in which one of the same kind is taken for a
+repetition of it.
+'''
+
+class Gesture(object):
+    '''
+    One physical gesture: a pointer event, kind is its name e.g. u'rwipe',
+    or the selection of the smart circle segment segment, kind is SELECT.
+    id numbers the gestures of a GestureDebouncer, time is when it was seen.
+    '''
+
+    __slots__ = ('kind', 'segment', 'id', 'time')
+
+    def __init__(self, kind, segment = None, id = 0, time = None):
+        '''
+
+        '''
+        self.kind = kind
+        self.segment = segment
+        self.id = id
+        self.time = time
+
+    def __repr__(self):
+        return 'Gesture(kind=%r, segment=%r, id=%r)' % (self.kind,
+                                                         self.segment, self.id)
+
+class GestureDebouncer(object):
+    '''
+    Turns the pointer frames of one service into gestures, so that every
+    physical gesture is reported exactly once.
+
+    An event or smart circle selection is reported on its rising edge, when
+    it shows up in a frame after one without it, not again in the frames
+    it stays set in. A gesture of the same kind within refractory seconds
+    after the last reported one is dropped as a repetition too, e.g. of a
+    frame sent twice or of frames merged in latest wins mode. Selections of
+    different smart circle segments are different gestures.
+    '''
+
+    def __init__(self, refractory = GESTURE_REFRACTORY, clock = monotonic):
+        '''
+
+        '''
+        self.refractory = refractory
+        self.clock = clock
+        self.count = 0
+        self.suppressed = 0
+        self.events = ()
+        self.selecting = False
+        self.last = {}
+
+    def update(self, frame):
+        '''
+        Take the next frame of the service, returns the list of gestures
+        that started in it.
+        '''
+        now = self.clock()
+        gestures = []
+        for event in frame.events:
+            if event in self.events:
+                self.suppressed += 1
+            else:
+                self._report(gestures, event, None, now)
+        self.events = frame.events
+        smart = frame.circle.smart
+        selecting = smart.enabled and smart.action_select
+        if selecting and not self.selecting:
+            self._report(gestures, SELECT, smart.action_segment, now)
+        elif selecting:
+            self.suppressed += 1
+        self.selecting = selecting
+        return gestures
+
+    def _report(self, gestures, kind, segment, now):
+        key = (kind, segment)
+        last = self.last.get(key)
+        if last != None and now - last < self.refractory:
+            self.suppressed += 1
+            return
+        self.last[key] = now
+        self.count += 1
+        gestures.append(Gesture(kind, segment, self.count, now))
+
+class MultiGestureListener(_dispatcher):
+    '''
+    Receives the pointer input of several gesture services on one socket.
+
+    The listener registers to every service added and keeps all of them
+    alive with one timer. If arbitrate is set, a SourceArbiter decides which
+    service is in control and only its frames are passed on, otherwise the
+    frames of all services are. The handler is called with the pointer
+    message, or PointerFrame if typed is set, and the SourceState of the
+    service it came from.
+    '''
+
+    received = 0
+    '''
+    Number of datagrams received.
+    '''
+
+    decode_errors = 0
+    '''
+    Number of datagrams that could not be parsed.
+    '''
+
+    heartbeats = 0
+    '''
+    Number of heart beats sent.
+    '''
+
+    def __init__(self, handler, services = (), port = 0, typed = False,
+                 arbitrate = True, handover = 0.5, sched = None,
+                 recorder = None):
+        '''
+        services are dictionaries with host and port, like the ones of the
+        DiscoveryListener, port is the local port to receive on.
+        '''
+        _dispatcher.__init__(self)
+        self.create_socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.bind(('', port))
+        self.listener = handler
+        self.typed = typed
+        self.arbitrate = arbitrate
+        self.arbiter = SourceArbiter(handover)
+        self.recorder = recorder
+        self.services = set()
+        for service in services:
+            self.add(service['host'], service['port'])
+        if sched == None:
+            sched = scheduler
+        self.heartbeat_timer = sched.call_every(HEARTBEAT_INTERVAL,
+                                                self.send_heartbeat,
+                                                delay = HEARTBEAT_INTERVAL)
+
+    def add(self, host, port = 8981):
+        '''
+        Register to the service on host:port.
+        '''
+        address = (host, port)
+        if address not in self.services:
+            self.services.add(address)
+            self.socket.sendto(b'register', address)
+            self.heartbeats += 1
+
+    def remove(self, host, port = 8981):
+        '''
+        Unregister from the service on host:port.
+        '''
+        address = (host, port)
+        if address in self.services:
+            self.services.discard(address)
+            self.arbiter.remove(address)
+            self.socket.sendto(b'unregister', address)
+
+    def update_services(self, services):
+        '''
+        Follow a list of services: register to new ones and unregister from
+        the ones no longer listed. Fits as DiscoveryListener handler.
+        '''
+        wanted = set((s['host'], s['port']) for s in services)
+        for address in self.services - wanted:
+            self.remove(*address)
+        for address in wanted - self.services:
+            self.add(*address)
+
+    def send_heartbeat(self, tmr = None):
+        '''
+        Send heart beat messages to all services.
+        '''
+        for address in self.services:
+            self.socket.sendto(b'register', address)
+            self.heartbeats += 1
+        self.arbiter.expire()
+
+    def writable(self):
+        '''
+        The socket is only written by sendto.
+        '''
+        return False
+
+    def handle_read(self):
+        '''
+
+        '''
+        data, addr = self.socket.recvfrom(2048)
+        t = perf_ns()
+        self.received += 1
+        if addr not in self.services:
+            return
+        if self.recorder != None:
+            self.recorder.record(data, addr)
+        try:
+            j = loads(data)
+            if not is_pointer_message(j):
+                return
+            frame = PointerFrame.from_message(j, t)
+        except:
+            # one broken source must not close the socket of all of them
+            self.decode_errors += 1
+            log.warning("invalid datagram from %s:%d: %r", addr[0], addr[1],
+                        sys.exc_info()[1])
+            return
+        if self.arbiter.update(addr, frame) or not self.arbitrate:
+            try:
+                self.listener(frame if self.typed else j,
+                              self.arbiter.sources[addr])
+            except Exception:
+                # must not reach asyncore, which would close the listener
+                log.exception("gesture handler failed")
+
+    def unregister(self):
+        '''
+        Unregister from all services.
+        '''
+        for address in list(self.services):
+            self.remove(*address)
+
+    def close(self):
+        '''
+        Stop the heart beats and close the socket.
+        '''
+        if self.heartbeat_timer != None:
+            self.heartbeat_timer.cancel()
+            self.heartbeat_timer = None
+        _dispatcher.close(self)
+
+class DiscoveryListener(_dispatcher):
     '''
 
     '''
@@ -86,59 +1289,143 @@ class DiscoveryListener(asyncore.dispatcher):
     Listener callback.
     '''
 
-    def __init__(self, handler, host = '', port = 8980):
-        '''
+    expiry_timer = None
+    '''
+    Scheduler timer removing services that went silent.
+    '''
 
+    registry = None
+    '''
+    ServiceRegistry of the discovered services.
+    '''
+
+    def __init__(self, handler, host = '', port = 8980, sched = None):
+        '''
+        handler is called with the list of services whenever a service
+        appears, changes or expires.
         '''
-        asyncore.dispatcher.__init__(self)
+        _dispatcher.__init__(self)
         self.create_socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.set_reuse_addr()
         self.bind((host, port))
-        self.services = {}
         self.listener = handler
+        self.registry = ServiceRegistry(listener = handler)
+        self.services = self.registry.services
+        if sched == None:
+            sched = scheduler
+        self.expiry_timer = sched.call_every(1, self.registry.expire, delay = 1)
+
+    def close(self):
+        '''
+        Stop the expiry timer and close the socket.
+        '''
+        if self.expiry_timer != None:
+            self.expiry_timer.cancel()
+            self.expiry_timer = None
+        _dispatcher.close(self)
 
     def handle_read(self):
         '''
 
         '''
-        data, addr = self.recvfrom(1024)
+        data, addr = self.socket.recvfrom(1024)
 
         try:
-            j = json.loads(data)
+            j = loads(data)
             if j[u'type'] == u'discovery':
-                h = j[u'hostname']
-                # we only support UDP connects in our client library
-                # find UDP port
-                s = j[u'services']
-                p = None
-                for i in range(len(s)):
-                    u = s[i]
-                    if u.startswith(u'udp:'):
-                        p = int(u[4:])
-                        break
-
-                # timestamp
-                ts = time.clock()
-                # update service
-                if p != None:
-                    ip = addr[0]
-                    self.services[ip] = { 'hostname': h,
-                                              'port': p,
-                                              'host': ip,
-                                              'time': ts }
-                # remove all old services
-                del_l = [] # deletion list
-                for kb, vb in self.services.iteritems():
-                    t = vb['time']
-                    if (t + 10) < ts:
-                        del_l.append(kb)
-                for i in range(len(del_l)):
-                    del self.services[del_l[i]]
-
-                # tell about the current list
-                self.listener(self.services.values())
+                # update service, the registry tells about changes
+                s = service_from_discovery(j, addr[0])
+                if s != None:
+                    self.registry.update(s)
         except:
-            import sys
-            print sys.exc_info()
+            log.warning("invalid discovery message: %r", sys.exc_info()[1])
+
+class VolumeController(object):
+    '''
+    Turns the relative volume steps of a circle gesture into absolute volume
+    settings of a player.
+
+    Steps are added to a locally tracked target volume, which is handed to
+    setter at most once per window: the first step after a pause right away,
+    faster steps are summed up and sent when the window is over. So the
+    volume follows the hand without one call per segment, and the result
+    does not depend on the order in which the player answers.
+
+    current returns the volume of the player (or None if unknown). It is
+    only asked before a gesture, i.e. after settle seconds without a change,
+    so that the answer to an earlier set can not move the target back.
+    '''
+
+    window = 0.1
+    '''
+    Minimum seconds between two volume settings.
+    '''
+
+    settle = 1.0
+    '''
+    Seconds without a change after which the player volume is read again.
+    '''
+
+    def __init__(self, setter, current = None, window = 0.1, settle = 1.0,
+                 minimum = 0, maximum = 100, sched = None):
+        '''
+        setter is called with the new volume, an int between minimum and
+        maximum.
+        '''
+        if sched == None:
+            sched = scheduler
+        self.setter = setter
+        self.current = current
+        self.window = window
+        self.settle = settle
+        self.minimum = minimum
+        self.maximum = maximum
+        self.sched = sched
+        self.volume = None
+        self.sent = None
+        self.last_set = None
+        self.set_count = 0
+        self._timer = None
 
+    def _idle(self, now):
+        return self.last_set == None or now - self.last_set >= self.settle
 
+    def change(self, delta):
+        '''
+        Change the target volume by delta, returns the new target or None
+        if the volume of the player is not known.
+        '''
+        now = self.sched.clock()
+        if self.current != None and self._timer == None and \
+           (self.volume == None or self._idle(now)):
+            volume = self.current()
+            if volume != None:
+                self.volume = self.sent = volume
+        if self.volume == None:
+            return None
+        self.volume = int(min(self.maximum,
+                              max(self.minimum, self.volume + delta)))
+        if self._timer == None:
+            if self.last_set == None or now - self.last_set >= self.window:
+                self.flush()
+            else:
+                self._timer = self.sched.call_later(
+                    self.last_set + self.window - now, self.flush)
+        return self.volume
+
+    def flush(self):
+        '''
+        Send the target volume now if it was not sent yet.
+        '''
+        if self._timer != None:
+            self._timer.cancel()
+            self._timer = None
+        if self.volume == None or self.volume == self.sent:
+            return
+        self.sent = self.volume
+        self.last_set = self.sched.clock()
+        self.set_count += 1
+        try:
+            self.setter(self.volume)
+        except:
+            log.exception("setting the volume failed")
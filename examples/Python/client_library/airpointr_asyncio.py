@@ -0,0 +1,356 @@
+'''
+asyncio transport for the AirPointr client library.
+
+Offers the same handler callbacks as airpointr.GestureListener and
+airpointr.DiscoveryListener, but runs inside an asyncio event loop next to
+any other asyncio service. Received datagrams are handed to the handler
+directly from the protocol callback, without any polling timeout in between.
+
+Pointer frames may also be consumed with async for:
+
+    async with open_pointer_stream(host = '127.0.0.1') as stream:
+        async for gesture in stream:
+            print(gesture['x'], gesture['y'])
+'''
+
+import asyncio
+import collections
+import logging
+import socket
+import sys
+
+import airpointr
+
+log = logging.getLogger('airpointr.asyncio')
+
+class GestureProtocol(asyncio.DatagramProtocol):
+    '''
+    Datagram protocol that registers to an AirPointr gesture service, keeps
+    the registration alive and hands every pointer message to the handler.
+    '''
+
+    listener = None
+    '''
+    Gesture listener.
+    '''
+
+    service = None
+    '''
+    Address of the gesture service.
+    '''
+
+    transport = None
+    '''
+    Datagram transport, set once the endpoint is created.
+    '''
+
+    last_heartbeat = None
+    '''
+    Last heart beat.
+    '''
+
+    received = 0
+    '''
+    Number of datagrams received.
+    '''
+
+    decode_errors = 0
+    '''
+    Number of datagrams that could not be parsed.
+    '''
+
+    heartbeats = 0
+    '''
+    Number of heart beats sent.
+    '''
+
+    def __init__(self, handler, service = None, host = None, port = 8981,
+                 heartbeat_interval = airpointr.HEARTBEAT_INTERVAL,
+                 typed = False):
+        '''
+        handler is called with the parsed json of every pointer message, or
+        with an airpointr.PointerFrame if typed is set.
+        '''
+        self.typed = typed
+        if service != None:
+            self.service = (service['host'], service['port'])
+        else:
+            self.service = (host, port)
+        self.listener = handler
+        self.heartbeat_interval = heartbeat_interval
+        self._heartbeat_timer = None
+
+    def connection_made(self, transport):
+        '''
+        Register to the service as soon as the socket is ready.
+        '''
+        self.transport = transport
+        self.send_heartbeat()
+
+    def connection_lost(self, exc):
+        '''
+        Stop sending heart beats.
+        '''
+        if self._heartbeat_timer != None:
+            self._heartbeat_timer.cancel()
+            self._heartbeat_timer = None
+        self.transport = None
+
+    def send_heartbeat(self):
+        '''
+        Send heart beat message to service and schedule the next one.
+        '''
+        self.transport.sendto(b'register')
+        self.heartbeats += 1
+        self.last_heartbeat = airpointr.monotonic()
+        loop = asyncio.get_running_loop()
+        self._heartbeat_timer = loop.call_later(self.heartbeat_interval,
+                                                self.send_heartbeat)
+
+    def datagram_received(self, data, addr):
+        '''
+
+        '''
+        t = airpointr.perf_ns()
+        self.received += 1
+        try:
+            j = airpointr.loads(data)
+            if not airpointr.is_pointer_message(j):
+                return
+            if self.typed:
+                j = airpointr.PointerFrame.from_message(j, t)
+        except:
+            self.decode_errors += 1
+            log.warning("invalid datagram: %r", sys.exc_info()[1])
+            return
+        try:
+            self.listener(j)
+        except Exception:
+            log.exception("gesture handler failed")
+
+    def error_received(self, exc):
+        '''
+        ICMP errors (e.g. service not running yet) are reported but do not
+        close the endpoint, the next heart beat retries the registration.
+        '''
+        log.warning("gesture service %s:%d: %s", self.service[0],
+                    self.service[1], exc)
+
+    def unregister(self):
+        '''
+        '''
+        if self.transport != None:
+            self.transport.sendto(b'unregister')
+
+    def close(self):
+        '''
+        Unregister from the service and close the transport.
+        '''
+        if self.transport != None:
+            self.unregister()
+            self.transport.close()
+
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+    '''
+    Datagram protocol that collects the AirPointr services announced on the
+    discovery port.
+    '''
+
+    services = None
+    '''
+    Services dictionary.
+    '''
+
+    registry = None
+    '''
+    airpointr.ServiceRegistry of the discovered services.
+    '''
+
+    listener = None
+    '''
+    Listener callback.
+    '''
+
+    transport = None
+    '''
+    Datagram transport, set once the endpoint is created.
+    '''
+
+    def __init__(self, handler, expiry_interval = 1):
+        '''
+        handler is called with the list of services whenever a service
+        appears, changes or expires.
+        '''
+        self.listener = handler
+        self.registry = airpointr.ServiceRegistry(listener = handler)
+        self.services = self.registry.services
+        self.expiry_interval = expiry_interval
+        self._expiry_timer = None
+
+    def connection_made(self, transport):
+        '''
+
+        '''
+        self.transport = transport
+        self._expiry_timer = asyncio.get_running_loop().call_later(
+            self.expiry_interval, self.expire)
+
+    def connection_lost(self, exc):
+        '''
+        Stop the expiry timer.
+        '''
+        if self._expiry_timer != None:
+            self._expiry_timer.cancel()
+            self._expiry_timer = None
+        self.transport = None
+
+    def expire(self):
+        '''
+        Remove services that stopped sending discovery messages.
+        '''
+        self.registry.expire()
+        self._expiry_timer = asyncio.get_running_loop().call_later(
+            self.expiry_interval, self.expire)
+
+    def datagram_received(self, data, addr):
+        '''
+
+        '''
+        try:
+            j = airpointr.loads(data)
+            if j[u'type'] == u'discovery':
+                s = airpointr.service_from_discovery(j, addr[0])
+                if s != None:
+                    self.registry.update(s)
+        except:
+            log.warning("invalid discovery message: %r", sys.exc_info()[1])
+
+    def close(self):
+        '''
+
+        '''
+        if self.transport != None:
+            self.transport.close()
+
+async def create_gesture_endpoint(handler, service = None, host = None,
+                                  port = 8981, typed = False):
+    '''
+    Create a datagram endpoint connected to the gesture service and return
+    the (transport, protocol) pair.
+    '''
+    loop = asyncio.get_running_loop()
+    protocol = GestureProtocol(handler, service = service, host = host,
+                               port = port, typed = typed)
+    return await loop.create_datagram_endpoint(
+        lambda: protocol, remote_addr = protocol.service)
+
+async def create_discovery_endpoint(handler, host = '', port = 8980):
+    '''
+    Create a datagram endpoint bound to the discovery port and return the
+    (transport, protocol) pair.
+    '''
+    loop = asyncio.get_running_loop()
+    # several clients on one machine listen for discovery messages, so the
+    # socket is created by hand to set SO_REUSEADDR like asyncore did
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    return await loop.create_datagram_endpoint(
+        lambda: DiscoveryProtocol(handler), sock = sock)
+
+class PointerStream(object):
+    '''
+    Asynchronous iterator over the pointer messages of one gesture service.
+
+    Frames are buffered in a bounded deque, if the consumer falls behind
+    the oldest frames are dropped.
+    '''
+
+    protocol = None
+    '''
+    GestureProtocol feeding the stream.
+    '''
+
+    def __init__(self, maxlen = 64, typed = False):
+        '''
+
+        '''
+        self.typed = typed
+        self._frames = collections.deque(maxlen = maxlen)
+        self._waiter = None
+        self._closed = False
+
+    def _push(self, j):
+        '''
+        Protocol callback, wakes up a waiting consumer.
+        '''
+        self._frames.append(j)
+        waiter = self._waiter
+        if waiter != None and not waiter.done():
+            waiter.set_result(None)
+
+    async def open(self, service = None, host = None, port = 8981):
+        '''
+        Register to the gesture service.
+        '''
+        transport, self.protocol = await create_gesture_endpoint(
+            self._push, service = service, host = host, port = port,
+            typed = self.typed)
+        return self
+
+    def close(self):
+        '''
+        Unregister and end the iteration.
+        '''
+        self._closed = True
+        if self.protocol != None:
+            self.protocol.close()
+        waiter = self._waiter
+        if waiter != None and not waiter.done():
+            waiter.set_result(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._frames:
+            if self._closed:
+                raise StopAsyncIteration
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        return self._frames.popleft()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+def open_pointer_stream(service = None, host = None, port = 8981, maxlen = 64,
+                        typed = False):
+    '''
+    Open a PointerStream, to be used with await or async with.
+    '''
+    return _StreamOpener(PointerStream(maxlen = maxlen, typed = typed),
+                         service, host, port)
+
+class _StreamOpener(object):
+    '''
+    Awaitable and async context manager returned by open_pointer_stream.
+    '''
+
+    def __init__(self, stream, service, host, port):
+        self._stream = stream
+        self._args = (service, host, port)
+
+    def __await__(self):
+        return self._stream.open(*self._args).__await__()
+
+    async def __aenter__(self):
+        return await self._stream.open(*self._args)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._stream.close()
@@ -0,0 +1,572 @@
+'''
+Kodi JSON-RPC backend for the AirPointr media clients.
+
+KodiClient talks JSON-RPC over one persistent HTTP connection and can send
+several calls as one batch request. KodiDispatcher runs the Kodi commands
+on a worker thread, so the gesture receive loop never waits for Kodi.
+KodiStateCache mirrors the player and volume state of Kodi from its
+notifications, so gestures do not have to ask Kodi before acting.
+KodiBackend puts them together for the GestureEngine.
+'''
+
+import http.client
+import json
+import logging
+import socket
+import threading
+import time
+
+import airpointr
+import airpointr_media
+
+log = logging.getLogger('airpointr.kodi')
+
+class KodiError(Exception):
+    '''
+    Kodi answered a call with a JSON-RPC error.
+    '''
+
+    def __init__(self, method, error):
+        '''
+
+        '''
+        Exception.__init__(self, '%s: %s' % (method, error.get('message')))
+        self.method = method
+        self.error = error
+
+def _params(args, kwargs):
+    '''
+    JSON-RPC params of a call, positional or by name like pyjsonrpc did.
+    '''
+    if kwargs:
+        return kwargs
+    return list(args)
+
+_STALE_CONNECTION = (http.client.RemoteDisconnected, BrokenPipeError,
+                     ConnectionResetError, ConnectionAbortedError)
+'''
+Errors of a keep-alive connection Kodi closed while it was idle, the request
+did not reach Kodi and may be sent again.
+'''
+
+class KodiClient(object):
+    '''
+    JSON-RPC client on a keep-alive HTTP connection to Kodi. The connection
+    is opened on the first call and reopened once if Kodi closed it while it
+    was idle. Requests are never repeated otherwise, e.g. after a timeout
+    Kodi may already run the call, and Player.PlayPause toggles.
+    '''
+
+    def __init__(self, host, port = 8080, timeout = 5.0, path = '/jsonrpc'):
+        '''
+
+        '''
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.path = path
+        self.connects = 0
+        self._connection = None
+        self._id = 0
+
+    def _next_id(self):
+        self._id += 1
+        return self._id
+
+    def _post(self, payload):
+        '''
+        Send one request body and return the decoded response.
+        '''
+        body = json.dumps(payload).encode('utf-8')
+        headers = { 'Content-Type': 'application/json' }
+        for attempt in (0, 1):
+            reused = self._connection != None
+            if not reused:
+                self._connection = http.client.HTTPConnection(
+                    self.host, self.port, timeout = self.timeout)
+                self.connects += 1
+            try:
+                self._connection.request('POST', self.path, body, headers)
+                response = self._connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, socket.error) as e:
+                self.close()
+                if attempt == 1 or not reused or \
+                   not isinstance(e, _STALE_CONNECTION):
+                    raise
+        if response.status != 200:
+            raise http.client.HTTPException('Kodi answered HTTP %d'
+                                            % response.status)
+        return json.loads(data.decode('utf-8'))
+
+    def request(self, method, params):
+        '''
+        Call method with the JSON-RPC params (list or dict) and return its
+        result.
+        '''
+        r = self._post({ 'jsonrpc': '2.0', 'method': method,
+                         'params': params, 'id': self._next_id() })
+        if 'error' in r:
+            raise KodiError(method, r['error'])
+        return r.get('result')
+
+    def call(self, method, *args, **kwargs):
+        '''
+        Call method and return its result, arguments are passed by position
+        or by name.
+        '''
+        return self.request(method, _params(args, kwargs))
+
+    def batch(self, calls):
+        '''
+        Send a list of (method, params) calls as one batch request and return
+        their results in the same order. A failed call yields its KodiError
+        instead of a result.
+        '''
+        if not calls:
+            return []
+        requests = []
+        for method, params in calls:
+            requests.append({ 'jsonrpc': '2.0', 'method': method,
+                              'params': params, 'id': self._next_id() })
+        responses = self._post(requests)
+        if isinstance(responses, dict):
+            # a malformed batch is answered with a single error
+            responses = [responses]
+        by_id = dict((r.get('id'), r) for r in responses)
+        results = []
+        for request in requests:
+            r = by_id.get(request['id'], {})
+            if 'error' in r:
+                results.append(KodiError(request['method'], r['error']))
+            else:
+                results.append(r.get('result'))
+        return results
+
+    def close(self):
+        '''
+        Close the HTTP connection.
+        '''
+        if self._connection != None:
+            self._connection.close()
+            self._connection = None
+
+class KodiDispatcher(airpointr_media.CommandDispatcher):
+    '''
+    CommandDispatcher of a KodiClient, notifications queued back to back are
+    sent as one JSON-RPC batch.
+    '''
+
+    name = 'Kodi'
+
+    log = log
+
+    def __init__(self, client, maxsize = 32):
+        '''
+
+        '''
+        airpointr_media.CommandDispatcher.__init__(self, client, maxsize)
+        self.client = client
+
+    def notify(self, method, *args, **kwargs):
+        '''
+        Queue a call, its result is ignored.
+        '''
+        return self._put((method, _params(args, kwargs)))
+
+    def send_batch(self, calls):
+        '''
+        Send the (method, params) calls, several as one batch request.
+        '''
+        if len(calls) == 1:
+            self.client.request(*calls[0])
+            return 0
+        failed = 0
+        for r in self.client.batch(calls):
+            if isinstance(r, KodiError):
+                failed += 1
+                log.error("Kodi Status: call failed: %s", r)
+        return failed
+
+class KodiStateCache(object):
+    '''
+    Local copy of the Kodi state needed by the gestures: the active player,
+    its speed and the volume.
+
+    The state is kept up to date by the notifications Kodi pushes over its
+    raw JSON-RPC TCP port (9090, "Allow remote control from applications on
+    other systems" has to be enabled for remote Kodi hosts) and reconciled
+    by reconcile, which should run periodically on the dispatcher thread.
+    Notifications sent while the connection was down are lost, so on_connect,
+    if given, is called from the cache thread every time it is opened, e.g.
+    to queue a reconcile.
+    '''
+
+    playerid = None
+    '''
+    Id of the first active player, None if nothing is playing.
+    '''
+
+    speed = 0
+    '''
+    Playback speed of the active player, 0 if paused.
+    '''
+
+    volume = None
+    '''
+    Volume in percent, None until known.
+    '''
+
+    muted = False
+    '''
+    Mute state.
+    '''
+
+    def __init__(self, host, port = 9090, reconnect_interval = 5.0,
+                 timeout = 5.0, on_connect = None):
+        '''
+        timeout bounds the connect, the notifications are waited for without
+        one.
+        '''
+        self.host = host
+        self.port = port
+        self.reconnect_interval = reconnect_interval
+        self.timeout = timeout
+        self.on_connect = on_connect
+        self.connected = False
+        self.connects = 0
+        self.notifications = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._socket = None
+        self._running = False
+        self._wakeup = threading.Event()
+
+    def start(self):
+        '''
+        Start listening for notifications.
+        '''
+        self._running = True
+        self._wakeup.clear()
+        self._thread = threading.Thread(target = self._run,
+                                        name = 'kodi-notifications')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stop listening for notifications.
+        '''
+        self._running = False
+        self._wakeup.set()
+        s = self._socket
+        if s != None:
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        if self._thread != None:
+            # a connect in progress can not be interrupted, it ends after
+            # timeout at the latest
+            self._thread.join(self.timeout)
+            self._thread = None
+
+    @property
+    def playing(self):
+        '''
+        True if a player is active and not paused.
+        '''
+        return self.playerid != None and self.speed != 0
+
+    def set_player(self, playerid, speed):
+        '''
+        Update the player state.
+        '''
+        with self._lock:
+            self.playerid = playerid
+            self.speed = speed
+
+    def set_volume(self, volume, muted = None):
+        '''
+        Update the volume state.
+        '''
+        with self._lock:
+            self.volume = volume
+            if muted != None:
+                self.muted = muted
+
+    def handle_notification(self, method, data):
+        '''
+        Apply a Kodi notification to the cache.
+        '''
+        if method in ('Player.OnPlay', 'Player.OnResume', 'Player.OnAVStart',
+                      'Player.OnPause', 'Player.OnSpeedChanged'):
+            player = data.get('player', {})
+            speed = player.get('speed', 0 if method == 'Player.OnPause' else 1)
+            self.set_player(player.get('playerid', self.playerid), speed)
+        elif method == 'Player.OnStop':
+            self.set_player(None, 0)
+        elif method == 'Application.OnVolumeChanged':
+            self.set_volume(data.get('volume'), data.get('muted'))
+        else:
+            return
+        self.notifications += 1
+
+    def reconcile(self, client):
+        '''
+        Read the complete state from Kodi, to be run on the dispatcher thread.
+        '''
+        players, app = client.batch([('Player.GetActivePlayers', []),
+                                     ('Application.GetProperties',
+                                      [['volume', 'muted']])])
+        if isinstance(players, KodiError):
+            raise players
+        if not isinstance(app, KodiError):
+            self.set_volume(app['volume'], app['muted'])
+        if len(players) >= 1:
+            playerid = players[0]['playerid']
+            p = client.call('Player.GetProperties', playerid, ['speed'])
+            self.set_player(playerid, p['speed'])
+        else:
+            self.set_player(None, 0)
+        return players
+
+    def _run(self):
+        while self._running:
+            try:
+                self._socket = socket.create_connection((self.host, self.port),
+                                                        self.timeout)
+                self._socket.settimeout(None)
+                self.connected = True
+                self.connects += 1
+                if self.on_connect != None:
+                    self.on_connect()
+                self._read(self._socket)
+            except socket.error as e:
+                if self._running:
+                    log.warning("Kodi Status: notification connection "
+                                "failed: %s", e)
+            finally:
+                self.connected = False
+                if self._socket != None:
+                    self._socket.close()
+                    self._socket = None
+            if self._running:
+                # stop wakes us up at once
+                self._wakeup.wait(self.reconnect_interval)
+
+    def _read(self, s):
+        '''
+        Split the stream of json objects Kodi sends without delimiters.
+        '''
+        decoder = json.JSONDecoder()
+        buf = ''
+        while self._running:
+            data = s.recv(4096)
+            if not data:
+                return
+            buf += data.decode('utf-8', 'replace')
+            while True:
+                buf = buf.lstrip()
+                if not buf:
+                    break
+                try:
+                    message, end = decoder.raw_decode(buf)
+                except ValueError:
+                    # incomplete object, wait for more data
+                    break
+                buf = buf[end:]
+                if isinstance(message, dict) and 'method' in message:
+                    params = message.get('params', {})
+                    self.handle_notification(message['method'],
+                                             params.get('data') or {})
+
+class KodiBackend(airpointr_media.MediaBackend):
+    '''
+    Kodi as media player of the GestureEngine. The commands run on a
+    KodiDispatcher and are chosen by the state of a KodiStateCache, which
+    is compared with Kodi every reconcile_interval seconds.
+    '''
+
+    name = 'Kodi'
+
+    def __init__(self, host, port = 8080, notification_port = 9090,
+                 reconcile_interval = 30, sched = None):
+        '''
+
+        '''
+        if sched == None:
+            sched = airpointr.scheduler
+        self.client = KodiClient(host, port)
+        self.dispatcher = KodiDispatcher(self.client)
+        # the notifications missed while disconnected are made up for
+        self.state = KodiStateCache(host, notification_port,
+                                    on_connect = self.reconcile)
+        self.reconcile_interval = reconcile_interval
+        self.sched = sched
+        self.reconcile_timer = None
+
+    def open(self):
+        '''
+        Wait for Kodi to answer, then start the dispatcher and the state
+        cache.
+        '''
+        while True:
+            try:
+                players = self.state.reconcile(self.client)
+                break
+            except Exception as e:
+                log.error("%s\nKodi is not responding.\nPlease check:\n"
+                          "  Is Kodi running?\n"
+                          "  Is the Kodi webserver enabled?\n"
+                          "  Is KODI_HOST and KODI_PORT correct?", e)
+                time.sleep(10)
+
+        if len(players) < 1:
+            log.warning("Kodi Status: No Player active, playback control is "
+                        "not active!")
+
+        self.dispatcher.start()
+        # player and volume changes are pushed by kodi, the cache is compared
+        # with kodi now and then in case a notification got lost
+        self.state.start()
+        self.reconcile_timer = self.sched.call_every(
+            self.reconcile_interval, self.reconcile,
+            delay = self.reconcile_interval)
+
+    def close(self):
+        '''
+
+        '''
+        if self.reconcile_timer != None:
+            self.reconcile_timer.cancel()
+            self.reconcile_timer = None
+        self.state.stop()
+        self.dispatcher.stop()
+
+    def reconcile(self):
+        '''
+        Queue a comparison of the cached state with Kodi.
+        '''
+        self.dispatcher.submit(self.state.reconcile)
+
+    def reconnects(self):
+        '''
+        HTTP and notification connections to Kodi reopened.
+        '''
+        return max(0, self.client.connects - 1) + \
+               max(0, self.state.connects - 1)
+
+    def volume(self):
+        '''
+
+        '''
+        return self.state.volume
+
+    def set_volume(self, volume):
+        '''
+
+        '''
+        self.dispatcher.submit(self._set_volume, volume)
+
+    def _set_volume(self, client, volume):
+        volume = client.call('Application.SetVolume', volume)
+        # kodi notifies the change as well, the cache is updated right away
+        self.state.set_volume(volume)
+        log.info("Kodi Status: Volume changed to: %s%%", volume)
+
+    def _player(self, client):
+        '''
+        Id of the player to control, None if no player is active.
+        '''
+        if not self.state.connected:
+            # without notifications the cached player and speed may be
+            # outdated, so they are read from kodi before every command
+            self.state.reconcile(client)
+        if self.state.playerid == None:
+            log.warning("Kodi Status: No Player active, playback control is "
+                        "not active!")
+        return self.state.playerid
+
+    def _play_pause(self, client, playerid, play):
+        if play == None:
+            r = client.call('Player.PlayPause', playerid = playerid)
+        else:
+            r = client.call('Player.PlayPause', playerid = playerid,
+                            play = play)
+        self.state.set_player(playerid, r['speed'])
+
+    def _previous(self, client, playerid):
+        # the first GoTo only restarts the current item, both are sent as
+        # one batch request
+        for r in client.batch([('Player.GoTo', [playerid, 'previous']),
+                               ('Player.GoTo', [playerid, 'previous'])]):
+            if isinstance(r, KodiError):
+                raise r
+
+    def _run(self, client, command):
+        playerid = self._player(client)
+        if playerid == None:
+            return
+        if command == 'forward':
+            if self.state.speed != 0:
+                client.call('Player.GoTo', playerid, 'next')
+                log.info("Playback state:  play --> next track")
+            else:
+                self._play_pause(client, playerid, True)
+                log.info("Playback state:  pause --> play")
+        elif command == 'backward':
+            if self.state.speed != 0:
+                self._play_pause(client, playerid, False)
+                log.info("Playback state:  play --> pause")
+            else:
+                self._previous(client, playerid)
+                log.info("Playback state:  pause --> previous track")
+        else:
+            if command == 'play':
+                self._play_pause(client, playerid, None)
+            elif command == 'next':
+                client.call('Player.GoTo', playerid, 'next')
+            elif command == 'stop':
+                client.call('Player.Stop', playerid)
+                self.state.set_player(None, 0)
+            elif command == 'previous':
+                self._previous(client, playerid)
+            log.info("Kodi Status: Playback switched to: %s", command)
+
+    def forward(self):
+        '''
+
+        '''
+        self.dispatcher.submit(self._run, 'forward')
+
+    def backward(self):
+        '''
+
+        '''
+        self.dispatcher.submit(self._run, 'backward')
+
+    def play(self):
+        '''
+
+        '''
+        self.dispatcher.submit(self._run, 'play')
+
+    def next(self):
+        '''
+
+        '''
+        self.dispatcher.submit(self._run, 'next')
+
+    def stop(self):
+        '''
+
+        '''
+        self.dispatcher.submit(self._run, 'stop')
+
+    def previous(self):
+        '''
+
+        '''
+        self.dispatcher.submit(self._run, 'previous')
@@ -0,0 +1,267 @@
+'''
+Console output of the AirPointr clients that never holds up the receive
+loop.
+
+The library logs to the "airpointr" logger and its children, one child per
+category, e.g. "airpointr.kodi" or "airpointr.media.events". LogPipeline
+puts the records into a bounded queue and writes them from a background
+thread, so a slow serial console or SSH link only delays the output. A
+RateLimitFilter lets every category through at a limited rate and counts
+the records it suppressed, records that do not fit into the queue are
+dropped and counted as well.
+
+Console renders the output on a terminal at a fixed rate: log lines are
+written above a status line, which shows the latest state set with
+status(), however often that is set:
+
+    console = airpointr_log.Console()
+    pipeline = airpointr_log.LogPipeline(console = console)
+    pipeline.start()
+    ...
+    console.status("Pointer: x=0.500000 / y=0.500000")
+'''
+
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+'''
+Default format of the log lines.
+'''
+
+class RateLimitFilter(logging.Filter):
+    '''
+    Token bucket per logger: up to burst records at once, then rate records
+    per second. The number of records suppressed meanwhile is attached to
+    the next record let through as its suppressed attribute.
+    '''
+
+    def __init__(self, rate = 5.0, burst = 20, clock = time.monotonic):
+        '''
+
+        '''
+        logging.Filter.__init__(self)
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.suppressed = 0
+        self._buckets = {}
+
+    def filter(self, record):
+        now = self.clock()
+        bucket = self._buckets.get(record.name)
+        if bucket == None:
+            # tokens, time of the last refill, records suppressed since
+            bucket = self._buckets[record.name] = [self.burst, now, 0]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] += 1
+            self.suppressed += 1
+            return False
+        bucket[0] = tokens - 1
+        record.suppressed = bucket[2]
+        bucket[2] = 0
+        return True
+
+class LogFormatter(logging.Formatter):
+    '''
+    Formatter telling how many records of the logger were suppressed before
+    a line.
+    '''
+
+    def format(self, record):
+        line = logging.Formatter.format(self, record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            line += ' (%d similar messages suppressed)' % suppressed
+        return line
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    '''
+    QueueHandler that never blocks, records not fitting into the queue are
+    counted in dropped.
+    '''
+
+    dropped = 0
+    '''
+    Number of records dropped because the queue was full.
+    '''
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class Console(object):
+    '''
+    Terminal renderer redrawing at most rate times per second, from its own
+    thread. Log lines are written above the status line. If the stream is
+    no terminal, the status line is left out.
+    '''
+
+    def __init__(self, stream = None, rate = 20.0, max_lines = 200):
+        '''
+
+        '''
+        if stream == None:
+            stream = sys.stdout
+        self.stream = stream
+        self.interval = 1.0 / rate
+        self.max_lines = max_lines
+        self.dropped = 0
+        self.tty = hasattr(stream, 'isatty') and stream.isatty()
+        self.handler = _ConsoleHandler(self)
+        self._lines = []
+        self._status = None
+        self._drawn = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._running = False
+
+    def write(self, line):
+        '''
+        Queue a line to be written above the status line.
+        '''
+        with self._lock:
+            if len(self._lines) >= self.max_lines:
+                self.dropped += 1
+                return
+            self._lines.append(line)
+
+    def status(self, text):
+        '''
+        Set the status line, shown on the next redraw.
+        '''
+        self._status = text
+
+    def draw(self):
+        '''
+        Write the queued lines and redraw the status line if it changed.
+        '''
+        with self._lock:
+            lines = self._lines
+            self._lines = []
+        status = self._status if self.tty else None
+        if not lines and status == self._drawn:
+            return
+        out = []
+        if self._drawn != None:
+            # overwrite the old status line
+            out.append('\r\033[K')
+        for line in lines:
+            out.append(line + '\n')
+        if status != None:
+            out.append(status)
+        self._drawn = status
+        self.stream.write(''.join(out))
+        self.stream.flush()
+
+    def start(self):
+        '''
+        Start redrawing.
+        '''
+        self._running = True
+        self._thread = threading.Thread(target = self._run,
+                                        name = 'console')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Write what is left and stop redrawing.
+        '''
+        if self._thread != None:
+            self._running = False
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.draw()
+        if self._drawn != None:
+            self.stream.write('\n')
+            self.stream.flush()
+            self._drawn = None
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self.interval)
+            try:
+                self.draw()
+            except (IOError, ValueError):
+                # the terminal is gone, nothing left to show the output on
+                return
+
+class _ConsoleHandler(logging.Handler):
+    '''
+    Handler writing the formatted records to a Console.
+    '''
+
+    def __init__(self, console):
+        '''
+
+        '''
+        logging.Handler.__init__(self)
+        self.console = console
+
+    def emit(self, record):
+        try:
+            self.console.write(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+class LogPipeline(object):
+    '''
+    Routes the records of the "airpointr" logger through a bounded queue to
+    a background thread, which writes them to the console if given or to
+    stream. The logging calls only format the record and queue it.
+    '''
+
+    def __init__(self, level = logging.INFO, console = None, stream = None,
+                 rate = 5.0, burst = 20, maxsize = 1000, fmt = FORMAT,
+                 logger = 'airpointr'):
+        '''
+        rate and burst limit the records per logger, see RateLimitFilter.
+        '''
+        self.console = console
+        self.logger = logging.getLogger(logger)
+        self.level = level
+        self.queue = queue.Queue(maxsize)
+        self.limiter = RateLimitFilter(rate, burst)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.handler.addFilter(self.limiter)
+        if console != None:
+            output = console.handler
+        else:
+            output = logging.StreamHandler(stream if stream != None
+                                           else sys.stdout)
+        output.setFormatter(LogFormatter(fmt, '%H:%M:%S'))
+        self.listener = logging.handlers.QueueListener(self.queue, output)
+
+    def start(self):
+        '''
+        Attach to the logger and start the writer thread, and the console.
+        '''
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(self.level)
+        # the records must not reach the blocking handlers of the root logger
+        self.logger.propagate = False
+        self.listener.start()
+        if self.console != None:
+            self.console.start()
+
+    def stop(self):
+        '''
+        Detach from the logger and write out the queued records.
+        '''
+        self.logger.removeHandler(self.handler)
+        self.logger.propagate = True
+        self.listener.stop()
+        if self.console != None:
+            self.console.stop()
@@ -0,0 +1,717 @@
+'''
+Gesture control of media players, shared by the Kodi and MPD clients.
+
+GestureEngine finds and registers to the AirPointr service, keeps it alive
+and turns the pointer frames into player actions. What a gesture does is
+given by a mapping, a plain dictionary:
+
+    {
+        'events': {'rwipe': 'forward', 'lwipe': 'backward'},
+        'smart': {0: 'play', 1: 'next', 2: 'stop', 3: 'previous'},
+        'volume': {'turns': 2, 'step': 2},
+    }
+
+events maps pointer events and smart the selected smart circle segment to
+an action, i.e. the name of a MediaBackend method. volume enables the
+volume control by circling, after turns full turns, with step percent per
+circle segment. Mappings may also be read from a mapping file, see
+airpointr_rules. The player itself is driven by a MediaBackend.
+'''
+
+import logging
+import queue
+import socket
+import threading
+
+import airpointr
+import airpointr_rules
+import airpointr_stats
+import airpointr_wire
+
+log = logging.getLogger('airpointr.media')
+event_log = logging.getLogger('airpointr.media.events')
+license_log = logging.getLogger('airpointr.media.license')
+
+ACTIONS = ('forward', 'backward', 'play', 'next', 'stop', 'previous')
+'''
+Actions a mapping may refer to.
+'''
+
+SWIPE_MAPPING = {
+    'events': { 'rwipe': 'forward', 'lwipe': 'backward' },
+    'volume': { 'turns': 0, 'step': 2 },
+}
+'''
+Swipe right for play or next track, swipe left for pause or previous track,
+circle for the volume.
+'''
+
+SMARTCIRCLE_MAPPING = {
+    'smart': { 0: 'play', 1: 'next', 2: 'stop', 3: 'previous' },
+    'volume': { 'turns': 2, 'step': 2 },
+}
+'''
+Smart circle segments north, east, south and west for play/pause, next
+track, stop and previous track, two more turns of the circle for the
+volume.
+'''
+
+_EVENT_NAMES = { 'rwipe': 'right swipe', 'lwipe': 'left swipe' }
+
+def segment_delta(segment, last_segment, segments = 8):
+    '''
+    Number of circle segments moved from last_segment to segment, negative
+    counterclockwise, taking the shorter way around the circle.
+    '''
+    delta = segment - last_segment
+    if delta > segments // 2:
+        delta -= segments
+    elif delta < -(segments // 2):
+        delta += segments
+    return delta
+
+def compile_mapping(mapping):
+    '''
+    RuleTable of a mapping dictionary or mapping file, raises ValueError if
+    the mapping is invalid or refers to an unknown action.
+    '''
+    if isinstance(mapping, str):
+        return airpointr_rules.load_mapping(mapping, ACTIONS)
+    return airpointr_rules.compile_mapping(mapping, ACTIONS)
+
+class CommandDispatcher(object):
+    '''
+    Worker thread executing the commands of a media backend in order of
+    submission, target is the connection to the player.
+
+    notify queues a command whose answer is not needed, submit queues a job
+    function that is called with target and may send several commands.
+    Notifications queued back to back are handed to send_batch in one go,
+    which the backends implement, e.g. as one JSON-RPC batch. If the player
+    is slow the queue fills up and further commands are dropped, the caller
+    never blocks.
+    '''
+
+    name = 'media'
+    '''
+    Name of the player in status messages and of the thread.
+    '''
+
+    log = log
+    '''
+    Logger of the errors.
+    '''
+
+    stats = None
+    '''
+    If set the issue, ack and total latencies of the commands queued while
+    origin_ns is set are recorded to it, see airpointr_stats.LatencyStats.
+    '''
+
+    origin_ns = None
+    '''
+    perf_ns() stamp of the reception of the frame the commands queued now
+    belong to, None for commands not caused by a frame.
+    '''
+
+    def __init__(self, target, maxsize = 32):
+        '''
+
+        '''
+        self.target = target
+        self.dropped = 0
+        self.failed = 0
+        self.latency = airpointr_stats.Histogram()
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+
+    def start(self):
+        '''
+        Start the worker thread.
+        '''
+        self._thread = threading.Thread(target = self._run, name = '%s-'
+                                        'dispatcher' % self.name.lower())
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout = None):
+        '''
+        Finish the queued commands and stop the worker thread.
+        '''
+        if self._thread != None:
+            self._queue.put((None, None))
+            self._thread.join(timeout)
+            self._thread = None
+        self.target.close()
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait((item, self.origin_ns))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            self.log.warning("%s Status: too many pending commands, command "
+                             "dropped", self.name)
+            return False
+
+    def notify(self, command, *args):
+        '''
+        Queue a command, its answer is ignored.
+        '''
+        return self._put((command,) + args)
+
+    def submit(self, func, *args):
+        '''
+        Queue func(target, *args).
+        '''
+        return self._put((func, args))
+
+    def send_batch(self, commands):
+        '''
+        Send a list of notified commands to the player, returns the number
+        of commands the player rejected. Raises if the batch failed as a
+        whole.
+        '''
+        raise NotImplementedError
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            # everything queued meanwhile is handled in one go
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            commands = []
+            for item, origin in items:
+                if item == None:
+                    self._flush(commands)
+                    return
+                if callable(item[0]):
+                    self._flush(commands)
+                    commands = []
+                    self._execute(item[0], item[1], origin)
+                else:
+                    commands.append((item, origin))
+            self._flush(commands)
+
+    def _flush(self, commands):
+        '''
+        Send queued notifications as one batch.
+        '''
+        if not commands:
+            return
+        start = airpointr.perf_ns()
+        try:
+            self.failed += self.send_batch([c for c, origin in commands]) or 0
+            self._record([origin for c, origin in commands], start)
+        except Exception as e:
+            # none of the commands got through
+            self.failed += len(commands)
+            self.log.error("%s Status: command failed: %s", self.name, e)
+
+    def _execute(self, func, args, origin = None):
+        start = airpointr.perf_ns()
+        try:
+            func(self.target, *args)
+            self._record([origin], start)
+        except Exception as e:
+            self.failed += 1
+            self.log.error("%s Status: command failed: %s", self.name, e)
+
+    def _record(self, origins, start):
+        '''
+        Record the latencies of commands sent at start and answered now, for
+        the frames received at origins.
+        '''
+        now = airpointr.perf_ns()
+        self.latency.record(now - start)
+        stats = self.stats
+        if stats == None:
+            return
+        for origin in origins:
+            if origin != None:
+                stats.record('issue', start - origin)
+                stats.record('ack', now - start)
+                stats.record('total', now - origin)
+
+class MediaBackend(object):
+    '''
+    Media player controlled by the GestureEngine.
+
+    The actions are called from the receive loop and must not wait for the
+    player, i.e. they queue their commands to a worker thread and decide
+    on locally cached player state.
+    '''
+
+    name = 'media'
+    '''
+    Name of the player in status messages.
+    '''
+
+    dispatcher = None
+    '''
+    Worker thread queueing the player commands, if any.
+    '''
+
+    def instrument(self, stats):
+        '''
+        Record the latencies of the player commands to stats, see
+        airpointr_stats.LatencyStats.
+        '''
+        if self.dispatcher != None:
+            self.dispatcher.stats = stats
+
+    def trace(self, recv_ns):
+        '''
+        Attribute the commands queued from now on to the frame received at
+        recv_ns, None ends the attribution.
+        '''
+        if self.dispatcher != None:
+            self.dispatcher.origin_ns = recv_ns
+
+    def open(self):
+        '''
+        Connect to the player, may block until it is reachable.
+        '''
+
+    def close(self):
+        '''
+        Disconnect from the player.
+        '''
+
+    def reconnects(self):
+        '''
+        Number of times a connection to the player had to be reopened.
+        '''
+        return 0
+
+    def volume(self):
+        '''
+        Current volume in percent, None if unknown.
+        '''
+        return None
+
+    def set_volume(self, volume):
+        '''
+        Set the volume in percent.
+        '''
+        raise NotImplementedError
+
+    def forward(self):
+        '''
+        Start playback if paused or stopped, otherwise next track.
+        '''
+        raise NotImplementedError
+
+    def backward(self):
+        '''
+        Pause if playing, otherwise previous track.
+        '''
+        raise NotImplementedError
+
+    def play(self):
+        '''
+        Toggle play and pause.
+        '''
+        raise NotImplementedError
+
+    def next(self):
+        '''
+        Next track.
+        '''
+        raise NotImplementedError
+
+    def stop(self):
+        '''
+        Stop playback.
+        '''
+        raise NotImplementedError
+
+    def previous(self):
+        '''
+        Previous track.
+        '''
+        raise NotImplementedError
+
+class GestureEngine(object):
+    '''
+    Receive loop of a media client: discovers AirPointr services, registers
+    to the one on host_ip and controls backend with its pointer input as
+    given by mapping, a mapping dictionary, the path of a mapping file or a
+    RuleTable.
+
+    With all_services set, the engine registers to every service it
+    discovers, all on one socket, and an airpointr.SourceArbiter decides
+    whose pointer input controls the backend.
+
+    With wire set to airpointr_wire.BINARY, the engine asks the services
+    for the compact binary frames, services that do not support them keep
+    sending json.
+
+    Every service gets an airpointr.GestureDebouncer, so that a swipe or
+    smart circle selection runs its action once, however many frames it
+    shows up in. refractory is its window in seconds.
+    '''
+
+    keep_alive_interval = 15
+    '''
+    Seconds between two keep alive messages to the active service.
+    '''
+
+    def __init__(self, backend, mapping, host_ip = '127.0.0.1',
+                 hostname = None, gesture_port = 8981, volume_window = 0.1,
+                 sched = None, recorder = None, stats = None,
+                 all_services = False, handover = 0.5,
+                 wire = airpointr_wire.JSON,
+                 refractory = airpointr.GESTURE_REFRACTORY):
+        '''
+        host_ip is the address of the service to use, if None it is looked
+        up by hostname. If recorder is given, all received datagrams are
+        recorded, see airpointr_record, it is closed with the engine. If
+        stats is given, the latencies of the pointer frames from reception to
+        the answer of the player are recorded to it, see airpointr_stats.
+        handover is the time in seconds a service keeps the control after
+        the last gesture in front of it, if all_services is set.
+        '''
+        if sched == None:
+            sched = airpointr.scheduler
+        self.backend = backend
+        self.rules = compile_mapping(mapping)
+        self.host_ip = host_ip
+        self.all_services = all_services
+        self.wire = wire
+        self.refractory = refractory
+        self.debouncers = {}
+        self.arbiter = airpointr.SourceArbiter(handover)
+        self.source = None
+        self.hostname = hostname
+        self.gesture_port = gesture_port
+        self.sched = sched
+        self.recorder = recorder
+        self.stats = stats
+        if stats != None:
+            backend.instrument(stats)
+        self.services = airpointr.ServiceRegistry()
+        self.sock = None
+        self.keep_alive_timer = None
+        self.received = 0
+        self.decode_errors = 0
+        self.heartbeats = 0
+        self.dropped = 0
+        self.suppressed_gestures = 0
+        self.volume_change_active = False
+        self.last_segment = 0
+        self.rule_segment = None
+        # volume steps of a circle gesture are summed up to one setting
+        self.volume_controller = airpointr.VolumeController(
+            backend.set_volume, backend.volume, window = volume_window,
+            sched = sched)
+
+    def register(self, ip, port):
+        '''
+        Send the registration request to the given address.
+        '''
+        try:
+            self.sock.sendto(b"register", (ip, port))
+            self.heartbeats += 1
+            if self.wire != airpointr_wire.JSON:
+                self.sock.sendto(airpointr_wire.request(self.wire), (ip, port))
+        except socket.error as e:
+            log.warning("registration to %s:%d failed: %s", ip, port, e)
+
+    def keep_alive(self):
+        '''
+        List the discovered services and send a keep alive message to the
+        one that provides the control input, or to all of them if
+        all_services is set.
+        '''
+        self.services.expire()
+        self.arbiter.expire()
+        for address in list(self.debouncers):
+            if address[0] not in self.services:
+                del self.debouncers[address]
+        lines = ["Discovered Airpointr Server:"]
+        for server in self.services.values():
+            address = (server["host"], server["port"])
+            if self.all_services and not server["active"]:
+                self.register(*address)
+            if server["active"]:
+                self.register(*address)
+                lines.append("Address: " + (str(address)
+                       + " | License Status: " + str(server["license_status"])
+                       + " | (active)"))
+            else:
+                lines.append(str(address))
+        log.info("\n".join(lines))
+
+    def handle_discovery_message(self, addr, json_data):
+        '''
+        Add a new service and register to it if it should provide the
+        control input.
+        '''
+        ip = addr[0]
+        if self.services.touch(ip) != None:
+            return
+        self.services.update(dict(host = ip, port = addr[1], active = False,
+                                  license_status = "demo"))
+        if ip == self.host_ip or self.all_services:
+            self.register(*addr)
+
+        lines = ["received discovery message:"]
+        for ka, va in json_data.items():
+            if isinstance(va, dict):
+                lines.append(ka + ": ")
+                for kb, vb in va.items():
+                    lines.append("  " + kb + ": " + str(vb))
+            else:
+                lines.append(ka + ": " + str(va))
+        lines.append("From Addresse " + str(addr))
+        log.info("\n".join(lines))
+
+    def handle_pointer_message(self, addr, frame):
+        '''
+        Check if the pointer frame is control input and evaluate it.
+        '''
+        ip = addr[0]
+        valid_input = False
+        server = self.services.touch(ip)
+        if server != None:
+            server["active"] = True
+            server["license_status"] = frame.license
+            if frame.licensed:
+                valid_input = True
+            else:
+                license_log.warning("AirPointr Status %s:%d : Demo expired "
+                                    "-> Pointer output is invalid!",
+                                    server["host"], server["port"])
+
+        if not valid_input:
+            self.dropped += 1
+        elif self.all_services:
+            if self.arbiter.update(addr, frame):
+                self.handle_source_input(addr, frame)
+            else:
+                self.dropped += 1
+        elif ip == self.host_ip:
+            self.handle_pointer_input(frame, addr)
+        else:
+            self.dropped += 1
+
+    def handle_source_input(self, addr, frame):
+        '''
+        Evaluate the frame of the service in control, a gesture started in
+        front of another service is not continued.
+        '''
+        if addr != self.source:
+            if self.source != None:
+                log.info("AirPointr service %s:%d took over the control",
+                         addr[0], addr[1])
+            self.source = addr
+            self.volume_change_active = False
+            self.rule_segment = None
+        self.handle_pointer_input(frame, addr)
+
+    def handle_traced_pointer_message(self, addr, frame):
+        '''
+        handle_pointer_message recording the decode and handler latencies,
+        the player commands are attributed to the frame.
+        '''
+        stats = self.stats
+        stats.stamp('decode', frame.recv_ns)
+        self.backend.trace(frame.recv_ns)
+        try:
+            self.handle_pointer_message(addr, frame)
+        finally:
+            self.backend.trace(None)
+        stats.stamp('handler', frame.recv_ns)
+
+    def handle_frame(self, addr, frame):
+        '''
+        Handle a decoded pointer frame, traced if stats are recorded.
+        '''
+        if self.stats != None and frame.recv_ns != None:
+            self.handle_traced_pointer_message(addr, frame)
+        else:
+            self.handle_pointer_message(addr, frame)
+
+    def handle_op_message(self, addr, json_data):
+        '''
+        Display if a registration operation has been successful.
+        '''
+        log.info("Operation-Status from: %s ..%s --> %s", addr,
+                 json_data["op"],
+                 "success" if json_data.get("success") else "fail")
+
+    def debouncer(self, addr):
+        '''
+        GestureDebouncer of the service at addr.
+        '''
+        debouncer = self.debouncers.get(addr)
+        if debouncer == None:
+            debouncer = self.debouncers[addr] = airpointr.GestureDebouncer(
+                self.refractory, self.sched.clock)
+        return debouncer
+
+    def handle_pointer_input(self, frame, addr = None):
+        '''
+        Change the volume while circling, otherwise run the actions of the
+        rules matching the gestures started in the frame of the service at
+        addr, events or smart circle selection, or its circle segment.
+        '''
+        debouncer = self.debouncer(addr)
+        suppressed = debouncer.suppressed
+        gestures = debouncer.update(frame)
+        self.suppressed_gestures += debouncer.suppressed - suppressed
+        circle = frame.circle
+        rules = self.rules
+        self.update_volume(circle)
+        if self.volume_change_active:
+            self.rule_segment = None
+            return
+
+        for gesture in gestures:
+            if gesture.kind == airpointr.SELECT:
+                action = rules.smart_action(gesture.segment)
+            else:
+                action = rules.event_action(gesture.kind)
+                if action != None:
+                    event_log.info("event occured: %s (gesture %d)",
+                                   _EVENT_NAMES.get(gesture.kind,
+                                                    gesture.kind),
+                                   gesture.id)
+            if action != None:
+                self.execute(action)
+
+        if not circle.active:
+            self.rule_segment = None
+        elif circle.segment != self.rule_segment:
+            # segment rules fire when the circle moves into the segment
+            if self.rule_segment != None and circle.direction != 0:
+                action = rules.segment_action(circle.segment, circle.turns)
+                if action != None:
+                    self.execute(action)
+            self.rule_segment = circle.segment
+
+    def update_volume(self, circle):
+        '''
+        Volume control is active while the circle is active after the
+        configured number of turns, each segment changes the volume by step.
+        '''
+        volume = self.rules.volume
+        if volume == None or not circle.active:
+            self.volume_change_active = False
+            return
+        if circle.direction == 0:
+            return
+        if self.volume_change_active:
+            delta = segment_delta(circle.segment, self.last_segment)
+            if delta != 0:
+                self.volume_controller.change(delta * volume['step'])
+                self.last_segment = circle.segment
+        elif abs(circle.turns) >= volume['turns']:
+            self.last_segment = circle.segment
+            self.volume_change_active = True
+
+    def execute(self, action):
+        '''
+        Run an action of the backend.
+        '''
+        try:
+            getattr(self.backend, action)()
+        except Exception as e:
+            log.error("%s Status: %s failed: %s", self.backend.name, action, e)
+
+    def handle_datagram(self, data, addr, recv_ns = None):
+        '''
+        Dispatch a datagram received from a service.
+        '''
+        self.received += 1
+        if self.recorder != None:
+            self.recorder.record(data, addr)
+        if airpointr_wire.is_binary(data):
+            try:
+                frame = airpointr_wire.decode_frame(data, recv_ns)
+            except ValueError as e:
+                self.decode_errors += 1
+                log.warning("invalid binary frame: %s", e)
+                return
+            self.handle_frame(addr, frame)
+            return
+        if data[:1] != b"{":
+            self.decode_errors += 1
+            log.warning("not a JSON-Blob")
+            return
+        try:
+            json_data = airpointr.loads(data)
+        except ValueError as e:
+            self.decode_errors += 1
+            log.warning("invalid JSON-Blob: %s", e)
+            return
+        try:
+            if "type" in json_data:
+                if json_data["type"] == "discovery":
+                    self.handle_discovery_message(addr, json_data)
+                elif json_data["type"] == "pointer":
+                    frame = airpointr.PointerFrame.from_message(json_data,
+                                                                recv_ns)
+                    self.handle_frame(addr, frame)
+            if "op" in json_data:
+                self.handle_op_message(addr, json_data)
+        except (KeyError, TypeError, ValueError) as e:
+            # a message lacking fields must not end the receive loop
+            self.decode_errors += 1
+            log.warning("invalid message from %s:%d: %r", addr[0], addr[1],
+                        e)
+
+    def open(self):
+        '''
+        Start the backend, open the socket and register to the service.
+        '''
+        self.backend.open()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('', 0))
+
+        if self.host_ip == None:
+            self.host_ip = socket.gethostbyname_ex(self.hostname)[2][0]
+
+        # discovery messages are not sent over the loopback interface, so
+        # if the service runs on this machine it has to be registered directly
+        if self.host_ip == "127.0.0.1" or self.host_ip == "127.0.1.1":
+            self.register("127.0.0.1", self.gesture_port)
+            self.services.update(dict(host = "127.0.0.1",
+                                      port = self.gesture_port,
+                                      active = False,
+                                      license_status = "demo"),
+                                 expires = False)
+
+        self.keep_alive_timer = self.sched.call_every(self.keep_alive_interval,
+                                                      self.keep_alive)
+
+    def close(self):
+        '''
+        Close the socket and the backend.
+        '''
+        if self.keep_alive_timer != None:
+            self.keep_alive_timer.cancel()
+            self.keep_alive_timer = None
+        if self.sock != None:
+            self.sock.close()
+            self.sock = None
+        if self.recorder != None:
+            self.recorder.close()
+        self.backend.close()
+
+    def run(self):
+        '''
+        Open and handle the datagrams until interrupted.
+        '''
+        self.open()
+        try:
+            while True:
+                data, addr = airpointr.recvfrom(self.sock, 1024, self.sched)
+                self.handle_datagram(data, addr, airpointr.perf_ns())
+        finally:
+            self.close()
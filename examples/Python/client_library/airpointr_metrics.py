@@ -0,0 +1,256 @@
+'''
+Metrics of long running gesture clients in the Prometheus text format.
+
+The clients already count what they do: GestureListener and GestureEngine
+count received datagrams, decode errors, heart beats and dropped or
+coalesced frames, the dispatchers of the media backends keep the round trip
+times of the player commands. A Registry reads these counters when it is
+scraped, so collecting metrics costs nothing in the receive loop.
+MetricsServer serves the registry over HTTP on /metrics:
+
+    registry = airpointr_metrics.Registry()
+    airpointr_metrics.watch_engine(registry, engine)
+    airpointr_metrics.MetricsServer(registry, 9101).start()
+
+Rates like datagrams/s are derived from the counters by the scraper, e.g.
+rate(airpointr_datagrams_received_total[1m]).
+'''
+
+import http.server
+import threading
+
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99)
+'''
+Quantiles of the latency summaries.
+'''
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', r'\\')
+                                          .replace('"', r'\"')
+                                          .replace('\n', r'\n'))
+                             for k, v in sorted(labels.items()))
+
+def _value(value):
+    if value == None:
+        return 'NaN'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+class Registry(object):
+    '''
+    Set of metrics, each read from a function at scrape time. A metric name
+    may be registered several times with different labels, e.g. once per
+    listener.
+    '''
+
+    def __init__(self):
+        '''
+
+        '''
+        self._metrics = {}
+        self._order = []
+        self._lock = threading.Lock()
+
+    def _add(self, name, kind, help, func, labels):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = (kind, help, [])
+                self._order.append(name)
+            elif self._metrics[name][0] != kind:
+                raise ValueError('metric %s is already a %s'
+                                 % (name, self._metrics[name][0]))
+            self._metrics[name][2].append((func, dict(labels or {})))
+
+    def counter(self, name, help, func, labels = None):
+        '''
+        Register a counter, func returns its total.
+        '''
+        self._add(name, 'counter', help, func, labels)
+
+    def gauge(self, name, help, func, labels = None):
+        '''
+        Register a gauge, func returns its current value.
+        '''
+        self._add(name, 'gauge', help, func, labels)
+
+    def summary(self, name, help, func, labels = None, scale = 1e-9):
+        '''
+        Register a summary, func returns an airpointr_stats.Histogram whose
+        values are multiplied by scale, by default from nanoseconds to
+        seconds.
+        '''
+        self._add(name, 'summary', help, (func, scale), labels)
+
+    def exposition(self):
+        '''
+        All metrics in the Prometheus text format.
+        '''
+        lines = []
+        with self._lock:
+            metrics = [(name,) + self._metrics[name] for name in self._order]
+        for name, kind, help, children in metrics:
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for func, labels in children:
+                if kind == 'summary':
+                    lines.extend(self._summary(name, func, labels))
+                    continue
+                try:
+                    value = func()
+                except Exception:
+                    # a broken metric must not break the others
+                    value = None
+                lines.append('%s%s %s' % (name, _labels(labels),
+                                          _value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def _summary(self, name, func, labels):
+        func, scale = func
+        h = func()
+        lines = []
+        for q in SUMMARY_QUANTILES:
+            l = dict(labels, quantile = repr(q))
+            p = h.percentile(q * 100)
+            lines.append('%s%s %s' % (name, _labels(l),
+                                      _value(None if p == None else p * scale)))
+        lines.append('%s_sum%s %s' % (name, _labels(labels),
+                                      _value(h.total * scale)))
+        lines.append('%s_count%s %d' % (name, _labels(labels), h.count))
+        return lines
+
+class MetricsServer(object):
+    '''
+    HTTP server exposing a registry on /metrics, in a background thread.
+    By default only local scrapers can reach it, set host to '' to listen
+    on all interfaces.
+    '''
+
+    def __init__(self, registry, port = 9101, host = '127.0.0.1'):
+        '''
+
+        '''
+        self.registry = registry
+        self.server = http.server.ThreadingHTTPServer((host, port),
+                                                      self._handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = None
+
+    def _handler(self):
+        registry = self.registry
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.exposition().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # scrapes are not worth a line on the console
+                pass
+
+        return Handler
+
+    def start(self):
+        '''
+        Start serving.
+        '''
+        self._thread = threading.Thread(target = self.server.serve_forever,
+                                        name = 'metrics-server')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stop serving and close the socket.
+        '''
+        if self._thread != None:
+            self.server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server.server_close()
+
+def watch_services(registry, services, labels = None):
+    '''
+    Register the number of services of an airpointr.ServiceRegistry.
+    '''
+    registry.gauge('airpointr_services', 'Discovered AirPointr services.',
+                   lambda: len(services), labels)
+
+def watch_listener(registry, listener, labels = None):
+    '''
+    Register the counters of an airpointr.GestureListener, labelled with
+    its service by default.
+    '''
+    if labels == None:
+        labels = { 'service': '%s:%d' % listener.service }
+    registry.counter('airpointr_datagrams_received_total',
+                     'Datagrams received from the service.',
+                     lambda: listener.received, labels)
+    registry.counter('airpointr_decode_errors_total',
+                     'Datagrams that could not be parsed.',
+                     lambda: listener.decode_errors, labels)
+    registry.counter('airpointr_coalesced_frames_total',
+                     'Pointer frames dropped for a newer one.',
+                     lambda: listener.coalesced, labels)
+    registry.counter('airpointr_heartbeats_total',
+                     'Heart beats sent to the service.',
+                     lambda: listener.heartbeats, labels)
+
+def watch_backend(registry, backend, labels = None):
+    '''
+    Register the command latency, dropped and failed commands and reconnects
+    of an airpointr_media.MediaBackend, labelled with its name by default.
+    '''
+    if labels == None:
+        labels = { 'backend': backend.name }
+    registry.counter('airpointr_backend_reconnects_total',
+                     'Connections to the player reopened.',
+                     backend.reconnects, labels)
+    dispatcher = backend.dispatcher
+    if dispatcher == None:
+        return
+    registry.summary('airpointr_backend_command_seconds',
+                     'Round trip time of the player commands.',
+                     lambda: dispatcher.latency, labels)
+    registry.counter('airpointr_backend_dropped_commands_total',
+                     'Player commands dropped because too many were pending.',
+                     lambda: dispatcher.dropped, labels)
+    registry.counter('airpointr_backend_failed_commands_total',
+                     'Player commands that failed.',
+                     lambda: dispatcher.failed, labels)
+
+def watch_engine(registry, engine, labels = None):
+    '''
+    Register the counters of an airpointr_media.GestureEngine, its services
+    and its backend, labelled with the backend name by default.
+    '''
+    if labels == None:
+        labels = { 'backend': engine.backend.name }
+    registry.counter('airpointr_datagrams_received_total',
+                     'Datagrams received from the service.',
+                     lambda: engine.received, labels)
+    registry.counter('airpointr_decode_errors_total',
+                     'Datagrams that could not be parsed.',
+                     lambda: engine.decode_errors, labels)
+    registry.counter('airpointr_dropped_frames_total',
+                     'Pointer frames not used as control input.',
+                     lambda: engine.dropped, labels)
+    registry.counter('airpointr_heartbeats_total',
+                     'Heart beats sent to the service.',
+                     lambda: engine.heartbeats, labels)
+    registry.counter('airpointr_suppressed_gestures_total',
+                     'Repeated events and smart circle selections ignored.',
+                     lambda: engine.suppressed_gestures, labels)
+    watch_services(registry, engine.services, labels)
+    watch_backend(registry, engine.backend, labels)
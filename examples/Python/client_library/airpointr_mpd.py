@@ -0,0 +1,467 @@
+'''
+MPD backend for the AirPointr media clients.
+
+MPDConnection speaks the MPD protocol on one persistent TCP connection,
+which is reopened transparently when MPD dropped it, and sends several
+commands as one command list. MPDDispatcher runs the MPD commands on a
+worker thread, so the gesture receive loop never waits for MPD.
+MPDStatusCache mirrors the player and mixer status of MPD, so gestures do
+not have to ask MPD before acting. MPDBackend puts them together for the
+GestureEngine.
+'''
+
+import logging
+import socket
+import threading
+import time
+
+import airpointr
+import airpointr_media
+
+log = logging.getLogger('airpointr.mpd')
+
+class MPDError(Exception):
+    '''
+    MPD answered a command with an ACK.
+    '''
+
+    def __init__(self, command, message):
+        '''
+
+        '''
+        Exception.__init__(self, '%s: %s' % (command, message))
+        self.command = command
+        self.message = message
+
+def _quote(arg):
+    '''
+    Argument of a command as MPD expects it.
+    '''
+    arg = str(arg).replace('\\', '\\\\').replace('"', '\\"')
+    return '"%s"' % arg
+
+def _line(command, args):
+    return ' '.join([command] + [_quote(a) for a in args]) + '\n'
+
+_STALE_CONNECTION = (BrokenPipeError, ConnectionResetError,
+                     ConnectionAbortedError)
+'''
+Errors of a connection MPD closed while it was idle, if raised before the
+first line of the answer the command did not reach MPD.
+'''
+
+class MPDConnection(object):
+    '''
+    Client side of the MPD protocol on a persistent TCP connection. The
+    connection is opened on the first command and reopened once if MPD
+    closed it meanwhile. Commands are never repeated otherwise, e.g. after a
+    timeout MPD may already run them, and next skips a track each time.
+    After a failed connect, no new attempt is made for retry_interval
+    seconds, so an unreachable MPD costs no time per command.
+    '''
+
+    reconnect = True
+    '''
+    Reopen the connection and repeat the command if MPD closed it, otherwise
+    the error is raised.
+    '''
+
+    connect_timeout = None
+    '''
+    Timeout of the connect and login, timeout if None. Set it if timeout is
+    None, which only suits waiting for idle.
+    '''
+
+    def __init__(self, host = 'localhost', port = 6600, password = None,
+                 timeout = 5.0, retry_interval = 5.0):
+        '''
+
+        '''
+        self.host = host
+        self.port = int(port)
+        self.password = password
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.version = None
+        self.connects = 0
+        self._socket = None
+        self._file = None
+        self._next_attempt = 0
+        self._lines = 0
+
+    @property
+    def connected(self):
+        '''
+        True if the connection to MPD is open.
+        '''
+        return self._socket != None
+
+    def connect(self):
+        '''
+        Open the connection and log in with the password.
+        '''
+        self.close()
+        now = time.monotonic()
+        if now < self._next_attempt:
+            raise socket.error('not connected to MPD, next attempt in %.1f s'
+                               % (self._next_attempt - now))
+        timeout = self.timeout
+        if self.connect_timeout != None:
+            timeout = self.connect_timeout
+        try:
+            self._socket = socket.create_connection((self.host, self.port),
+                                                    timeout)
+            self._file = self._socket.makefile('rb')
+            greeting = self._readline()
+            if not greeting.startswith('OK MPD '):
+                raise socket.error('%s:%d is not an MPD server'
+                                   % (self.host, self.port))
+            self.version = greeting[7:]
+            if self.password != None:
+                self._write(_line('password', [self.password]))
+                self._read_response('password')
+            self._socket.settimeout(self.timeout)
+        except:
+            self.close()
+            self._next_attempt = now + self.retry_interval
+            raise
+        self.connects += 1
+
+    def _readline(self):
+        line = self._file.readline()
+        if not line.endswith(b'\n'):
+            raise ConnectionResetError('connection to MPD lost')
+        self._lines += 1
+        return line[:-1].decode('utf-8', 'replace')
+
+    def _write(self, data):
+        self._socket.sendall(data.encode('utf-8'))
+
+    def _read_response(self, command, end = 'OK'):
+        '''
+        Read the key/value lines up to end, returned as a dictionary.
+        '''
+        result = {}
+        while True:
+            line = self._readline()
+            if line == end:
+                return result
+            if line.startswith('ACK '):
+                raise MPDError(command, line[4:])
+            key, sep, value = line.partition(': ')
+            if sep:
+                result[key] = value
+
+    def _execute(self, send, receive):
+        for attempt in (0, 1):
+            reused = self._socket != None
+            if not reused:
+                self.connect()
+            self._lines = 0
+            try:
+                send()
+                return receive()
+            except (socket.error, ValueError) as e:
+                self.close()
+                if attempt == 1 or not self.reconnect or not reused or \
+                   self._lines or not isinstance(e, _STALE_CONNECTION):
+                    raise
+
+    def command(self, command, *args):
+        '''
+        Send one command and return its response as a dictionary.
+        '''
+        return self._execute(lambda: self._write(_line(command, args)),
+                             lambda: self._read_response(command))
+
+    def command_list(self, commands):
+        '''
+        Send a list of (command, args...) tuples as one command list and
+        return their responses in the same order. MPD stops at a failing
+        command, its MPDError is raised.
+        '''
+        if not commands:
+            return []
+        lines = ['command_list_ok_begin\n']
+        for c in commands:
+            lines.append(_line(c[0], c[1:]))
+        lines.append('command_list_end\n')
+
+        def receive():
+            results = []
+            for c in commands:
+                results.append(self._read_response(c[0], 'list_OK'))
+            self._read_response('command_list_end')
+            return results
+        return self._execute(lambda: self._write(''.join(lines)), receive)
+
+    def shutdown(self):
+        '''
+        Interrupt a command waiting for MPD, may be called from another
+        thread.
+        '''
+        s = self._socket
+        if s != None:
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def close(self):
+        '''
+        Close the connection.
+        '''
+        if self._socket != None:
+            try:
+                self._file.close()
+                self._socket.close()
+            except socket.error:
+                pass
+            self._socket = None
+            self._file = None
+
+class MPDDispatcher(airpointr_media.CommandDispatcher):
+    '''
+    CommandDispatcher of an MPDConnection, notifications queued back to back
+    are sent as one command list.
+    '''
+
+    name = 'MPD'
+
+    log = log
+
+    def __init__(self, connection, maxsize = 32):
+        '''
+
+        '''
+        airpointr_media.CommandDispatcher.__init__(self, connection, maxsize)
+        self.connection = connection
+
+    def send_batch(self, commands):
+        '''
+        Send the (command, args...) tuples, several as one command list.
+        '''
+        if len(commands) == 1:
+            self.connection.command(*commands[0])
+        else:
+            self.connection.command_list(commands)
+        return 0
+
+class MPDStatusCache(object):
+    '''
+    Local copy of the MPD status.
+
+    A second connection waits with "idle player mixer" for changes of the
+    playback state or volume and reads the status after each change. The
+    listener, if any, is called with the new status from the cache thread.
+    '''
+
+    status = {}
+    '''
+    Last status reported by MPD, empty while not connected.
+    '''
+
+    def __init__(self, host = 'localhost', port = 6600, password = None,
+                 listener = None, retry_interval = 5.0, timeout = 5.0):
+        '''
+        timeout bounds the connect and login, idle is waited for without
+        one.
+        '''
+        self.connection = MPDConnection(host, port, password,
+                                        timeout = None, retry_interval = 0)
+        self.connection.connect_timeout = timeout
+        self.connection.reconnect = False
+        self.listener = listener
+        self.retry_interval = retry_interval
+        self.updates = 0
+        self._thread = None
+        self._running = False
+        self._wakeup = threading.Event()
+
+    @property
+    def state(self):
+        '''
+        Playback state "play", "pause" or "stop", None if unknown.
+        '''
+        return self.status.get('state')
+
+    @property
+    def volume(self):
+        '''
+        Volume in percent, None if unknown or MPD has no mixer.
+        '''
+        volume = int(self.status.get('volume', -1))
+        if volume < 0:
+            return None
+        return volume
+
+    def start(self):
+        '''
+        Start watching the status.
+        '''
+        self._running = True
+        self._wakeup.clear()
+        self._thread = threading.Thread(target = self._run,
+                                        name = 'mpd-status')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stop watching the status.
+        '''
+        self._running = False
+        self._wakeup.set()
+        self.connection.shutdown()
+        if self._thread != None:
+            # shutdown can not interrupt a connect in progress, it ends
+            # after the connect timeout at the latest
+            self._thread.join(self.connection.connect_timeout)
+            self._thread = None
+
+    def update(self, status):
+        '''
+        Replace the cached status.
+        '''
+        self.status = status
+        self.updates += 1
+        if self.listener != None:
+            try:
+                self.listener(status)
+            except Exception as e:
+                log.error("MPD Status: listener failed: %s", e)
+
+    def _run(self):
+        while self._running:
+            try:
+                self.update(self.connection.command('status'))
+                while self._running:
+                    self.connection.command('idle', 'player', 'mixer')
+                    self.update(self.connection.command('status'))
+            except (socket.error, MPDError) as e:
+                if self._running:
+                    log.warning("MPD Status: status connection failed: %s", e)
+            self.connection.close()
+            self.status = {}
+            if self._running:
+                # stop wakes us up at once
+                self._wakeup.wait(self.retry_interval)
+
+class MPDBackend(airpointr_media.MediaBackend):
+    '''
+    MPD as media player of the GestureEngine. The commands are sent by an
+    MPDDispatcher and chosen by the state of an MPDStatusCache.
+    '''
+
+    name = 'MPD'
+
+    def __init__(self, host = 'localhost', port = 6600, password = None):
+        '''
+
+        '''
+        self.dispatcher = MPDDispatcher(MPDConnection(host, port, password))
+        self.status = MPDStatusCache(host, port, password,
+                                     listener = self.handle_status)
+        self.last_state = None
+
+    def handle_status(self, status):
+        '''
+        Display the playback state if it has changed.
+        '''
+        if self.last_state == None:
+            log.info("Connection to mpd established")
+        if status.get('state') != self.last_state:
+            self.last_state = status.get('state')
+            log.info("Current mpd state = %s", self.last_state)
+
+    def open(self):
+        '''
+
+        '''
+        self.dispatcher.start()
+        self.status.start()
+
+    def close(self):
+        '''
+
+        '''
+        self.status.stop()
+        self.dispatcher.stop()
+
+    def reconnects(self):
+        '''
+        Connections to MPD reopened by the dispatcher and the status cache.
+        '''
+        return max(0, self.dispatcher.connection.connects - 1) + \
+               max(0, self.status.connection.connects - 1)
+
+    def volume(self):
+        '''
+
+        '''
+        return self.status.volume
+
+    def set_volume(self, volume):
+        '''
+
+        '''
+        self.dispatcher.notify('setvol', volume)
+        log.info("MPD Status: Volume changed to: %s%%", volume)
+
+    def forward(self):
+        '''
+
+        '''
+        state = self.status.state
+        if state == 'stop' or state == 'pause':
+            self.dispatcher.notify('play')
+        else:
+            self.dispatcher.notify('next')
+        log.info("Switched play-mode direction: forward")
+
+    def backward(self):
+        '''
+
+        '''
+        state = self.status.state
+        if state == 'play':
+            self.dispatcher.notify('pause')
+        elif state == 'pause':
+            self.dispatcher.notify('previous')
+        elif state == 'stop':
+            self.dispatcher.notify('play')
+            self.dispatcher.notify('previous')
+        else:
+            self.dispatcher.notify('play')
+        log.info("Switched play-mode direction: backward")
+
+    def _command(self, command):
+        self.dispatcher.notify(command)
+        log.info("MPD Status: Playback switched to: %s", command)
+
+    def play(self):
+        '''
+
+        '''
+        if self.status.state == 'play':
+            self._command('pause')
+        else:
+            self._command('play')
+
+    def next(self):
+        '''
+
+        '''
+        self._command('next')
+
+    def stop(self):
+        '''
+
+        '''
+        self._command('stop')
+
+    def previous(self):
+        '''
+
+        '''
+        self._command('previous')
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+'''
+Recording and replay of the datagrams sent by an AirPointr service.
+
+A log starts with the 8 byte MAGIC, followed by one record per datagram:
+a RECORD header with the monotonic receive time in nanoseconds, the IPv4
+address and port of the sender and the length of the payload, then the
+payload itself. Records are only ever appended, so a log cut short by a
+crash is readable up to its last complete record. A Recorder opening such a
+log cuts the incomplete record off before it appends.
+
+Recorder writes a log, GestureListener and GestureEngine take one as their
+recorder. Replayer feeds a log into a handler or over UDP, at the recorded
+pace, accelerated or as fast as possible.
+
+Usage:
+    airpointr_record.py record [--host HOST] [--port PORT] LOG
+    airpointr_record.py replay [--speed SPEED] [--to HOST:PORT | --listen PORT] LOG
+    airpointr_record.py info LOG
+'''
+
+import argparse
+import logging
+import os
+import socket
+import struct
+import sys
+import time
+
+import airpointr
+
+log = logging.getLogger('airpointr.record')
+
+MAGIC = b'APRLOG\x00\x01'
+'''
+First bytes of a log, the last one is the format version.
+'''
+
+RECORD = struct.Struct('<Q4sHH')
+'''
+Record header: receive time (ns), sender address, sender port, payload length.
+'''
+
+def _log_end(f, path):
+    '''
+    Offset behind the last complete record of the log open in f, 0 if it
+    is empty or cut short in the MAGIC.
+    '''
+    size = os.fstat(f.fileno()).st_size
+    f.seek(0)
+    magic = f.read(len(MAGIC))
+    if magic != MAGIC:
+        if MAGIC.startswith(magic):
+            return 0
+        raise ValueError('%s is not an AirPointr log' % path)
+    end = len(MAGIC)
+    while end + RECORD.size <= size:
+        f.seek(end)
+        length = RECORD.unpack(f.read(RECORD.size))[3]
+        if end + RECORD.size + length > size:
+            break
+        end += RECORD.size + length
+    return end
+
+class Recorder(object):
+    '''
+    Appends datagrams to a log file.
+
+    Records go through the write buffer of the file, flush writes them out.
+    If sched is given, this happens every flush_interval seconds.
+    '''
+
+    def __init__(self, path, flush_interval = 1.0, sched = None):
+        '''
+
+        '''
+        self.path = path
+        self.count = 0
+        self._file = open(path, 'ab+')
+        try:
+            end = _log_end(self._file, path)
+        except:
+            self._file.close()
+            raise
+        if end < self._file.seek(0, os.SEEK_END):
+            log.warning("%s: incomplete last record dropped", path)
+            self._file.truncate(end)
+        if end == 0:
+            self._file.write(MAGIC)
+        self._pack = RECORD.pack
+        # packed IPv4 addresses by host, names are resolved once
+        self._addresses = {}
+        self.flush_timer = None
+        if sched != None:
+            self.flush_timer = sched.call_every(flush_interval, self.flush,
+                                                delay = flush_interval)
+
+    def record(self, data, addr, t_ns = None):
+        '''
+        Append a datagram received from addr, at t_ns (monotonic clock) or
+        now.
+        '''
+        if t_ns == None:
+            t_ns = time.monotonic_ns()
+        ip = self._addresses.get(addr[0])
+        if ip == None:
+            ip = self._address(addr[0])
+        self._file.write(self._pack(t_ns, ip, addr[1], len(data)))
+        self._file.write(data)
+        self.count += 1
+
+    def _address(self, host):
+        '''
+        Packed IPv4 address of host, a name is resolved. If that fails the
+        records show 0.0.0.0, a recorder must not stop the listener.
+        '''
+        try:
+            ip = socket.inet_aton(socket.gethostbyname(host))
+        except (socket.error, UnicodeError) as e:
+            log.warning("cannot record the address of %r: %s", host, e)
+            ip = b'\0\0\0\0'
+        self._addresses[host] = ip
+        return ip
+
+    def flush(self):
+        '''
+        Write the buffered records to the file.
+        '''
+        if self._file != None:
+            self._file.flush()
+
+    def close(self):
+        '''
+        Flush and close the log.
+        '''
+        if self.flush_timer != None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        if self._file != None:
+            self._file.close()
+            self._file = None
+
+def read_log(path):
+    '''
+    Generator of the (t_ns, addr, data) records of a log.
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not an AirPointr log' % path)
+        size = RECORD.size
+        unpack = RECORD.unpack
+        while True:
+            header = f.read(size)
+            if len(header) < size:
+                return
+            t_ns, ip, port, length = unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                # the last record was cut short
+                return
+            yield t_ns, (socket.inet_ntoa(ip), port), data
+
+class Replayer(object):
+    '''
+    Plays a log back. speed 1 keeps the recorded pace, 10 is ten times as
+    fast, 0 sends as fast as possible.
+    '''
+
+    def __init__(self, path, speed = 1.0):
+        '''
+
+        '''
+        self.path = path
+        self.speed = speed
+        self.count = 0
+        self.late_ns = 0
+
+    def replay(self, handler):
+        '''
+        Call handler(data, addr) for every datagram of the log, returns the
+        number of datagrams.
+        '''
+        start = None
+        first = None
+        speed = self.speed
+        for t_ns, addr, data in read_log(self.path):
+            if speed:
+                now = time.monotonic_ns()
+                if start == None:
+                    start = now
+                    first = t_ns
+                due = start + int((t_ns - first) / speed)
+                if due > now:
+                    time.sleep((due - now) / 1e9)
+                else:
+                    # how far the replay runs behind the log
+                    self.late_ns = max(self.late_ns, now - due)
+            handler(data, addr)
+            self.count += 1
+        return self.count
+
+    def replay_udp(self, dest, sock = None):
+        '''
+        Send the datagrams of the log to dest, from sock if given.
+        '''
+        if sock == None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return self.replay(lambda data, addr: sock.sendto(data, dest))
+
+    def replay_service(self, port, host = '127.0.0.1'):
+        '''
+        Act as the gesture service on host:port: wait for a client to
+        register and send the log to it.
+        '''
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, port))
+        try:
+            while True:
+                data, client = sock.recvfrom(1024)
+                if data == b'register':
+                    break
+            sock.sendto(b'{"op": "register", "success": true}', client)
+            return self.replay_udp(client, sock)
+        finally:
+            sock.close()
+
+def info(path):
+    '''
+    Datagram count, duration in seconds and senders of a log.
+    '''
+    count = 0
+    first = last = None
+    senders = set()
+    for t_ns, addr, data in read_log(path):
+        if first == None:
+            first = t_ns
+        last = t_ns
+        senders.add(addr)
+        count += 1
+    duration = 0.0 if first == None else (last - first) / 1e9
+    return count, duration, sorted(senders)
+
+def record(path, host, port):
+    '''
+    Register to the gesture service on host:port and record until
+    interrupted.
+    '''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('', 0))
+    service = (host, port)
+    recorder = Recorder(path, sched = airpointr.scheduler)
+    # AirPointr service has to be kept alive
+    airpointr.scheduler.call_every(airpointr.HEARTBEAT_INTERVAL,
+                                   sock.sendto, b'register', service)
+    print("recording %s:%d to %s, stop with Ctrl-C" % (host, port, path))
+    try:
+        while True:
+            data, addr = airpointr.recvfrom(sock, 2048)
+            recorder.record(data, addr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.sendto(b'unregister', service)
+        recorder.close()
+    print("%d datagrams recorded" % recorder.count)
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Record and replay the '
+                                     'datagrams of an AirPointr service.')
+    commands = parser.add_subparsers(dest = 'command')
+    commands.required = True
+
+    p = commands.add_parser('record', help = 'record a gesture service')
+    p.add_argument('--host', default = '127.0.0.1')
+    p.add_argument('--port', type = int, default = 8981)
+    p.add_argument('log')
+
+    p = commands.add_parser('replay', help = 'replay a log')
+    p.add_argument('--speed', default = '1',
+                   help = 'factor of the recorded pace or "max" (default 1)')
+    target = p.add_mutually_exclusive_group()
+    target.add_argument('--to', metavar = 'HOST:PORT',
+                        help = 'send the datagrams to HOST:PORT')
+    target.add_argument('--listen', metavar = 'PORT', type = int,
+                        help = 'act as gesture service on PORT and send to '
+                        'the client that registers')
+    p.add_argument('log')
+
+    p = commands.add_parser('info', help = 'summary of a log')
+    p.add_argument('log')
+
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record(args.log, args.host, args.port)
+    elif args.command == 'replay':
+        speed = 0 if args.speed == 'max' else float(args.speed)
+        replayer = Replayer(args.log, speed)
+        t = time.monotonic()
+        if args.to != None:
+            host, port = args.to.rsplit(':', 1)
+            replayer.replay_udp((host, int(port)))
+        elif args.listen != None:
+            replayer.replay_service(args.listen)
+        else:
+            out = sys.stdout
+            replayer.replay(lambda data, addr: out.write('%s:%d %s\n' % (
+                addr[0], addr[1], data.decode('utf-8', 'replace'))))
+        print("%d datagrams replayed in %.3f s, at most %.1f ms late"
+              % (replayer.count, time.monotonic() - t,
+                 replayer.late_ns / 1e6))
+    else:
+        count, duration, senders = info(args.log)
+        print("%d datagrams, %.3f s" % (count, duration))
+        if duration > 0:
+            print("%.1f datagrams/s" % (count / duration))
+        for addr in senders:
+            print("from %s:%d" % addr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+#!/usr/bin/env python
+'''
+Gesture relay: many local consumers share one registration at an AirPointr
+service.
+
+The relay registers to the gesture service with a GestureListener, so the
+service sends every frame once, and passes the frames on to its
+subscribers over a Unix datagram socket (RELAY_PATH). A subscriber binds
+its own Unix datagram socket and sends "subscribe <filter> [<format>]" to
+the relay, like a client sends "register" to the service, and repeats it
+as heart beat. The format is the wire format of the frames, json by
+default or the binary one of airpointr_wire. Subscribers that stay silent for SUBSCRIBER_TIMEOUT seconds are
+dropped, "unsubscribe" leaves at once. The filter is one of FILTERS:
+
+    all      every frame
+    pointer  frames while the pointer is active, and the one ending it
+    events   frames with events or a smart circle selection
+    circle   frames while the circle is active, and the one ending it
+
+RelayListener is the subscriber side, with the handler callbacks of
+GestureListener. Consumers on the same machine can also read the frames
+from a shared memory ring the relay writes, see airpointr_shm. The relay
+never blocks on a subscriber: a frame that does not fit into the socket
+buffer of a subscriber is dropped for it. Towards the service the relay
+asks for the binary wire format unless --wire json is given, which saves
+bandwidth when the service is reached over Wi-Fi.
+
+Unix only. Usage:
+    airpointr_relay.py [--host HOST] [--port PORT] [--path PATH] [--ring [RING]]
+                       [--wire FORMAT]
+'''
+
+try:
+    import asyncore
+except ImportError:
+    # asyncore is gone since Python 3.12
+    asyncore = None
+import argparse
+import itertools
+import json
+import logging
+import os
+import socket
+import stat
+import sys
+import tempfile
+
+import airpointr
+import airpointr_log
+import airpointr_shm
+import airpointr_wire
+
+_dispatcher = getattr(asyncore, 'dispatcher', object)
+
+log = logging.getLogger('airpointr.relay')
+
+RELAY_PATH = os.path.join(tempfile.gettempdir(), 'airpointr-relay.sock')
+'''
+Default path of the relay socket.
+'''
+
+FILTERS = ('all', 'pointer', 'events', 'circle')
+'''
+Frame filters a subscriber can choose from.
+'''
+
+SUBSCRIBER_TIMEOUT = 3 * airpointr.HEARTBEAT_INTERVAL
+'''
+Seconds after which a subscriber that stopped sending heart beats is
+dropped.
+'''
+
+def frame_kinds(j, last = None):
+    '''
+    Filters a pointer message passes, last is the message before it.
+    '''
+    kinds = ['all']
+    if j[u'active'] or (last != None and last[u'active']):
+        kinds.append('pointer')
+    circle = j[u'circle']
+    if j[u'events'] or circle[u'smart'][u'actionSelect']:
+        kinds.append('events')
+    if circle[u'active'] or (last != None and last[u'circle'][u'active']):
+        kinds.append('circle')
+    return kinds
+
+def _ack(op, success, **fields):
+    return json.dumps(dict(fields, op = op, success = success)).encode()
+
+class Subscriber(object):
+    '''
+    Local consumer of the relay.
+    '''
+
+    def __init__(self, address, filter, now, format = airpointr_wire.JSON):
+        '''
+
+        '''
+        self.address = address
+        self.filter = filter
+        self.format = format
+        self.last_seen = now
+        self.sent = 0
+        self.dropped = 0
+
+class Relay(_dispatcher):
+    '''
+    Relay of the pointer frames of the gesture service on host:port to the
+    subscribers on the Unix datagram socket path and, if ring is given, to
+    an airpointr_shm ring in the file ring. wire is the wire format asked
+    from the service.
+    '''
+
+    subscriber_timeout = SUBSCRIBER_TIMEOUT
+    '''
+    Seconds after which a silent subscriber is dropped.
+    '''
+
+    def __init__(self, host = '127.0.0.1', port = 8981, path = RELAY_PATH,
+                 sched = None, ring = None, wire = airpointr_wire.BINARY):
+        '''
+
+        '''
+        _dispatcher.__init__(self)
+        if sched == None:
+            sched = airpointr.scheduler
+        self.sched = sched
+        self.path = path
+        self.subscribers = {}
+        self.frames = 0
+        self.last = None
+        self.ring = None
+        if ring != None:
+            self.ring = airpointr_shm.RingWriter(ring)
+        # a socket left behind by a relay that died is replaced
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+        self.create_socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.bind(path)
+        self.upstream = airpointr_wire.WireGestureListener(
+            self.handle_frame, host = host, port = port, wire = wire,
+            sched = sched)
+        self.expiry_timer = sched.call_every(airpointr.HEARTBEAT_INTERVAL,
+                                             self.expire)
+
+    def writable(self):
+        '''
+        The socket is only written by sendto.
+        '''
+        return False
+
+    def handle_read(self):
+        '''
+        Handle the subscriptions.
+        '''
+        try:
+            data, addr = self.socket.recvfrom(256)
+        except BlockingIOError:
+            return
+        if not addr:
+            # unbound sockets cannot be answered
+            return
+        words = data.split()
+        command = words[0].decode('ascii', 'replace') if words else ''
+        if command == 'subscribe':
+            name = words[1].decode('ascii', 'replace') if len(words) > 1 \
+                   else 'all'
+            format = words[2].decode('ascii', 'replace') if len(words) > 2 \
+                     else airpointr_wire.JSON
+            self.subscribe(addr, name, format)
+        elif command == 'unsubscribe':
+            self.unsubscribe(addr)
+
+    def subscribe(self, addr, name, format = airpointr_wire.JSON):
+        '''
+        Add a subscriber or renew its subscription.
+        '''
+        now = self.sched.clock()
+        if name not in FILTERS:
+            log.warning("unknown filter %r of subscriber %r", name, addr)
+            self._send(addr, _ack('subscribe', False))
+            return
+        if format not in airpointr_wire.FORMATS:
+            log.warning("unknown wire format %r of subscriber %r", format,
+                        addr)
+            self._send(addr, _ack('subscribe', False))
+            return
+        subscriber = self.subscribers.get(addr)
+        if subscriber != None and subscriber.filter == name and \
+           subscriber.format == format:
+            subscriber.last_seen = now
+            return
+        self.subscribers[addr] = Subscriber(addr, name, now, format)
+        log.info("subscriber %r: %s frames as %s, %d subscribers", addr, name,
+                 format, len(self.subscribers))
+        self._send(addr, _ack('subscribe', True, format = format))
+
+    def unsubscribe(self, addr):
+        '''
+        Remove a subscriber.
+        '''
+        if self.subscribers.pop(addr, None) != None:
+            log.info("subscriber %r left, %d subscribers", addr,
+                     len(self.subscribers))
+
+    def expire(self):
+        '''
+        Drop the subscribers that stopped sending heart beats.
+        '''
+        now = self.sched.clock()
+        for addr, subscriber in list(self.subscribers.items()):
+            if now - subscriber.last_seen > self.subscriber_timeout:
+                log.info("subscriber %r timed out", addr)
+                del self.subscribers[addr]
+
+    def _send(self, addr, data):
+        '''
+        Send without blocking, returns False if the datagram was dropped.
+        '''
+        try:
+            self.socket.sendto(data, addr)
+            return True
+        except BlockingIOError:
+            return False
+        except OSError as e:
+            # the subscriber is gone without unsubscribing, or its socket is
+            # broken, the others are served on
+            if self.subscribers.pop(addr, None) != None:
+                log.info("subscriber %r dropped: %s", addr, e)
+            return False
+
+    def handle_frame(self, j):
+        '''
+        Pass a pointer message of the service on to the subscribers.
+        '''
+        self.frames += 1
+        if self.ring != None:
+            self.ring.write(j)
+        kinds = frame_kinds(j, self.last)
+        self.last = j
+        encoded = {}
+        for subscriber in list(self.subscribers.values()):
+            if subscriber.filter not in kinds:
+                continue
+            data = encoded.get(subscriber.format)
+            if data == None:
+                # encoded once per format for all subscribers
+                data = encoded[subscriber.format] = \
+                    airpointr_wire.encode(j, subscriber.format)
+            if self._send(subscriber.address, data):
+                subscriber.sent += 1
+            else:
+                subscriber.dropped += 1
+
+    def close(self):
+        '''
+        Unregister from the service and remove the socket.
+        '''
+        if self.expiry_timer != None:
+            self.expiry_timer.cancel()
+            self.expiry_timer = None
+        self.upstream.unregister()
+        self.upstream.close()
+        _dispatcher.close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        if self.ring != None:
+            self.ring.close()
+
+_client_ids = itertools.count()
+
+def _client_address():
+    '''
+    Address for the socket of a subscriber: in the abstract namespace on
+    Linux, so no file is left behind, otherwise a file in the temp
+    directory.
+    '''
+    name = 'airpointr-relay-%d-%d' % (os.getpid(), next(_client_ids))
+    if sys.platform.startswith('linux'):
+        return '\0' + name
+    return os.path.join(tempfile.gettempdir(), name + '.sock')
+
+class RelayListener(_dispatcher):
+    '''
+    Subscriber of a Relay, calls handler with the pointer messages passing
+    filter, or with PointerFrame objects if typed is set. The frames are
+    sent in the wire format, see airpointr_wire.
+    '''
+
+    listener = None
+    '''
+    Gesture listener.
+    '''
+
+    subscribed = False
+    '''
+    True once the relay confirmed the subscription.
+    '''
+
+    def __init__(self, handler, filter = 'all', path = RELAY_PATH,
+                 typed = False, sched = None, wire = airpointr_wire.BINARY):
+        '''
+
+        '''
+        if filter not in FILTERS:
+            raise ValueError('unknown filter %r, expected one of %s'
+                             % (filter, ', '.join(FILTERS)))
+        if wire not in airpointr_wire.FORMATS:
+            raise ValueError('unknown wire format %r, expected one of %s'
+                             % (wire, ', '.join(airpointr_wire.FORMATS)))
+        _dispatcher.__init__(self)
+        self.create_socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.address = _client_address()
+        self.bind(self.address)
+        self.listener = handler
+        self.filter = filter
+        self.wire = wire
+        self.relay = path
+        self.typed = typed
+        if sched == None:
+            sched = airpointr.scheduler
+        self.send_heartbeat()
+        interval = airpointr.HEARTBEAT_INTERVAL
+        self.heartbeat_timer = sched.call_every(interval, self.send_heartbeat,
+                                                delay = interval)
+
+    def writable(self):
+        '''
+        The socket is only written by sendto.
+        '''
+        return False
+
+    def send_heartbeat(self, tmr = None):
+        '''
+        Subscribe, or renew the subscription.
+        '''
+        try:
+            self.socket.sendto(('subscribe %s %s' % (self.filter, self.wire))
+                               .encode('ascii'), self.relay)
+        except OSError as e:
+            # the relay is not running (yet), the next heart beat retries
+            self.subscribed = False
+            log.warning("relay %s: %s", self.relay, e)
+
+    def handle_read(self):
+        '''
+
+        '''
+        t = airpointr.perf_ns()
+        try:
+            data = self.socket.recv(65536)
+            if self.typed and airpointr_wire.is_binary(data):
+                # straight to the frame, without the detour over a message
+                j = airpointr_wire.decode_frame(data, t)
+            else:
+                j = airpointr_wire.decode(data)
+                if self.typed and airpointr.is_pointer_message(j):
+                    j = airpointr.PointerFrame.from_message(j, t)
+        except BlockingIOError:
+            return
+        except:
+            log.warning("invalid datagram from the relay: %r",
+                        sys.exc_info()[1])
+            return
+        if isinstance(j, airpointr.PointerFrame) or \
+           airpointr.is_pointer_message(j):
+            self.deliver(j)
+        elif j.get(u'op') == u'subscribe':
+            self.subscribed = bool(j.get(u'success'))
+
+    def deliver(self, item):
+        '''
+        Call the handler. An exception it raises is logged, it must not reach
+        asyncore, which would close the listener for good.
+        '''
+        try:
+            self.listener(item)
+        except Exception:
+            log.exception("gesture handler failed")
+
+    def unsubscribe(self):
+        '''
+        Leave the relay.
+        '''
+        try:
+            self.socket.sendto(b'unsubscribe', self.relay)
+        except OSError:
+            pass
+        self.subscribed = False
+
+    def close(self):
+        '''
+        Unsubscribe, stop the heart beats and close the socket.
+        '''
+        if self.heartbeat_timer != None:
+            self.heartbeat_timer.cancel()
+            self.heartbeat_timer = None
+            self.unsubscribe()
+        _dispatcher.close(self)
+        if not self.address.startswith('\0') and os.path.exists(self.address):
+            os.unlink(self.address)
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Relay the frames of an '
+                                     'AirPointr service to local subscribers.')
+    parser.add_argument('--host', default = '127.0.0.1',
+                        help = 'gesture service (default 127.0.0.1)')
+    parser.add_argument('--port', type = int, default = 8981)
+    parser.add_argument('--path', default = RELAY_PATH,
+                        help = 'relay socket (default %s)' % RELAY_PATH)
+    parser.add_argument('--ring', nargs = '?', const = airpointr_shm.RING_PATH,
+                        help = 'also write the frames to a shared memory ring '
+                        '(default %s)' % airpointr_shm.RING_PATH)
+    parser.add_argument('--wire', choices = airpointr_wire.FORMATS,
+                        default = airpointr_wire.BINARY,
+                        help = 'wire format asked from the service '
+                        '(default %s)' % airpointr_wire.BINARY)
+    args = parser.parse_args()
+
+    pipeline = airpointr_log.LogPipeline()
+    pipeline.start()
+    relay = Relay(args.host, args.port, args.path, ring = args.ring,
+                  wire = args.wire)
+    log.info("relaying %s:%d to %s", args.host, args.port, args.path)
+    try:
+        airpointr.loop()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        relay.close()
+        pipeline.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+'''
+Gesture rules of the media clients, loaded from mapping files.
+
+A mapping file is a json object with a list of rules and the optional
+volume control:
+
+    {
+        "rules": [
+            {"event": "rwipe", "action": "forward"},
+            {"smart": 0, "action": "play"},
+            {"segment": 2, "turns": 1, "action": "next"}
+        ],
+        "volume": {"turns": 2, "step": 2}
+    }
+
+Each rule has exactly one trigger: event fires on a pointer event, smart
+on the selection of a smart circle segment (0 north to 3 west), segment
+when the circle moves into that segment (0 to 7) after at least turns
+full turns. The rules are compiled into a RuleTable, so matching a frame
+costs a few dictionary or list lookups however many rules there are.
+'''
+
+import json
+
+CIRCLE_SEGMENTS = 8
+'''
+Number of segments of the circle gesture.
+'''
+
+class RuleTable(object):
+    '''
+    Gesture rules compiled into lookup tables, from trigger to action name.
+    '''
+
+    def __init__(self):
+        '''
+
+        '''
+        self.events = {}
+        self.smart = {}
+        self.segments = None
+        self.volume = None
+
+    def event_action(self, event):
+        '''
+        Action of a pointer event, None if there is no rule for it.
+        '''
+        return self.events.get(event)
+
+    def smart_action(self, segment):
+        '''
+        Action of a smart circle selection, None if there is no rule for it.
+        '''
+        return self.smart.get(segment)
+
+    def segment_action(self, segment, turns):
+        '''
+        Action of the circle entering segment after turns turns, None if
+        there is no rule for it.
+        '''
+        if self.segments == None:
+            return None
+        row = self.segments[segment % CIRCLE_SEGMENTS]
+        return row[min(int(abs(turns)), len(row) - 1)]
+
+def _segment_table(rules):
+    '''
+    Table of the actions by segment and full turns, the last column is used
+    for all turns from the highest threshold on.
+    '''
+    max_turns = max(turns for segment, turns, action in rules)
+    table = [[None] * (max_turns + 1) for i in range(CIRCLE_SEGMENTS)]
+    # lower thresholds first, a higher one overrides them from its column
+    for segment, turns, action in sorted(rules, key = lambda r: r[1]):
+        row = table[segment]
+        for t in range(turns, max_turns + 1):
+            row[t] = action
+    return table
+
+def _int(rule, key, low, high):
+    value = rule[key]
+    if isinstance(value, bool) or not isinstance(value, int) or \
+       not low <= value <= high:
+        raise ValueError('%s of rule %r must be an integer from %d to %d'
+                         % (key, rule, low, high))
+    return value
+
+def _volume(volume):
+    '''
+    Volume control of a mapping, with the defaults filled in.
+    '''
+    if not isinstance(volume, dict):
+        raise ValueError('volume %r must be an object with turns and step'
+                         % (volume,))
+    settings = { 'turns': volume.get('turns', 0),
+                 'step': volume.get('step', 2) }
+    # turns 0 starts the volume control right away, step 0 would never
+    # change the volume
+    for key, low in (('turns', 0), ('step', 1)):
+        value = settings[key]
+        if isinstance(value, bool) or not isinstance(value, int) or \
+           not low <= value <= 100:
+            raise ValueError('%s of volume %r must be an integer from %d to '
+                             '100' % (key, volume, low))
+    return settings
+
+def compile_rules(rules, volume = None, actions = None):
+    '''
+    Compile a list of rule dictionaries into a RuleTable. If actions is
+    given, rules with other actions raise ValueError, like malformed or
+    contradicting rules do.
+    '''
+    table = RuleTable()
+    segment_rules = {}
+    for rule in rules:
+        if 'action' not in rule:
+            raise ValueError('rule %r has no action' % (rule,))
+        action = rule['action']
+        if actions != None and action not in actions:
+            raise ValueError('unknown action %r, expected one of %s'
+                             % (action, ', '.join(actions)))
+        triggers = [k for k in ('event', 'smart', 'segment') if k in rule]
+        if len(triggers) != 1:
+            raise ValueError('rule %r needs exactly one of event, smart and '
+                             'segment' % (rule,))
+        if 'turns' in rule and triggers[0] != 'segment':
+            raise ValueError('turns of rule %r only applies to segment rules'
+                             % (rule,))
+
+        if triggers[0] == 'event':
+            key, target = rule['event'], table.events
+        elif triggers[0] == 'smart':
+            key, target = _int(rule, 'smart', 0, 3), table.smart
+        else:
+            key = (_int(rule, 'segment', 0, CIRCLE_SEGMENTS - 1),
+                   _int(rule, 'turns', 0, 100) if 'turns' in rule else 0)
+            target = segment_rules
+        if key in target and target[key] != action:
+            raise ValueError('rule %r contradicts an earlier rule' % (rule,))
+        target[key] = action
+
+    if segment_rules:
+        table.segments = _segment_table([k + (a,) for k, a in
+                                         segment_rules.items()])
+    if volume != None:
+        table.volume = _volume(volume)
+    return table
+
+def compile_mapping(mapping, actions = None):
+    '''
+    Compile a mapping into a RuleTable. Besides the rules list of a mapping
+    file, the events and smart dictionaries of the airpointr_media mappings
+    are understood.
+    '''
+    if isinstance(mapping, RuleTable):
+        return mapping
+    rules = list(mapping.get('rules', []))
+    for event, action in mapping.get('events', {}).items():
+        rules.append({ 'event': event, 'action': action })
+    for segment, action in mapping.get('smart', {}).items():
+        rules.append({ 'smart': int(segment), 'action': action })
+    return compile_rules(rules, mapping.get('volume'), actions)
+
+def load_mapping(path, actions = None):
+    '''
+    Read a mapping file and compile it into a RuleTable. Errors in the file
+    raise ValueError naming it.
+    '''
+    with open(path) as f:
+        mapping = json.load(f)
+    if not isinstance(mapping, dict):
+        raise ValueError('%s: a mapping has to be a json object' % path)
+    try:
+        return compile_mapping(mapping, actions)
+    except ValueError as e:
+        raise ValueError('%s: %s' % (path, e))
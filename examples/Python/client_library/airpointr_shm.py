@@ -0,0 +1,504 @@
+'''
+Pointer frames in shared memory, for consumers on the same machine.
+
+A frame is stored as a fixed FRAME record instead of json:
+
+    ts              int64   monotonic time in ns, when the service sent the
+                            frame if it tells, otherwise when it arrived
+    seq             uint32  sequence number of the service, 0 if none
+    x, y, turns     double
+    flags           uint8   FLAG_* bits
+    events          uint8   bit i set for EVENTS[i]
+    direction       int8
+    segment         uint8
+    action_segment  uint8
+    license         uint8   index into LICENSES, OTHER_LICENSE otherwise
+
+RingWriter appends frames to a ring of such records in a memory mapped
+file, the relay runs one (see airpointr_relay). RingReader follows the
+ring from any number of processes: reading a frame is a few struct unpacks
+on the mapping, without system calls or parsing. Each slot is guarded by a
+sequence number, like a seqlock: the writer stores it, odd, before it
+changes the slot and again, even, after, and tells which frame the slot
+holds. A reader checks it before and after reading the record and retries
+or drops the record if it changed. Readers that fall behind by more than
+the ring size lose the oldest frames and count them.
+
+What a reader can rely on: the sequence numbers and the frame count are
+aligned 32 bit words, which are stored and loaded in one access on x86 and
+ARM, the 32 bit Raspberry Pi included, so they are never seen half
+written. CPython has no memory barriers of its own. x86 keeps stores and
+loads in order anyway. ARM does not, so the accesses of the sequence
+numbers are fenced by taking a lock (see _fence), which issues the barrier
+with the C libraries of Linux; with that, a reader never returns a torn or
+overwritten record there either.
+
+The relay replaces the ring file when it restarts. A reader keeps the
+mapping of the file it opened, and whenever it finds no new frames, at
+most every check_interval seconds, it looks up whether path is still that
+file and maps the new one if not.
+
+RingListener calls a GestureListener style handler with the new frames,
+polling the ring from the scheduler.
+'''
+
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+import airpointr
+
+FRAME = struct.Struct('<qIdddBBbBBB')
+'''
+Pointer frame record, little endian.
+'''
+
+FLAG_ACTIVE = 1
+FLAG_CIRCLE = 2
+FLAG_SMART = 4
+FLAG_SELECT = 8
+'''
+Flags of a record: pointer active, circle active, smart circle enabled and
+smart circle action selected.
+'''
+
+EVENTS = (u'rwipe', u'lwipe')
+'''
+Events a record can carry, others are left out.
+'''
+
+LICENSES = (None, u'demo', u'licensed')
+'''
+License states a record can carry, any other state is stored as
+OTHER_LICENSE.
+'''
+
+OTHER_LICENSE = u'expired'
+'''
+License state of records of a service in none of the LICENSES states.
+'''
+
+MAGIC = b'APRRING\x02'
+'''
+First bytes of a ring file, the last one is the format version.
+'''
+
+HEADER = struct.Struct('=8sIII4x')
+'''
+Ring header: MAGIC, slot size, number of slots (a power of two), number of
+frames written modulo 2**32. Header and sequence numbers are in the byte
+order of the machine.
+'''
+
+# the frame count of the header and the sequence numbers of the slots are
+# 32 bit words, read and written through a memoryview in one access each
+_HEAD_WORD = 4
+_MASK = 0xffffffff
+_HALF = 0x80000000
+
+SLOT_SEQ_SIZE = 8
+'''
+Size of the sequence number in front of each record, a 32 bit word and
+padding: 2 * frame number + 1 while the frame is written, 2 * frame number
++ 2 once it is complete, both modulo 2**32.
+'''
+
+SLOT_SIZE = (SLOT_SEQ_SIZE + FRAME.size + 7) // 8 * 8
+'''
+Bytes per slot, records are aligned to 8 bytes.
+'''
+
+DEFAULT_DIRECTORY = '/dev/shm' if os.path.isdir('/dev/shm') \
+                    else tempfile.gettempdir()
+
+RING_PATH = os.path.join(DEFAULT_DIRECTORY, 'airpointr-frames')
+'''
+Default ring file, in memory backed /dev/shm where available.
+'''
+
+_FENCE = threading.Lock()
+
+def _fence():
+    '''
+    Memory barrier: stores and loads before it are not reordered with the
+    ones after it. Locks are built on the atomic operations of the C
+    library, which issue the barrier instructions where the processor
+    needs them, e.g. dmb on ARM.
+    '''
+    _FENCE.acquire()
+    _FENCE.release()
+
+_EVENT_BITS = dict((e, 1 << i) for i, e in enumerate(EVENTS))
+_LICENSE_CODES = dict((l, i) for i, l in enumerate(LICENSES))
+
+def frame_record(j, ts = 0, strict = False):
+    '''
+    FRAME values of a pointer message, ts is used if the message has no
+    time stamp. If strict is set, None is returned for messages a record
+    cannot carry exactly, i.e. with unknown events or license states.
+    '''
+    flags = FLAG_ACTIVE if j[u'active'] else 0
+    events = 0
+    for e in j[u'events']:
+        bit = _EVENT_BITS.get(e)
+        if bit == None:
+            if strict:
+                return None
+            continue
+        events |= bit
+    license = _LICENSE_CODES.get(j.get(u'license'))
+    if license == None:
+        if strict:
+            return None
+        license = len(LICENSES)
+    c = j.get(u'circle')
+    if c == None:
+        direction = segment = action_segment = 0
+        turns = 0.0
+    else:
+        s = c.get(u'smart')
+        if c[u'active']:
+            flags |= FLAG_CIRCLE
+        if s != None:
+            if s[u'enabled']:
+                flags |= FLAG_SMART
+            if s[u'actionSelect']:
+                flags |= FLAG_SELECT
+            action_segment = s[u'actionSegment']
+        else:
+            action_segment = 0
+        direction = c[u'direction']
+        segment = c[u'segment']
+        turns = c[u'turns']
+    return (j.get(u'ts', ts), j.get(u'seq', 0), j[u'x'], j[u'y'], turns,
+            flags, events, direction, segment, action_segment, license)
+
+def _events(bits):
+    return tuple(e for i, e in enumerate(EVENTS) if bits & (1 << i))
+
+def _license(code):
+    return LICENSES[code] if code < len(LICENSES) else OTHER_LICENSE
+
+def record_message(r):
+    '''
+    Pointer message of FRAME values, as the service would send it.
+    '''
+    ts, seq, x, y, turns, flags, events, direction, segment, \
+        action_segment, license = r
+    j = { u'type': u'pointer', u'x': x, u'y': y,
+          u'active': bool(flags & FLAG_ACTIVE),
+          u'events': list(_events(events)),
+          u'license': _license(license),
+          u'circle': { u'active': bool(flags & FLAG_CIRCLE),
+                       u'direction': direction, u'segment': segment,
+                       u'turns': turns,
+                       u'smart': { u'enabled': bool(flags & FLAG_SMART),
+                                   u'actionSelect': bool(flags & FLAG_SELECT),
+                                   u'actionSegment': action_segment } } }
+    if seq:
+        j[u'seq'] = seq
+    if ts:
+        j[u'ts'] = ts
+    return j
+
+def record_frame(r, recv_ns = None):
+    '''
+    airpointr.PointerFrame of FRAME values, without the detour over a
+    message.
+    '''
+    ts, seq, x, y, turns, flags, events, direction, segment, \
+        action_segment, license = r
+    smart = airpointr.SmartCircleState(bool(flags & FLAG_SMART),
+                                       bool(flags & FLAG_SELECT),
+                                       action_segment)
+    circle = airpointr.CircleState(bool(flags & FLAG_CIRCLE), direction,
+                                   segment, turns, smart)
+    return airpointr.PointerFrame(x, y, bool(flags & FLAG_ACTIVE),
+                                  _events(events), _license(license), circle,
+                                  recv_ns)
+
+class RingWriter(object):
+    '''
+    Writes pointer frames into a ring of slots records in the file path,
+    which is created or replaced. There must only be one writer per ring.
+    '''
+
+    def __init__(self, path = RING_PATH, slots = 256):
+        '''
+        slots must be a power of two, so the slot of a frame stays the same
+        when the frame count wraps around.
+        '''
+        if slots < 1 or slots & (slots - 1):
+            raise ValueError('slots must be a power of two, not %r' % slots)
+        self.path = path
+        self.slots = slots
+        self.count = 0
+        size = HEADER.size + slots * SLOT_SIZE
+        # a new file, readers of an old ring keep their own mapping of it
+        tmp = path + '.%d' % os.getpid()
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self._map, 0, MAGIC, SLOT_SIZE, slots, 0)
+        self._words = memoryview(self._map).cast('I')
+        os.rename(tmp, path)
+
+    def write_record(self, r):
+        '''
+        Append a record given as FRAME values.
+        '''
+        words = self._words
+        n = self.count
+        offset = HEADER.size + (n % self.slots) * SLOT_SIZE
+        word = offset >> 2
+        words[word] = (2 * n + 1) & _MASK
+        _fence()
+        FRAME.pack_into(self._map, offset + SLOT_SEQ_SIZE, *r)
+        _fence()
+        words[word] = (2 * n + 2) & _MASK
+        self.count = n + 1
+        words[_HEAD_WORD] = self.count & _MASK
+
+    def write(self, j, ts = None):
+        '''
+        Append a pointer message, received at ts (monotonic clock, ns) or
+        now.
+        '''
+        if ts == None:
+            ts = time.monotonic_ns()
+        self.write_record(frame_record(j, ts))
+
+    def close(self):
+        '''
+        Unmap the ring and remove its file.
+        '''
+        if self._map != None:
+            self._words.release()
+            self._map.close()
+            self._map = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+class RingReader(object):
+    '''
+    Follows the ring in the file path. read returns the frames written
+    since the last call, starting with the newest slots frames that were
+    in the ring when the reader was opened if backlog is set, otherwise
+    with the next frame. If the ring file is replaced, the reader continues
+    with the newest slots frames of the new ring.
+    '''
+
+    retries = 8
+    '''
+    Attempts to read a slot the writer is changing.
+    '''
+
+    check_interval = 1.0
+    '''
+    Minimum seconds between two checks whether the ring file was replaced.
+    '''
+
+    def __init__(self, path = RING_PATH, backlog = False):
+        '''
+
+        '''
+        self.path = path
+        self._map = None
+        count = self._open()
+        self.next = max(0, count - self.slots) if backlog else count
+        self.lost = 0
+        self.reopens = 0
+        self._checked = time.monotonic()
+
+    def _open(self):
+        '''
+        Map the ring file, returns its frame count.
+        '''
+        with open(self.path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            m = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, slot_size, slots, count = HEADER.unpack_from(m, 0)
+        if magic != MAGIC or slot_size != SLOT_SIZE:
+            m.close()
+            raise ValueError('%s is not an AirPointr frame ring' % self.path)
+        self.close()
+        self._map = m
+        self._words = memoryview(m).cast('I')
+        self.slots = slots
+        # the mapping keeps the file alive, so no new file gets its inode
+        self._file_id = (st.st_dev, st.st_ino)
+        return count
+
+    def replaced(self):
+        '''
+        True if path is a new ring file, e.g. of a restarted relay.
+        '''
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            # the writer is gone, maybe for good, keep the old ring
+            return False
+        return (st.st_dev, st.st_ino) != self._file_id
+
+    def _check(self):
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return False
+        self._checked = now
+        if not self.replaced():
+            return False
+        try:
+            count = self._open()
+        except (OSError, ValueError):
+            # caught while the writer sets the new file up, retry later
+            return False
+        self.next = max(0, count - self.slots)
+        self.reopens += 1
+        return True
+
+    def _count(self):
+        '''
+        Frames written, the 32 bit count of the header extended by next.
+        '''
+        return self.next + ((self._words[_HEAD_WORD] - self.next) & _MASK)
+
+    def pending(self):
+        '''
+        Number of frames written and not read yet.
+        '''
+        return self._count() - self.next
+
+    def read_slot(self, n):
+        '''
+        FRAME values of frame number n, None if it was overwritten.
+        '''
+        words = self._words
+        offset = HEADER.size + (n % self.slots) * SLOT_SIZE
+        word = offset >> 2
+        done = (2 * n + 2) & _MASK
+        for attempt in range(self.retries):
+            seq = words[word]
+            _fence()
+            later = (seq - done) & _MASK
+            if later == 0:
+                r = FRAME.unpack_from(self._map, offset + SLOT_SEQ_SIZE)
+                _fence()
+                if words[word] == done:
+                    return r
+            elif later < _HALF:
+                # a later frame is in the slot, or being written to it
+                return None
+        return None
+
+    def read(self, limit = None):
+        '''
+        List of the FRAME values of the new frames, at most limit.
+        '''
+        count = self._count()
+        if count == self.next and self._check():
+            count = self._count()
+        if count - self.next > self.slots:
+            # the writer lapped us, the oldest frames are gone
+            self.lost += count - self.slots - self.next
+            self.next = count - self.slots
+        if limit != None:
+            count = min(count, self.next + limit)
+        records = []
+        read_slot = self.read_slot
+        for n in range(self.next, count):
+            r = read_slot(n)
+            if r == None:
+                self.lost += 1
+            else:
+                records.append(r)
+        self.next = count
+        return records
+
+    def latest(self):
+        '''
+        FRAME values of the newest frame, None if there is none. Frames
+        before it are skipped.
+        '''
+        count = self._count()
+        if count == self.next and self._check():
+            count = self._count()
+        self.next = count
+        if count == 0:
+            return None
+        return self.read_slot(count - 1)
+
+    def close(self):
+        '''
+        Unmap the ring.
+        '''
+        if self._map != None:
+            self._words.release()
+            self._map.close()
+            self._map = None
+
+class RingListener(object):
+    '''
+    Calls handler with the frames of a ring, like a GestureListener does
+    with the datagrams of a service: with pointer messages, PointerFrame
+    objects if typed is set, and with a list per poll in drain mode. The
+    ring is polled every interval seconds from the scheduler, by
+    airpointr.loop next to other listeners or by run.
+    '''
+
+    def __init__(self, handler, path = RING_PATH, typed = False,
+                 drain = False, interval = 0.004, sched = None):
+        '''
+
+        '''
+        self.listener = handler
+        self.typed = typed
+        self.drain = drain
+        self.reader = RingReader(path)
+        if sched == None:
+            sched = airpointr.scheduler
+        self.sched = sched
+        self.poll_timer = sched.call_every(interval, self.poll)
+
+    def poll(self):
+        '''
+        Hand the new frames to the handler.
+        '''
+        records = self.reader.read()
+        if not records:
+            return
+        t = airpointr.perf_ns()
+        if self.typed:
+            frames = [record_frame(r, t) for r in records]
+        else:
+            frames = [record_message(r) for r in records]
+        if self.drain:
+            self.listener(frames)
+        else:
+            for frame in frames:
+                self.listener(frame)
+
+    def run(self):
+        '''
+        Poll until closed, for processes without sockets to wait on.
+        '''
+        sched = self.sched
+        while self.poll_timer != None:
+            t = sched.timeout()
+            if t:
+                time.sleep(t)
+            sched.run_pending()
+
+    def close(self):
+        '''
+        Stop polling and unmap the ring.
+        '''
+        if self.poll_timer != None:
+            self.poll_timer.cancel()
+            self.poll_timer = None
+        self.reader.close()
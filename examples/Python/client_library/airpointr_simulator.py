@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+'''
+AirPointr service simulator for load and latency tests without a camera.
+
+Simulator speaks the protocol of the service: it broadcasts discovery
+messages, answers register and unregister with op messages and streams
+pointer messages of synthetic gestures (swipes, circles and smart circle
+selections) to the registered clients. Besides the fields of the service,
+every pointer message carries a sequence number "seq" and the send time
+"ts" (monotonic clock in nanoseconds), so clients can count dropped frames
+and measure the latency. Clients ignore fields they do not know. Clients
+asking for the binary wire format get the frames in it, see
+airpointr_wire.
+
+LoadTest registers a number of clients to a simulator and reports the
+frames received, lost and their latency.
+
+Usage:
+    airpointr_simulator.py serve [--port PORT] [--rate HZ] [--gestures G,..]
+    airpointr_simulator.py load [--clients N] [--rate HZ] [--duration S]
+                                [--wire FORMAT]
+'''
+
+import argparse
+import json
+import math
+import selectors
+import socket
+import threading
+import time
+
+import airpointr
+import airpointr_wire
+
+CLIENT_TIMEOUT = 30
+'''
+Seconds after which a client that stopped sending heart beats is dropped.
+'''
+
+def pointer_message(x = 0.5, y = 0.5, active = True, events = (),
+                    circle = None, license = 'licensed'):
+    '''
+    Pointer message as sent by the service.
+    '''
+    if circle == None:
+        circle = circle_state()
+    return { 'type': 'pointer', 'x': x, 'y': y, 'active': active,
+             'events': list(events), 'circle': circle, 'license': license }
+
+def circle_state(active = False, direction = 0, segment = 0, turns = 0.0,
+                 action_select = False, action_segment = 0):
+    '''
+    "circle" dictionary of a pointer message.
+    '''
+    return { 'active': active, 'direction': direction, 'segment': segment,
+             'turns': turns,
+             'smart': { 'enabled': True, 'actionSelect': action_select,
+                        'actionSegment': action_segment } }
+
+def idle(frames = 30):
+    '''
+    Pointer resting near the center.
+    '''
+    for i in range(frames):
+        yield pointer_message(0.5 + 0.01 * math.sin(i / 5.0),
+                              0.5 + 0.01 * math.cos(i / 5.0))
+
+def swipe(event = 'rwipe', frames = 10):
+    '''
+    Pointer moving across, with the event in the last frame.
+    '''
+    sign = 1 if event == 'rwipe' else -1
+    for i in range(frames):
+        x = 0.5 + sign * (i / float(frames - 1) - 0.5) * 0.8
+        yield pointer_message(x, 0.5, events = [event] if i == frames - 1
+                              else [])
+
+def circle(turns = 3.0, direction = 1, frames_per_turn = 24):
+    '''
+    Pointer circling, turns full turns clockwise (direction 1) or
+    counterclockwise (-1).
+    '''
+    frames = int(turns * frames_per_turn)
+    for i in range(frames + 1):
+        t = i / float(frames_per_turn)
+        a = 2 * math.pi * t * direction
+        segment = int(t * 8) % 8
+        if direction < 0:
+            segment = (8 - segment) % 8
+        yield pointer_message(0.5 + 0.2 * math.sin(a), 0.5 - 0.2 * math.cos(a),
+                              circle = circle_state(True, direction, segment,
+                                                    round(t * direction, 3)))
+
+def smart_select(segment = 0, frames = 12):
+    '''
+    Short circle ending with the selection of a smart circle segment.
+    '''
+    for i in range(frames):
+        yield pointer_message(0.5, 0.3, circle = circle_state(
+            True, 0, segment * 2, 0.25, i == frames - 1, segment))
+
+GESTURES = {
+    'idle': lambda: idle(),
+    'swipe': lambda: list(swipe('rwipe')) + list(idle(10)) +
+                     list(swipe('lwipe')),
+    'circle': lambda: list(circle(3.0, 1)) + list(circle(3.0, -1)),
+    'smart': lambda: [f for s in range(4) for f in
+                      list(smart_select(s)) + list(idle(10))],
+}
+'''
+Gesture sequences the simulator can stream, by name.
+'''
+
+def gesture_stream(names):
+    '''
+    Endless stream of the frames of the named gestures, with idle frames
+    between them.
+    '''
+    while True:
+        for name in names:
+            for frame in GESTURES[name]():
+                yield frame
+            for frame in idle(10):
+                yield frame
+
+class Simulator(object):
+    '''
+    Simulated AirPointr service on an UDP port, driven by the scheduler
+    sched (airpointr.scheduler by default) in run.
+    '''
+
+    def __init__(self, port = 8981, host = '', rate = 60.0,
+                 gestures = ('swipe', 'circle', 'smart'),
+                 license = 'licensed', hostname = None, discovery_port = 8980,
+                 discovery_interval = 1.0, discovery_targets = ('<broadcast>',),
+                 sched = None):
+        '''
+        Pointer messages are sent rate times per second, discovery messages
+        every discovery_interval seconds to all discovery_targets (no
+        discovery if empty).
+        '''
+        if sched == None:
+            sched = airpointr.scheduler
+        for name in gestures:
+            if name not in GESTURES:
+                raise ValueError('unknown gesture %r, expected one of %s'
+                                 % (name, ', '.join(sorted(GESTURES))))
+        self.sched = sched
+        self.rate = rate
+        self.license = license
+        self.hostname = hostname or socket.gethostname()
+        self.discovery_port = discovery_port
+        self.discovery_interval = discovery_interval
+        self.discovery_targets = discovery_targets
+        self.clients = {}
+        self.formats = {}
+        self.seq = 0
+        self.sent = 0
+        self.send_errors = 0
+        self.frames = gesture_stream(gestures)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.port = self.sock.getsockname()[1]
+        self.timers = []
+        self._running = False
+
+    def discovery_message(self):
+        '''
+        Encoded discovery message.
+        '''
+        return json.dumps({ 'type': 'discovery', 'hostname': self.hostname,
+                            'services': ['udp:%d' % self.port] }).encode()
+
+    def send_discovery(self):
+        '''
+        Send a discovery message to all discovery targets.
+        '''
+        data = self.discovery_message()
+        for target in self.discovery_targets:
+            try:
+                self.sock.sendto(data, (target, self.discovery_port))
+            except socket.error:
+                self.send_errors += 1
+
+    def handle_datagram(self, data, addr):
+        '''
+        Handle a register, unregister or wire format request of a client.
+        '''
+        op = data.strip().decode('utf-8', 'replace')
+        if op == 'register':
+            self.clients[addr] = self.sched.clock()
+        elif op == 'unregister':
+            self.clients.pop(addr, None)
+            self.formats.pop(addr, None)
+        else:
+            format = airpointr_wire.parse_request(data)
+            if format != None:
+                self.handle_wire_request(format, addr)
+            return
+        self.sock.sendto(json.dumps({ 'op': op, 'success': True }).encode(),
+                         addr)
+
+    def handle_wire_request(self, format, addr):
+        '''
+        Switch a client to the wire format it asked for, if it is known.
+        '''
+        success = format in airpointr_wire.FORMATS
+        if success:
+            if format == airpointr_wire.JSON:
+                self.formats.pop(addr, None)
+            else:
+                self.formats[addr] = format
+        reply = { 'op': 'wire', 'success': success,
+                  'format': self.formats.get(addr, airpointr_wire.JSON) }
+        self.sock.sendto(json.dumps(reply).encode(), addr)
+
+    def expire(self):
+        '''
+        Drop the clients whose last heart beat is too old.
+        '''
+        limit = self.sched.clock() - CLIENT_TIMEOUT
+        for addr, t in list(self.clients.items()):
+            if t < limit:
+                del self.clients[addr]
+                self.formats.pop(addr, None)
+
+    def send_frame(self):
+        '''
+        Send the next pointer message to all clients.
+        '''
+        if not self.clients:
+            return
+        frame = next(self.frames)
+        frame['license'] = self.license
+        self.seq += 1
+        frame['seq'] = self.seq
+        frame['ts'] = time.monotonic_ns()
+        encoded = {}
+        for addr in list(self.clients):
+            format = self.formats.get(addr, airpointr_wire.JSON)
+            data = encoded.get(format)
+            if data == None:
+                # encoded once per format
+                data = encoded[format] = airpointr_wire.encode(frame, format)
+            try:
+                self.sock.sendto(data, addr)
+                self.sent += 1
+            except socket.error:
+                self.send_errors += 1
+
+    def start(self):
+        '''
+        Schedule the frames, discovery and client expiry.
+        '''
+        self._running = True
+        self.timers = [self.sched.call_every(1.0 / self.rate, self.send_frame),
+                       self.sched.call_every(1, self.expire, delay = 1)]
+        if self.discovery_targets:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            self.timers.append(self.sched.call_every(self.discovery_interval,
+                                                     self.send_discovery))
+
+    def run(self):
+        '''
+        Serve until stop is called.
+        '''
+        self.start()
+        while self._running:
+            try:
+                data, addr = airpointr.recvfrom(self.sock, 1024, self.sched)
+            except socket.error:
+                break
+            self.handle_datagram(data, addr)
+
+    def stop(self):
+        '''
+        Stop serving, may be called from another thread.
+        '''
+        self._running = False
+        for timer in self.timers:
+            timer.cancel()
+        self.timers = []
+        # wake up run
+        try:
+            self.sock.sendto(b'', ('127.0.0.1', self.port))
+        except socket.error:
+            pass
+
+    def close(self):
+        '''
+
+        '''
+        self.stop()
+        self.sock.close()
+
+def percentile(values, p):
+    '''
+    p-th percentile of the sorted list values.
+    '''
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+class LoadTest(object):
+    '''
+    Registers clients to the service on host:port and measures, for each of
+    them, the frames received, the frames lost (gaps in seq) and the
+    latency from the ts field to the reception.
+    '''
+
+    def __init__(self, host = '127.0.0.1', port = 8981, clients = 10,
+                 rcvbuf = None, wire = airpointr_wire.JSON):
+        '''
+        rcvbuf sets the receive buffer size of the client sockets, wire the
+        wire format the clients ask for.
+        '''
+        self.service = (host, port)
+        self.wire = wire
+        self.socks = []
+        for i in range(clients):
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if rcvbuf != None:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+            s.bind(('', 0))
+            s.setblocking(False)
+            self.socks.append(s)
+        self.received = [0] * clients
+        self.lost = [0] * clients
+        self.bytes = 0
+        self.latencies = []
+
+    def register(self):
+        '''
+        Register all clients, or renew their registration.
+        '''
+        for s in self.socks:
+            s.sendto(b'register', self.service)
+            if self.wire != airpointr_wire.JSON:
+                s.sendto(airpointr_wire.request(self.wire), self.service)
+
+    def run(self, duration):
+        '''
+        Receive for duration seconds, returns the summary.
+        '''
+        self.register()
+        selector = selectors.DefaultSelector()
+        for i, s in enumerate(self.socks):
+            selector.register(s, selectors.EVENT_READ, i)
+        last_seq = [None] * len(self.socks)
+        start = time.monotonic()
+        heartbeat = start
+        end = start + duration
+        while True:
+            now = time.monotonic()
+            if now >= end:
+                break
+            if now - heartbeat >= airpointr.HEARTBEAT_INTERVAL:
+                heartbeat = now
+                self.register()
+            for key, mask in selector.select(end - now):
+                i = key.data
+                while True:
+                    try:
+                        data = key.fileobj.recv(2048)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    t = time.monotonic_ns()
+                    j = airpointr_wire.decode(data)
+                    if 'seq' not in j:
+                        continue
+                    self.received[i] += 1
+                    self.bytes += len(data)
+                    self.latencies.append(t - j['ts'])
+                    if last_seq[i] != None and j['seq'] > last_seq[i] + 1:
+                        self.lost[i] += j['seq'] - last_seq[i] - 1
+                    last_seq[i] = j['seq']
+        for s in self.socks:
+            s.sendto(b'unregister', self.service)
+        selector.close()
+        return self.summary(duration)
+
+    def summary(self, duration):
+        '''
+        Dictionary of the totals and latency percentiles in microseconds.
+        '''
+        received = sum(self.received)
+        lost = sum(self.lost)
+        latencies = sorted(self.latencies)
+        return { 'clients': len(self.socks),
+                 'received': received,
+                 'lost': lost,
+                 'loss': lost / float(received + lost) if received + lost
+                         else 0.0,
+                 'frames_per_s': received / float(duration),
+                 'bytes_per_frame': self.bytes / float(received) if received
+                                    else 0.0,
+                 'p50_us': percentile(latencies, 50) / 1e3,
+                 'p99_us': percentile(latencies, 99) / 1e3,
+                 'max_us': (latencies[-1] if latencies
+                            else float('nan')) / 1e3 }
+
+    def close(self):
+        '''
+
+        '''
+        for s in self.socks:
+            s.close()
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Simulated AirPointr '
+                                     'service and load test.')
+    commands = parser.add_subparsers(dest = 'command')
+    commands.required = True
+
+    for name in ('serve', 'load'):
+        p = commands.add_parser(name)
+        p.add_argument('--port', type = int,
+                       default = 8981 if name == 'serve' else 0)
+        p.add_argument('--rate', type = float, default = 60.0,
+                       help = 'pointer messages per second (default 60)')
+        p.add_argument('--gestures', default = 'swipe,circle,smart',
+                       help = 'comma separated, from %s'
+                       % ', '.join(sorted(GESTURES)))
+        p.add_argument('--license', default = 'licensed')
+    serve = commands.choices['serve']
+    serve.add_argument('--no-discovery', action = 'store_true')
+    serve.add_argument('--discovery-target', action = 'append',
+                       help = 'address the discovery messages are sent to '
+                       '(default broadcast), may be repeated')
+    load = commands.choices['load']
+    load.add_argument('--clients', type = int, default = 10)
+    load.add_argument('--duration', type = float, default = 10.0)
+    load.add_argument('--wire', choices = airpointr_wire.FORMATS,
+                      default = airpointr_wire.JSON,
+                      help = 'wire format the clients ask for (default json)')
+    load.add_argument('--host', help = 'test a running service instead of '
+                      'a simulator started in this process')
+
+    args = parser.parse_args()
+    gestures = args.gestures.split(',')
+
+    if args.command == 'serve':
+        targets = args.discovery_target or ['<broadcast>']
+        sim = Simulator(args.port, rate = args.rate, gestures = gestures,
+                        license = args.license,
+                        discovery_targets = () if args.no_discovery
+                                            else targets)
+        print("simulating AirPointr service on port %d, %.0f frames/s"
+              % (sim.port, args.rate))
+        try:
+            sim.run()
+        except KeyboardInterrupt:
+            pass
+        sim.close()
+        print("%d frames sent" % sim.sent)
+        return
+
+    sim = None
+    host, port = args.host, args.port
+    if host == None:
+        sim = Simulator(args.port, '127.0.0.1', args.rate, gestures,
+                        args.license, discovery_targets = (),
+                        sched = airpointr.Scheduler())
+        host, port = '127.0.0.1', sim.port
+        threading.Thread(target = sim.run, daemon = True).start()
+    test = LoadTest(host, port, args.clients, wire = args.wire)
+    s = test.run(args.duration)
+    test.close()
+    if sim != None:
+        sim.close()
+    print("%(clients)d clients, %(received)d frames received, %(lost)d lost "
+          "(%(loss).2f%%)" % dict(s, loss = s['loss'] * 100))
+    print("%(frames_per_s).0f frames/s, %(bytes_per_frame).0f bytes/frame, "
+          "latency p50 %(p50_us).0f us, p99 %(p99_us).0f us, "
+          "max %(max_us).0f us" % s)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+'''
+Latency statistics of the gesture pipeline.
+
+A frame is stamped with perf_ns() when its datagram is received. The time
+from there to the end of each stage goes into a Histogram per stage:
+
+    decode   datagram parsed into a message or PointerFrame
+    handler  handler of the frame returned
+    issue    backend command taken from the dispatcher queue and sent
+    ack      backend answered the command (measured from issue)
+    total    backend answered the command (measured from the reception)
+
+GestureListener and GestureEngine take a LatencyStats object as stats, the
+Kodi and MPD dispatchers record issue, ack and total to it.
+'''
+
+import logging
+import threading
+
+import airpointr
+
+log = logging.getLogger('airpointr.stats')
+
+STAGES = ('decode', 'handler', 'issue', 'ack', 'total')
+'''
+Stages of the pipeline, in order.
+'''
+
+class Histogram(object):
+    '''
+    Log-linear histogram of non-negative integers in the style of
+    HdrHistogram. Values below 2**sub_bucket_bits are counted exactly, above
+    each power of two range is split into 2**(sub_bucket_bits - 1) linear
+    buckets, so values are kept with a relative error below
+    2**(1 - sub_bucket_bits), about 3% for the default of 6 bits. Recording
+    costs a few integer operations and memory grows with the log of the
+    largest value only.
+    '''
+
+    def __init__(self, sub_bucket_bits = 6):
+        '''
+
+        '''
+        self.sub_bucket_bits = sub_bucket_bits
+        self._half = 1 << (sub_bucket_bits - 1)
+        self._linear = 1 << sub_bucket_bits
+        self.reset()
+
+    def reset(self):
+        '''
+        Forget all values.
+        '''
+        self.counts = [0] * self._linear
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        if value < self._linear:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self._linear + (shift - 1) * self._half + \
+               (value >> shift) - self._half
+
+    def _highest(self, index):
+        '''
+        Largest value counted in bucket index.
+        '''
+        if index < self._linear:
+            return index
+        shift, sub = divmod(index - self._linear, self._half)
+        shift += 1
+        return ((self._half + sub + 1) << shift) - 1
+
+    def record(self, value):
+        '''
+        Count value, negative values count as 0.
+        '''
+        value = max(0, int(value))
+        index = self._index(value)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        self.count += 1
+        self.total += value
+        if self.min == None or value < self.min:
+            self.min = value
+        if self.max == None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        '''
+        Add the values of another histogram with the same sub_bucket_bits.
+        '''
+        if other.count == 0:
+            return
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min == None else min(self.min, other.min)
+        self.max = other.max if self.max == None else max(self.max, other.max)
+
+    @property
+    def mean(self):
+        '''
+        Mean of the values, None if empty.
+        '''
+        if self.count == 0:
+            return None
+        return self.total / float(self.count)
+
+    def percentile(self, p):
+        '''
+        Value below or at which p percent of the values are, None if empty.
+        '''
+        if self.count == 0:
+            return None
+        rank = max(1, int(round(self.count * p / 100.0)))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(self._highest(i), self.max)
+        return self.max
+
+class LatencyStats(object):
+    '''
+    Histograms of the stage latencies in nanoseconds. Each stage is
+    recorded from one thread only, reading is possible at any time.
+    '''
+
+    percentiles = (50, 90, 99)
+    '''
+    Percentiles shown in the summary.
+    '''
+
+    def __init__(self, stages = STAGES):
+        '''
+
+        '''
+        self.stages = stages
+        self.histograms = dict((s, Histogram()) for s in stages)
+        self.report_timer = None
+        self._lock = threading.Lock()
+
+    def record(self, stage, ns):
+        '''
+        Record a latency of stage in nanoseconds.
+        '''
+        self.histograms[stage].record(ns)
+
+    def stamp(self, stage, recv_ns):
+        '''
+        Record the time from recv_ns until now for stage, returns now.
+        '''
+        now = airpointr.perf_ns()
+        self.histograms[stage].record(now - recv_ns)
+        return now
+
+    def reset(self):
+        '''
+        Forget all latencies.
+        '''
+        with self._lock:
+            for h in self.histograms.values():
+                h.reset()
+
+    def summary(self):
+        '''
+        Dictionary of the stages with count, mean, percentiles (p50, ...)
+        and max, in microseconds. Stages without values are left out.
+        '''
+        result = {}
+        with self._lock:
+            for stage in self.stages:
+                h = self.histograms[stage]
+                if h.count == 0:
+                    continue
+                s = { 'count': h.count, 'mean': h.mean / 1e3,
+                      'max': h.max / 1e3 }
+                for p in self.percentiles:
+                    s['p%d' % p] = h.percentile(p) / 1e3
+                result[stage] = s
+        return result
+
+    def format_summary(self):
+        '''
+        Summary as a table.
+        '''
+        columns = ['p%d' % p for p in self.percentiles] + ['max']
+        lines = ['%-8s %8s %9s' % ('stage', 'count', 'mean us') +
+                 ''.join('%9s' % (c + ' us') for c in columns)]
+        summary = self.summary()
+        for stage in self.stages:
+            if stage in summary:
+                s = summary[stage]
+                lines.append('%-8s %8d %9.0f' % (stage, s['count'], s['mean'])
+                             + ''.join('%9.0f' % s[c] for c in columns))
+        return '\n'.join(lines)
+
+    def report(self, reset = True):
+        '''
+        Log the summary, then forget the latencies if reset is set.
+        '''
+        if any(h.count for h in self.histograms.values()):
+            log.info("latencies:\n%s", self.format_summary())
+        if reset:
+            self.reset()
+
+    def report_every(self, interval, reset = True, sched = None):
+        '''
+        Log the summary every interval seconds from the scheduler.
+        '''
+        if sched == None:
+            sched = airpointr.scheduler
+        self.report_timer = sched.call_every(interval, self.report, reset,
+                                             delay = interval)
+        return self.report_timer
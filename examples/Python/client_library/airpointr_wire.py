@@ -0,0 +1,186 @@
+'''
+Compact binary wire format of the pointer frames.
+
+A pointer message of the service is some 250 bytes of json with nested
+objects, parsed on every frame. In the binary format a frame is the fixed
+airpointr_shm.FRAME record behind the two MAGIC bytes, 44 bytes which are
+decoded by one struct unpack.
+
+The format is negotiated per client. Next to every "register" the client
+sends a "wire <format>" request in a datagram of its own, a service that
+supports the format answers with the op message
+
+    {"op": "wire", "success": true, "format": "binary1"}
+
+and sends the pointer frames of this client in it from then on. Services
+that do not know the request ignore it and go on sending json, so the
+clients decode every datagram by its first byte: MAGIC starts a binary
+frame, "{" a json message. Frames the record cannot carry exactly, e.g.
+with unknown, repeated or reordered events, unknown license states or
+values out of the range of their field, and all other messages are always
+sent as json.
+
+The simulator (airpointr_simulator) and the relay (airpointr_relay) speak
+the format. WireGestureListener is a GestureListener asking for it.
+'''
+
+import json
+import logging
+import struct
+import sys
+
+import airpointr
+import airpointr_shm
+
+log = logging.getLogger('airpointr.wire')
+
+JSON = 'json'
+BINARY = 'binary1'
+'''
+Names of the wire formats, the binary one with its version.
+'''
+
+FORMATS = (JSON, BINARY)
+'''
+Wire formats a client can ask for.
+'''
+
+MAGIC = b'\xa1\x01'
+'''
+First bytes of a binary frame: a byte no json message starts with and the
+version of the format.
+'''
+
+FRAME_SIZE = len(MAGIC) + airpointr_shm.FRAME.size
+'''
+Bytes of a binary frame.
+'''
+
+_PACK = struct.Struct('<%ds' % len(MAGIC) + airpointr_shm.FRAME.format[1:])
+_MAGIC_SIZE = len(MAGIC)
+
+def request(format):
+    '''
+    Datagram asking a service for the wire format.
+    '''
+    return b'wire ' + format.encode('ascii')
+
+def parse_request(data):
+    '''
+    Wire format asked for by a "wire <format>" datagram, None if it is no
+    such request.
+    '''
+    words = data.split()
+    if len(words) != 2 or words[0] != b'wire':
+        return None
+    return words[1].decode('ascii', 'replace')
+
+def encode(j, format = BINARY, ts = 0):
+    '''
+    Encoded message in the wire format. Messages the binary format cannot
+    carry exactly are encoded as json.
+    '''
+    if format == BINARY and airpointr.is_pointer_message(j):
+        try:
+            r = airpointr_shm.frame_record(j, ts, strict = True)
+            # the record folds events into bits and drops unknown fields,
+            # only messages it gives back unchanged are sent binary
+            if r != None and airpointr_shm.record_message(r) == j:
+                return _PACK.pack(MAGIC, *r)
+        except (struct.error, KeyError, TypeError, AttributeError):
+            # values out of the range of their field, or no complete
+            # pointer message
+            pass
+    return json.dumps(j).encode()
+
+def is_binary(data):
+    '''
+    True if the datagram is a binary frame.
+    '''
+    return data[:_MAGIC_SIZE] == MAGIC
+
+def unpack(data):
+    '''
+    FRAME values of a binary frame.
+    '''
+    if len(data) != FRAME_SIZE:
+        raise ValueError('binary frame of %d bytes, expected %d'
+                         % (len(data), FRAME_SIZE))
+    return _PACK.unpack(data)[1:]
+
+def decode(data):
+    '''
+    Message of a datagram in either format.
+    '''
+    if data[:_MAGIC_SIZE] == MAGIC:
+        return airpointr_shm.record_message(unpack(data))
+    return airpointr.loads(data)
+
+def decode_frame(data, recv_ns = None):
+    '''
+    airpointr.PointerFrame of a pointer datagram in either format, a binary
+    frame is converted without the detour over a message.
+    '''
+    if data[:_MAGIC_SIZE] == MAGIC:
+        return airpointr_shm.record_frame(unpack(data), recv_ns)
+    return airpointr.PointerFrame.from_message(airpointr.loads(data), recv_ns)
+
+class WireGestureListener(airpointr.GestureListener):
+    '''
+    GestureListener asking the service for the wire format, BINARY by
+    default, with every heart beat. Datagrams are decoded in whatever
+    format they arrive, format tells the one the service confirmed.
+    '''
+
+    wire = BINARY
+    '''
+    Wire format asked for.
+    '''
+
+    format = JSON
+    '''
+    Wire format confirmed by the service.
+    '''
+
+    def __init__(self, handler, service = None, host = None, port = 8981,
+                 wire = BINARY, **kwargs):
+        '''
+        The other arguments are the ones of GestureListener.
+        '''
+        if wire not in FORMATS:
+            raise ValueError('unknown wire format %r, expected one of %s'
+                             % (wire, ', '.join(FORMATS)))
+        self.wire = wire
+        airpointr.GestureListener.__init__(self, handler, service, host, port,
+                                           **kwargs)
+
+    def send_heartbeat(self, tmr = None):
+        '''
+        Send heart beat message and wire format request to service.
+        '''
+        airpointr.GestureListener.send_heartbeat(self, tmr)
+        if self.wire != JSON:
+            try:
+                self.socket.sendto(request(self.wire), self.service)
+            except OSError as e:
+                # the register may have been refused, the service is not
+                # running yet, the next heart beat asks again
+                log.warning("wire format request to %s:%d: %s",
+                            self.service[0], self.service[1], e)
+
+    def decode(self, data):
+        '''
+        Parse a datagram in either format, returns the message if it carries
+        pointer data.
+        '''
+        try:
+            j = decode(data)
+        except:
+            self.decode_errors += 1
+            log.warning("invalid datagram: %r", sys.exc_info()[1])
+            return None
+        if airpointr.is_pointer_message(j):
+            return j
+        if j.get(u'op') == u'wire' and j.get(u'success'):
+            self.format = j.get(u'format', JSON)
+        return None
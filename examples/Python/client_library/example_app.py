@@ -11,28 +11,33 @@ class MyGestureHandler:
 
     discovery_listener = None
 
-    def handle_gesture(self, gesture):
+    def handle_gesture(self, gesture, source):
         '''
         You may add your event handlers here that will be called on each received
         packet from airpointr.
         The argument to this function contains the parsed json so
         you may simply write 
-          print gesture['x'], gesture['y']
+          print(gesture['x'], gesture['y'])
         to output the current cursor position
+        With several AirPointr services only the one someone gestures in
+        front of is passed on, source tells which one it is.
         '''
-        print gesture
+        print(source.address, gesture)
         pass
 
     def handle_discovery(self, services):
-        if len(services) > 0:
-            print "Found AirPointr service - connecting to", services[0]['host']
-            self.connect(services[0]['host'], services[0]['port'])
-            self.discovery_listener.close();
+        if self.gesture_listener == None:
+            self.gesture_listener = airpointr.MultiGestureListener(handler = self.handle_gesture)
+        for service in services:
+            if (service['host'], service['port']) not in self.gesture_listener.services:
+                print("Found AirPointr service - connecting to", service['host'])
+        # connect to all services, also the ones discovered later
+        self.gesture_listener.update_services(services)
 
     def connect(self, host, port):
-        self.gesture_listener = airpointr.GestureListener(handler = self.handle_gesture,
-                                                          host = host,
-                                                          port = port)
+        if self.gesture_listener == None:
+            self.gesture_listener = airpointr.MultiGestureListener(handler = self.handle_gesture)
+        self.gesture_listener.add(host, port)
 
     def discover(self):
         self.discovery_listener = airpointr.DiscoveryListener(handler = self.handle_discovery)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+'''
+Very simple example how to use Raspberry AirPointr with asyncio.
+'''
+
+import asyncio
+
+import airpointr_asyncio
+
+async def discover():
+    '''
+    Wait for the first AirPointr service announced on the network.
+    '''
+    found = asyncio.get_running_loop().create_future()
+
+    def handle_discovery(services):
+        if len(services) > 0 and not found.done():
+            found.set_result(services[0])
+
+    transport, protocol = await airpointr_asyncio.create_discovery_endpoint(
+        handler = handle_discovery)
+    try:
+        return await found
+    finally:
+        transport.close()
+
+async def main():
+    service = await discover()
+    print("Found AirPointr service - connecting to", service['host'])
+    #service = { 'host': '192.168.57.1', 'port': 8981 }
+    async with airpointr_asyncio.open_pointer_stream(service = service) as stream:
+        async for gesture in stream:
+            # add your event handlers here, gesture contains the parsed json
+            # of each pointer packet received from airpointr
+            print(gesture['x'], gesture['y'])
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -9,10 +9,15 @@ to the console.
 @package display_airpointr_input
 '''
 
+import logging
+import os
 import socket
-import threading
-import json
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "client_library"))
+import airpointr
+import airpointr_log
 
 
 # IP Address of the machine that should provide the AirPointr service
@@ -23,88 +28,82 @@ AIRPOINTR_GESTURE_PORT = 8981
 sock = None
 http_client = None
 
+# the pointer state is redrawn 20 times per second whatever the frame rate,
+# events are logged above it
+console = airpointr_log.Console(rate = 20)
+log = logging.getLogger("airpointr.display")
+
+# a swipe or smart circle selection may show up in several frames, it is
+# reported once
+debouncer = airpointr.GestureDebouncer()
+
   
-def do_every(interval, worker_func, iterations = 0):
-    """
-    helper function to create periodically executed threads
-    """
-    if iterations != 1:
-        threading.Timer(
-                        interval,
-                        do_every, [interval, worker_func, 0 if iterations == 0 else iterations-1]
-                        ).start()
-    worker_func()
-                    
 def register_to_airpointr_service():
     """
     Sends the registration request to the specefied address
     """
     try:
-        sock.sendto("register",(AIRPOINTR_HOST_IP,AIRPOINTR_GESTURE_PORT))
+        sock.sendto(b"register",(AIRPOINTR_HOST_IP,AIRPOINTR_GESTURE_PORT))
     except socket.error as e:
-        print e
-        print (AIRPOINTR_HOST_IP,AIRPOINTR_GESTURE_PORT)    
+        log.warning("%s %s %s", e, AIRPOINTR_HOST_IP, AIRPOINTR_GESTURE_PORT)
 
-def handle_pointer_message(addr, json_data):
+def handle_pointer_message(addr, frame):
     """
     checks if the received pointer message should be handled as control input
     and starts the evalution of the pointer data
     """
     ip = addr[0]
     port = addr[1]
-    license_status = json_data["license"]
+    license_status = frame.license
     valid_input = False
     if (license_status == "demo" or 
         license_status == "licensed"):
             valid_input = True
     else:
-            print ("AirPointr Status " + 
-                   ip + ":" +
-                   str(port) + " :" )
-            print "Demo expired -> Pointer output is invalid!"
+            log.warning("AirPointr Status %s:%d : "
+                        "Demo expired -> Pointer output is invalid!", ip, port)
 
 
     if ip == AIRPOINTR_HOST_IP and valid_input:
-        handle_pointer_input(json_data)
+        handle_pointer_input(frame)
         
    
 
-def handle_pointer_input(json_data):
+def handle_pointer_input(frame):
     """
     displays the pointer input data
     """
-            
-    output_string = ("Pointer: x=" + "{:1.6f}".format(json_data["x"]) + 
-                     " / y=" + "{:1.6f}".format(json_data["y"]))
+    circle = frame.circle
+
+    output_string = ("Pointer: x=" + "{:1.6f}".format(frame.x) + 
+                     " / y=" + "{:1.6f}".format(frame.y))
                      
-    if not json_data["active"]:
+    if not frame.active:
         output_string += " (inactive)"
         
-    print "\033[A\033[G", output_string, "\033[K"
+    if circle.active:
+        output_string += " | Circle active: Segment=" + str(circle.segment)
+    console.status(output_string)
         
-    if json_data["events"]:
-        if json_data["events"] == [u'rwipe']:
-            print "Wipe Right detected.\n"
+    for gesture in debouncer.update(frame):
+        if gesture.kind == u'rwipe':
+            log.info("Wipe Right detected.")
     
-        if json_data["events"] == [u'lwipe']:
-            print "Wipe Left detected.\n"
-            
-    if json_data["circle"]["active"]:
-        output_string = "Circle active: Segment=" + str(json_data["circle"]["segment"])
-        print "\033[A\033[G", output_string, "\033[K"
+        if gesture.kind == u'lwipe':
+            log.info("Wipe Left detected.")
 
-    if json_data["circle"]["smart"]["enabled"]:
-        if json_data["circle"]["smart"]["actionSelect"]:
-            if json_data["circle"]["smart"]["actionSegment"] == 0:
+        if gesture.kind == airpointr.SELECT:
+            if gesture.segment == 0:
                 segment_string = "-north-"
-            elif json_data["circle"]["smart"]["actionSegment"] == 1:
+            elif gesture.segment == 1:
                 segment_string = "-east-"
-            elif json_data["circle"]["smart"]["actionSegment"] == 2:
+            elif gesture.segment == 2:
                 segment_string = "-south-"
-            elif json_data["circle"]["smart"]["actionSegment"] == 3:
+            elif gesture.segment == 3:
                 segment_string = "-west-"
                 
-            print "Smart circle action: Selected Segment", segment_string, ".\n"
+            log.info("Smart circle action: Selected Segment %s .",
+                     segment_string)
 
    
 
@@ -119,19 +118,30 @@ def main():
     
     sock.bind(('', 0))
 
+    # console output must never block the receive loop
+    pipeline = airpointr_log.LogPipeline(console = console,
+                                         fmt = "%(message)s")
+    pipeline.start()
+
     # AirPointr service has to be kept alive
-    do_every(15, register_to_airpointr_service)
+    airpointr.scheduler.call_every(15, register_to_airpointr_service)
     
-    while 1:
-        data, addr = sock.recvfrom(1024)
-        if data[0] == "{":
-            json_data = json.loads(data)
-            if "type" in json_data:        
-                if json_data["type"] == "pointer" in data:
-                    handle_pointer_message(addr, json_data)
+    try:
+        while 1:
+            data, addr = airpointr.recvfrom(sock, 1024)
+            recv_ns = airpointr.perf_ns()
+            if data[:1] == b"{":
+                json_data = airpointr.loads(data)
+                if "type" in json_data:        
+                    if json_data["type"] == "pointer":
+                        frame = airpointr.PointerFrame.from_message(json_data,
+                                                                    recv_ns)
+                        handle_pointer_message(addr, frame)
  
-        else:
-            print "\nnot a JSON-Blob"
+            else:
+                log.warning("not a JSON-Blob")
+    finally:
+        pipeline.stop()
  
             
 if __name__ == "__main__":
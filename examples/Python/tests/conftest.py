@@ -0,0 +1,308 @@
+'''
+Fixtures of the client library tests: players faked in this process, so
+the backends are tested against real sockets without Kodi or MPD.
+'''
+
+import http.server
+import json
+import os
+import shlex
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "client_library"))
+
+def wait_until(condition, timeout = 5.0):
+    '''
+    Poll condition until it is true, returns its last value.
+    '''
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.005)
+    return condition()
+
+class FakeKodi(object):
+    '''
+    Kodi JSON-RPC over HTTP, with a player and the volume, and its raw TCP
+    port pushing notifications. calls lists the (method, params) calls
+    received.
+    '''
+
+    def __init__(self):
+        '''
+
+        '''
+        self.volume = 40
+        self.muted = False
+        self.players = [{ 'playerid': 1, 'type': 'audio' }]
+        self.speed = 1
+        self.calls = []
+        self.connections = 0
+        self.delay = 0
+        self.keep_alive = True
+        self.http = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                    self._handler())
+        self.http.daemon_threads = True
+        self.port = self.http.server_address[1]
+        self.notification_server = socket.socket()
+        self.notification_server.bind(('127.0.0.1', 0))
+        self.notification_server.listen(4)
+        self.notification_port = self.notification_server.getsockname()[1]
+        self.notification_clients = []
+        self._threads = [
+            threading.Thread(target = self.http.serve_forever, daemon = True),
+            threading.Thread(target = self._accept, daemon = True)]
+        for t in self._threads:
+            t.start()
+
+    def methods(self):
+        return [method for method, params in self.calls]
+
+    def call(self, method, params):
+        self.calls.append((method, params))
+        if method == 'Application.GetProperties':
+            return { 'volume': self.volume, 'muted': self.muted }
+        if method == 'Application.SetVolume':
+            self.volume = params[0] if isinstance(params, list) \
+                          else params['volume']
+            return self.volume
+        if method == 'Player.GetActivePlayers':
+            return self.players
+        if method == 'Player.GetProperties':
+            return { 'speed': self.speed }
+        if method == 'Player.PlayPause':
+            play = params.get('play', self.speed == 0)
+            self.speed = 1 if play else 0
+            return { 'speed': self.speed }
+        if method in ('Player.GoTo', 'Player.Stop'):
+            return 'OK'
+        raise KeyError(method)
+
+    def _answer(self, request):
+        try:
+            result = self.call(request['method'], request.get('params'))
+        except KeyError:
+            return { 'jsonrpc': '2.0', 'id': request['id'],
+                     'error': { 'code': -32601,
+                                'message': 'Method not found.' } }
+        return { 'jsonrpc': '2.0', 'id': request['id'], 'result': result }
+
+    def _handler(self):
+        kodi = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                kodi.connections += 1
+                http.server.BaseHTTPRequestHandler.setup(self)
+
+            def do_POST(self):
+                length = int(self.headers['Content-Length'])
+                body = json.loads(self.rfile.read(length))
+                time.sleep(kodi.delay)
+                if isinstance(body, list):
+                    answer = [kodi._answer(r) for r in body]
+                else:
+                    answer = kodi._answer(body)
+                data = json.dumps(answer).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                # closed without telling the client, like an idle timeout
+                self.close_connection = not kodi.keep_alive
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _accept(self):
+        while True:
+            try:
+                c, addr = self.notification_server.accept()
+            except OSError:
+                return
+            self.notification_clients.append(c)
+
+    def notify(self, method, data):
+        '''
+        Push a notification to the connected clients.
+        '''
+        message = { 'jsonrpc': '2.0', 'method': method,
+                    'params': { 'sender': 'xbmc', 'data': data } }
+        for c in self.notification_clients:
+            c.sendall(json.dumps(message).encode())
+
+    def drop_notifications(self):
+        '''
+        Close the notification connections, as a restarting Kodi would.
+        '''
+        for c in self.notification_clients:
+            try:
+                c.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            c.close()
+        self.notification_clients = []
+
+    def close(self):
+        self.http.shutdown()
+        self.http.server_close()
+        self.drop_notifications()
+        self.notification_server.close()
+
+@pytest.fixture
+def kodi():
+    k = FakeKodi()
+    yield k
+    k.close()
+
+class FakeMPD(object):
+    '''
+    MPD protocol server with a player and a mixer, idle and command lists.
+    commands lists the (command, args...) tuples received, unknown commands
+    are answered with an ACK.
+    '''
+
+    def __init__(self):
+        '''
+
+        '''
+        self.state = 'stop'
+        self.volume = 50
+        self.commands = []
+        self.connections = 0
+        self.delay = 0
+        self.clients = []
+        self.changed = threading.Condition()
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(4)
+        self.port = self.server.getsockname()[1]
+        self._closed = False
+        threading.Thread(target = self._accept, daemon = True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                c, addr = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            self.clients.append(c)
+            threading.Thread(target = self._serve, args = (c,),
+                             daemon = True).start()
+
+    def _change(self, **values):
+        with self.changed:
+            for name, value in values.items():
+                setattr(self, name, value)
+            self.changed.notify_all()
+
+    def set_state(self, state):
+        '''
+        Change the state behind the back of the clients.
+        '''
+        self._change(state = state)
+
+    def _idle(self, c):
+        with self.changed:
+            state, volume = self.state, self.volume
+            while (state, volume) == (self.state, self.volume):
+                if self._closed or c not in self.clients:
+                    return None
+                self.changed.wait(0.05)
+            return 'changed: player\n' if state != self.state \
+                   else 'changed: mixer\n'
+
+    def _run(self, c, words):
+        command, args = words[0], words[1:]
+        if command == 'idle':
+            return self._idle(c)
+        self.commands.append(tuple(words))
+        time.sleep(self.delay)
+        if command == 'status':
+            return 'volume: %d\nstate: %s\n' % (self.volume, self.state)
+        if command == 'setvol':
+            self._change(volume = int(args[0]))
+        elif command in ('play', 'next', 'previous'):
+            self._change(state = 'play')
+        elif command == 'pause':
+            self._change(state = 'pause')
+        elif command == 'stop':
+            self._change(state = 'stop')
+        else:
+            return None
+        return ''
+
+    def _serve(self, c):
+        f = c.makefile('rwb')
+        command_list = None
+        try:
+            f.write(b'OK MPD 0.23.5\n')
+            f.flush()
+            for line in f:
+                line = line.decode('utf-8').rstrip('\n')
+                if line == 'command_list_ok_begin':
+                    command_list = []
+                    continue
+                if line == 'command_list_end':
+                    answer = ''
+                    for i, words in enumerate(command_list):
+                        r = self._run(c, words)
+                        if r == None:
+                            answer += 'ACK [5@%d] {%s} unknown command\n' \
+                                      % (i, words[0])
+                            break
+                        answer += r + 'list_OK\n'
+                    else:
+                        answer += 'OK\n'
+                    command_list = None
+                elif command_list != None:
+                    command_list.append(shlex.split(line))
+                    continue
+                else:
+                    words = shlex.split(line)
+                    r = self._run(c, words)
+                    if r == None:
+                        if words[0] == 'idle':
+                            return
+                        answer = 'ACK [5@0] {%s} unknown command\n' % words[0]
+                    else:
+                        answer = r + 'OK\n'
+                f.write(answer.encode('utf-8'))
+                f.flush()
+        except (OSError, ValueError):
+            pass
+        finally:
+            c.close()
+
+    def drop(self):
+        '''
+        Close the client connections, as MPD does after its idle timeout.
+        '''
+        for c in self.clients:
+            try:
+                c.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.clients = []
+
+    def close(self):
+        self._closed = True
+        self.drop()
+        self.server.close()
+
+@pytest.fixture
+def mpd():
+    m = FakeMPD()
+    yield m
+    m.close()
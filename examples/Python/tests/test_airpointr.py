@@ -0,0 +1,231 @@
+'''
+Building blocks of the client library, driven by a fake clock.
+'''
+
+import socket
+
+import pytest
+
+import airpointr
+
+class Clock(object):
+    '''
+    Clock that only moves when told to.
+    '''
+
+    def __init__(self):
+        '''
+
+        '''
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+def service(host):
+    return { 'host': host, 'port': 8981, 'hostname': 'cam-' + host }
+
+def test_registry_expires_silent_services():
+    clock = Clock()
+    changes = []
+    registry = airpointr.ServiceRegistry(timeout = 10, listener = changes.append,
+                                         clock = clock)
+    assert registry.update(service('a'))
+    assert registry.update(service('b'))
+    assert not registry.update(service('b'))
+    assert len(changes) == 2
+    clock.now += 6
+    registry.touch('a')
+    clock.now += 5
+    assert registry.expire()
+    assert 'a' in registry and 'b' not in registry
+    assert [s['host'] for s in changes[-1]] == ['a']
+    # a was touched at 106
+    clock.now = 115.5
+    assert not registry.expire()
+    clock.now = 116.5
+    assert registry.expire()
+    assert len(registry) == 0
+
+def test_registry_keeps_one_deadline_per_service():
+    clock = Clock()
+    registry = airpointr.ServiceRegistry(timeout = 10, clock = clock)
+    registry.update(service('a'))
+    for i in range(1000):
+        clock.now += 0.01
+        registry.touch('a')
+        registry.update(service('a'))
+    assert len(registry._deadlines) == 1
+    clock.now += 10.5
+    assert registry.expire()
+
+def test_registry_never_expires_pinned_services():
+    clock = Clock()
+    registry = airpointr.ServiceRegistry(timeout = 10, clock = clock)
+    registry.update(service('local'), expires = False)
+    registry.update(service('a'))
+    clock.now += 60
+    registry.touch('local')
+    assert registry.expire()
+    assert list(registry.services) == ['local']
+    # expires again once updated without the pin
+    registry.update(service('local'))
+    clock.now += 11
+    assert registry.expire()
+    assert len(registry) == 0
+
+def test_timers_run_in_deadline_order():
+    clock = Clock()
+    sched = airpointr.Scheduler(clock)
+    calls = []
+    sched.call_later(0.3, calls.append, 'c')
+    sched.call_later(0.1, calls.append, 'a')
+    sched.call_later(0.1, calls.append, 'b')
+    assert sched.timeout() == pytest.approx(0.1)
+    sched.run_pending()
+    assert calls == []
+    clock.now += 0.5
+    sched.run_pending()
+    # equal deadlines run in order of scheduling
+    assert calls == ['a', 'b', 'c']
+    assert sched.timeout() == None
+
+def test_periodic_timer_never_catches_up():
+    clock = Clock()
+    sched = airpointr.Scheduler(clock)
+    fired = []
+    sched.call_every(1, lambda: fired.append(clock.now), delay = 1)
+    for step in (1, 0.5, 0.5, 3.2, 1):
+        clock.now += step
+        sched.run_pending()
+    # the late pass runs the timer once, then it keeps its interval
+    assert fired == [101, 102, 105.2, 106.2]
+
+def test_cancelled_timers_do_not_run():
+    clock = Clock()
+    sched = airpointr.Scheduler(clock)
+    calls = []
+    once = sched.call_later(1, calls.append, 'once')
+    every = sched.call_every(1, calls.append, 'every')
+    sched.run_pending()
+    every.cancel()
+    once.cancel()
+    clock.now += 5
+    sched.run_pending()
+    assert calls == ['every']
+    assert sched.timeout() == None
+
+def test_failing_timer_keeps_schedule():
+    clock = Clock()
+    sched = airpointr.Scheduler(clock)
+    calls = []
+    sched.call_every(1, lambda: 1 / 0)
+    sched.call_every(1, calls.append, 'ok')
+    sched.run_pending()
+    clock.now += 1
+    sched.run_pending()
+    assert calls == ['ok', 'ok']
+
+def test_interval_must_be_positive():
+    with pytest.raises(ValueError):
+        airpointr.Scheduler().call_every(0, print)
+
+def test_recvfrom_with_due_timer():
+    # a timer due on every pass sets a timeout of 0 each time
+    sched = airpointr.Scheduler()
+    ticks = []
+    sched.call_every(1e-6, lambda: ticks.append(1))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    try:
+        sched.call_later(0.01, sock.sendto, b'hello', sock.getsockname())
+        data, addr = airpointr.recvfrom(sock, 1024, sched)
+        assert data == b'hello'
+        assert len(ticks) > 1
+    finally:
+        sock.close()
+
+def frame(events = (), select = None):
+    smart = airpointr.SmartCircleState(True, select != None, select or 0)
+    return airpointr.PointerFrame(events = tuple(events),
+                                  circle = airpointr.CircleState(True, 1, 0, 0,
+                                                                 smart))
+
+def kinds(gestures):
+    return [(g.kind, g.segment) for g in gestures]
+
+def test_debouncer_reports_rising_edges():
+    clock = Clock()
+    debouncer = airpointr.GestureDebouncer(0.3, clock)
+    assert kinds(debouncer.update(frame(['rwipe']))) == [('rwipe', None)]
+    clock.now += 0.5
+    # still set in the next frames: the same gesture
+    assert debouncer.update(frame(['rwipe'])) == []
+    # only the event new to the frame
+    assert kinds(debouncer.update(frame(['rwipe', 'lwipe']))) == \
+           [('lwipe', None)]
+    assert debouncer.update(frame()) == []
+    clock.now += 0.5
+    gestures = debouncer.update(frame(['rwipe']))
+    assert kinds(gestures) == [('rwipe', None)]
+    assert gestures[0].id == 3
+
+def test_debouncer_refractory_window():
+    clock = Clock()
+    debouncer = airpointr.GestureDebouncer(0.3, clock)
+    assert len(debouncer.update(frame(['rwipe']))) == 1
+    debouncer.update(frame())
+    clock.now += 0.1
+    # a repetition within the window, e.g. of a duplicated frame
+    assert debouncer.update(frame(['rwipe'])) == []
+    debouncer.update(frame())
+    clock.now += 0.3
+    assert len(debouncer.update(frame(['rwipe']))) == 1
+    assert debouncer.suppressed == 1
+
+def test_debouncer_window_per_smart_circle_segment():
+    clock = Clock()
+    debouncer = airpointr.GestureDebouncer(0.3, clock)
+    assert kinds(debouncer.update(frame(select = 0))) == [('select', 0)]
+    assert debouncer.update(frame(select = 0)) == []
+    debouncer.update(frame())
+    clock.now += 0.1
+    # another segment right after is another gesture
+    assert kinds(debouncer.update(frame(select = 1))) == [('select', 1)]
+    debouncer.update(frame())
+    clock.now += 0.1
+    assert debouncer.update(frame(select = 0)) == []
+    assert debouncer.count == 2
+
+def test_volume_steps_are_summed_per_window():
+    clock = Clock()
+    sched = airpointr.Scheduler(clock)
+    sets = []
+    volume = airpointr.VolumeController(sets.append, lambda: 50, window = 0.1,
+                                        sched = sched)
+    assert volume.change(2) == 52
+    assert volume.change(2) == 54
+    assert volume.change(-1) == 53
+    assert sets == [52]
+    clock.now += 0.1
+    sched.run_pending()
+    assert sets == [52, 53]
+    assert volume.change(100) == 100
+    clock.now += 0.1
+    sched.run_pending()
+    assert sets == [52, 53, 100]
+
+def test_volume_is_read_from_the_player_when_idle():
+    clock = Clock()
+    sched = airpointr.Scheduler(clock)
+    player = [30]
+    volume = airpointr.VolumeController(player.append, lambda: player[0],
+                                        window = 0.1, settle = 1.0,
+                                        sched = sched)
+    assert volume.change(2) == 32
+    # changed meanwhile with the remote control
+    player[0] = 70
+    clock.now += 0.5
+    assert volume.change(2) == 34
+    clock.now += 1.0
+    assert volume.change(2) == 72
@@ -0,0 +1,53 @@
+'''
+GestureEngine with a recording backend, fed datagrams directly.
+'''
+
+import airpointr
+import airpointr_media
+
+from test_listener import pointer
+
+class RecordingBackend(airpointr_media.MediaBackend):
+    '''
+    Backend listing the actions run.
+    '''
+
+    def __init__(self):
+        '''
+
+        '''
+        self.actions = []
+        self.level = 50
+
+    def volume(self):
+        return self.level
+
+    def set_volume(self, volume):
+        self.level = volume
+        self.actions.append(('set_volume', volume))
+
+    def forward(self):
+        self.actions.append('forward')
+
+    def backward(self):
+        self.actions.append('backward')
+
+ADDR = ('127.0.0.1', 8981)
+
+def engine():
+    e = airpointr_media.GestureEngine(RecordingBackend(),
+                                      airpointr_media.SWIPE_MAPPING,
+                                      sched = airpointr.Scheduler())
+    e.services.update(dict(host = ADDR[0], port = ADDR[1], active = False,
+                           license_status = 'demo'), expires = False)
+    return e
+
+def test_malformed_messages_are_counted():
+    e = engine()
+    e.handle_datagram(b'{"op":"register"}', ADDR)
+    e.handle_datagram(b'{"type":"pointer","x":1}', ADDR)
+    e.handle_datagram(b'not json', ADDR)
+    assert e.decode_errors == 2
+    e.handle_datagram(pointer(events = ['rwipe']), ADDR)
+    assert e.backend.actions == ['forward']
+    assert e.received == 4
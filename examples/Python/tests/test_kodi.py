@@ -0,0 +1,155 @@
+'''
+Kodi backend against a fake Kodi in this process.
+'''
+
+import socket
+import time
+
+import pytest
+
+import airpointr
+import airpointr_kodi
+
+from conftest import wait_until
+
+def test_client_call_and_batch(kodi):
+    client = airpointr_kodi.KodiClient('127.0.0.1', kodi.port)
+    assert client.call('Application.SetVolume', 55) == 55
+    results = client.batch([('Player.GetActivePlayers', []),
+                            ('Bad.Method', [])])
+    assert results[0] == kodi.players
+    assert isinstance(results[1], airpointr_kodi.KodiError)
+    client.close()
+    # one keep-alive connection for all calls
+    assert client.connects == 1
+
+def test_client_reopens_stale_connection(kodi):
+    client = airpointr_kodi.KodiClient('127.0.0.1', kodi.port)
+    kodi.keep_alive = False
+    client.call('Player.GoTo', 1, 'next')
+    assert wait_until(lambda: kodi.connections == 1)
+    client.call('Player.GoTo', 1, 'next')
+    client.close()
+    assert client.connects == 2
+    assert kodi.methods() == ['Player.GoTo', 'Player.GoTo']
+
+def test_client_never_repeats_timed_out_call(kodi):
+    client = airpointr_kodi.KodiClient('127.0.0.1', kodi.port, timeout = 0.2)
+    client.call('Player.GetActivePlayers')
+    kodi.delay = 0.5
+    with pytest.raises(socket.timeout):
+        client.call('Player.PlayPause', playerid = 1)
+    client.close()
+    # the toggle reached Kodi once, and is not sent again
+    assert wait_until(lambda: len(kodi.calls) == 2)
+    time.sleep(2 * kodi.delay)
+    assert kodi.methods() == ['Player.GetActivePlayers', 'Player.PlayPause']
+
+def test_dispatcher_batches_and_counts_failures(kodi):
+    dispatcher = airpointr_kodi.KodiDispatcher(
+        airpointr_kodi.KodiClient('127.0.0.1', kodi.port))
+    # queued before the worker starts, so they go out as one batch
+    dispatcher.notify('Application.SetVolume', 10)
+    dispatcher.notify('Bad.Method')
+    dispatcher.notify('Other.Bad')
+    dispatcher.notify('Player.Stop', playerid = 1)
+    dispatcher.start()
+    dispatcher.stop()
+    assert kodi.methods() == ['Application.SetVolume', 'Bad.Method',
+                              'Other.Bad', 'Player.Stop']
+    assert kodi.calls[-1] == ('Player.Stop', { 'playerid': 1 })
+    assert dispatcher.failed == 2
+    assert dispatcher.latency.count == 1
+
+def test_state_cache_follows_notifications(kodi):
+    cache = airpointr_kodi.KodiStateCache('127.0.0.1', kodi.notification_port,
+                                          reconnect_interval = 60)
+    cache.start()
+    try:
+        assert wait_until(lambda: kodi.notification_clients)
+        kodi.notify('Player.OnPause', { 'player': { 'playerid': 1,
+                                                    'speed': 0 } })
+        assert wait_until(lambda: cache.notifications == 1)
+        assert cache.playerid == 1 and not cache.playing
+        kodi.notify('Application.OnVolumeChanged', { 'volume': 12,
+                                                     'muted': False })
+        assert wait_until(lambda: cache.volume == 12)
+        kodi.notify('Player.OnStop', {})
+        assert wait_until(lambda: cache.playerid == None)
+        # stop must not wait for the reconnect back-off
+        kodi.drop_notifications()
+        assert wait_until(lambda: not cache.connected)
+    finally:
+        cache.stop()
+
+def test_state_cache_reports_every_connect(kodi):
+    connects = []
+    cache = airpointr_kodi.KodiStateCache('127.0.0.1', kodi.notification_port,
+                                          reconnect_interval = 0.05,
+                                          on_connect = lambda: connects.append(
+                                              cache.connected))
+    cache.start()
+    try:
+        assert wait_until(lambda: kodi.notification_clients)
+        kodi.drop_notifications()
+        assert wait_until(lambda: len(connects) == 2)
+        assert connects == [True, True]
+    finally:
+        cache.stop()
+
+def test_backend_reconciles_after_reconnect(kodi):
+    backend = _backend(kodi, kodi.notification_port)
+    try:
+        assert wait_until(lambda: kodi.notification_clients)
+        backend.state.reconnect_interval = 0.05
+        # lost notifications: Kodi paused while the connection was down
+        kodi.drop_notifications()
+        kodi.speed = 0
+        assert wait_until(lambda: backend.state.connects == 2)
+        assert wait_until(lambda: backend.state.speed == 0)
+    finally:
+        backend.close()
+
+def _backend(kodi, notification_port):
+    backend = airpointr_kodi.KodiBackend('127.0.0.1', kodi.port,
+                                         notification_port,
+                                         sched = airpointr.Scheduler())
+    backend.open()
+    return backend
+
+def test_backend_reconciles_without_notifications(kodi):
+    # nothing listens on the notification port of the fake
+    backend = _backend(kodi, 1)
+    try:
+        assert backend.state.speed == 1
+        # paused behind the back of the cache
+        kodi.speed = 0
+        del kodi.calls[:]
+        backend.forward()
+        assert wait_until(lambda: 'Player.PlayPause' in kodi.methods())
+        assert 'Player.GoTo' not in kodi.methods()
+        assert kodi.speed == 1
+    finally:
+        backend.close()
+
+def test_backend_actions(kodi):
+    backend = _backend(kodi, kodi.notification_port)
+    try:
+        assert wait_until(lambda: backend.state.connected)
+        # open and the notification connection reconcile once each
+        assert wait_until(
+            lambda: kodi.methods().count('Player.GetProperties') == 2)
+        assert backend.volume() == 40
+        del kodi.calls[:]
+        backend.forward()
+        assert wait_until(lambda: kodi.calls)
+        assert kodi.calls == [('Player.GoTo', [1, 'next'])]
+        del kodi.calls[:]
+        backend.previous()
+        assert wait_until(lambda: len(kodi.calls) == 2)
+        assert kodi.calls == [('Player.GoTo', [1, 'previous'])] * 2
+        backend.set_volume(70)
+        assert wait_until(lambda: backend.volume() == 70)
+        assert kodi.volume == 70
+    finally:
+        backend.close()
@@ -0,0 +1,148 @@
+'''
+GestureListener against a fake gesture service on a local UDP socket.
+'''
+
+import asyncore
+import json
+import socket
+
+import pytest
+
+import airpointr
+import airpointr_relay
+
+POINTER = { 'type': 'pointer', 'x': 0.25, 'y': 0.75, 'active': True,
+            'events': [], 'license': 'licensed',
+            'circle': { 'active': False, 'direction': 0, 'segment': 0,
+                        'turns': 0,
+                        'smart': { 'enabled': True, 'actionSelect': False,
+                                   'actionSegment': 0 } } }
+
+def pointer(**fields):
+    j = json.loads(json.dumps(POINTER))
+    j.update(fields)
+    return json.dumps(j).encode()
+
+@pytest.fixture
+def service():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(('127.0.0.1', 0))
+    s.settimeout(5)
+    yield s
+    s.close()
+
+def listen(service, handler, **kwargs):
+    '''
+    GestureListener registered to service, returns it and the address it
+    receives on.
+    '''
+    listener = airpointr.GestureListener(handler, host = '127.0.0.1',
+                                         port = service.getsockname()[1],
+                                         sched = airpointr.Scheduler(),
+                                         **kwargs)
+    data, client = service.recvfrom(1024)
+    assert data == b'register'
+    return listener, client
+
+def poll(condition, count = 200):
+    while not condition() and count > 0:
+        asyncore.loop(timeout = 0.01, count = 1)
+        count -= 1
+    return condition()
+
+def test_truncated_pointer_message_is_dropped(service):
+    frames = []
+    listener, client = listen(service, frames.append, typed = True)
+    try:
+        service.sendto(b'{"type":"pointer","x":0.1}', client)
+        service.sendto(pointer(x = 0.5), client)
+        assert poll(lambda: frames)
+        assert frames[0].x == 0.5
+        assert listener.decode_errors == 1
+        assert listener in asyncore.socket_map.values()
+    finally:
+        listener.close()
+
+def fields(frame):
+    circle = frame.circle
+    smart = circle.smart
+    return (frame.x, frame.y, frame.active, frame.events, frame.license,
+            circle.active, circle.direction, circle.segment, circle.turns,
+            smart and (smart.enabled, smart.action_select,
+                       smart.action_segment))
+
+def test_fast_parse_matches_decoder(service):
+    frames = []
+    listener, client = listen(service, frames.append, typed = True,
+                              fast_parse = True)
+    try:
+        j = json.loads(pointer(events = ['lwipe']))
+        del j['circle']['smart']
+        datagrams = [pointer(events = ['rwipe'], x = 0.5),
+                     json.dumps(j).encode(),
+                     b'{"type":"pointer","x":0.1}']
+        for data in datagrams:
+            service.sendto(data, client)
+        assert poll(lambda: listener.decode_errors == 1)
+        # no smart circle takes the path of the json decoder
+        expected = [airpointr.PointerFrame.from_message(json.loads(data))
+                    for data in datagrams[:2]]
+        assert [fields(f) for f in frames] == [fields(f) for f in expected]
+    finally:
+        listener.close()
+
+def test_coalesce_without_smart_circle(service):
+    messages = []
+    listener, client = listen(service, messages.append, coalesce = True)
+    try:
+        j = json.loads(pointer(events = ['rwipe']))
+        del j['circle']['smart']
+        service.sendto(json.dumps(j).encode(), client)
+        assert poll(lambda: messages)
+        assert messages[0]['events'] == ['rwipe']
+        assert listener.decode_errors == 0
+        service.sendto(pointer(x = 0.5), client)
+        assert poll(lambda: len(messages) == 2)
+    finally:
+        listener.close()
+
+def test_multi_listener_survives_truncated_message(service):
+    frames = []
+    port = service.getsockname()[1]
+    listener = airpointr.MultiGestureListener(
+        lambda frame, source: frames.append(frame),
+        [{ 'host': '127.0.0.1', 'port': port }], typed = True,
+        arbitrate = False, sched = airpointr.Scheduler())
+    try:
+        data, client = service.recvfrom(1024)
+        service.sendto(b'{"type":"pointer","x":0.1}', client)
+        service.sendto(pointer(x = 0.5), client)
+        assert poll(lambda: frames)
+        assert frames[0].x == 0.5
+        assert listener.decode_errors == 1
+    finally:
+        listener.close()
+
+def test_relay_listener_survives_handler_error(tmp_path):
+    relay = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    relay.bind(str(tmp_path / 'relay'))
+    relay.settimeout(5)
+    calls = []
+
+    def handler(j):
+        calls.append(j)
+        if len(calls) == 1:
+            raise RuntimeError('handler bug')
+
+    listener = airpointr_relay.RelayListener(handler, path = relay.getsockname(),
+                                             sched = airpointr.Scheduler())
+    try:
+        data, client = relay.recvfrom(1024)
+        assert data.startswith(b'subscribe')
+        relay.sendto(pointer(x = 0.1), client)
+        relay.sendto(pointer(x = 0.5), client)
+        assert poll(lambda: len(calls) == 2)
+        assert calls[1]['x'] == 0.5
+    finally:
+        listener.close()
+        relay.close()
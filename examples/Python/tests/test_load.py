@@ -0,0 +1,49 @@
+'''
+Short load test against a simulator in this process.
+'''
+
+import threading
+
+import pytest
+
+import airpointr
+import airpointr_simulator
+import airpointr_wire
+
+RATE = 200.0
+CLIENTS = 3
+DURATION = 1.0
+
+@pytest.fixture
+def simulator():
+    sim = airpointr_simulator.Simulator(0, '127.0.0.1', RATE,
+                                        discovery_targets = (),
+                                        sched = airpointr.Scheduler())
+    thread = threading.Thread(target = sim.run, daemon = True)
+    thread.start()
+    yield sim
+    sim.close()
+    thread.join(5)
+    assert not thread.is_alive()
+
+@pytest.mark.parametrize('wire', airpointr_wire.FORMATS)
+def test_load(simulator, wire):
+    test = airpointr_simulator.LoadTest('127.0.0.1', simulator.port, CLIENTS,
+                                        wire = wire)
+    try:
+        s = test.run(DURATION)
+    finally:
+        test.close()
+    assert s['clients'] == CLIENTS
+    # every client gets most of the frames sent meanwhile, loopback loses
+    # none of them
+    assert s['received'] >= CLIENTS * RATE * DURATION / 2
+    assert min(test.received) > 0
+    assert s['loss'] < 0.01
+    assert 0 <= s['p50_us'] <= s['p99_us'] <= s['max_us']
+    if wire == airpointr_wire.BINARY:
+        # only the frames sent before the wire request was answered are json
+        assert airpointr_wire.FRAME_SIZE <= s['bytes_per_frame'] < 50
+    else:
+        assert s['bytes_per_frame'] > 100
+    assert simulator.send_errors == 0
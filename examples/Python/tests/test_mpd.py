@@ -0,0 +1,138 @@
+'''
+MPD backend against a fake MPD in this process.
+'''
+
+import socket
+import time
+
+import pytest
+
+import airpointr_mpd
+
+from conftest import wait_until
+
+def test_connection_commands(mpd):
+    connection = airpointr_mpd.MPDConnection('127.0.0.1', mpd.port)
+    assert connection.command('status') == { 'volume': '50', 'state': 'stop' }
+    assert connection.version == '0.23.5'
+    results = connection.command_list([('setvol', 30), ('play',),
+                                       ('status',)])
+    assert results == [{}, {}, { 'volume': '30', 'state': 'play' }]
+    with pytest.raises(airpointr_mpd.MPDError) as e:
+        connection.command('bogus', 'x y')
+    assert e.value.command == 'bogus'
+    # the connection survives an ACK
+    assert connection.command('status')['state'] == 'play'
+    assert connection.connects == 1
+    connection.close()
+
+def test_connection_reopens_dropped_connection(mpd):
+    connection = airpointr_mpd.MPDConnection('127.0.0.1', mpd.port)
+    connection.command('status')
+    mpd.drop()
+    assert connection.command('setvol', 20) == {}
+    assert mpd.volume == 20
+    assert connection.connects == 2
+    connection.close()
+
+def test_connection_never_repeats_timed_out_command(mpd):
+    connection = airpointr_mpd.MPDConnection('127.0.0.1', mpd.port,
+                                             timeout = 0.2)
+    connection.command('status')
+    mpd.delay = 0.5
+    with pytest.raises(socket.timeout):
+        connection.command('next')
+    connection.close()
+    time.sleep(2 * mpd.delay)
+    assert mpd.commands == [('status',), ('next',)]
+
+def test_dispatcher_sends_command_lists(mpd):
+    dispatcher = airpointr_mpd.MPDDispatcher(
+        airpointr_mpd.MPDConnection('127.0.0.1', mpd.port))
+    # queued before the worker starts, so they go out as one command list
+    dispatcher.notify('setvol', 10)
+    dispatcher.notify('play')
+    dispatcher.start()
+    dispatcher.stop()
+    assert mpd.commands == [('setvol', '10'), ('play',)]
+    assert dispatcher.failed == 0
+    assert dispatcher.latency.count == 1
+
+def test_dispatcher_counts_failed_command_list(mpd):
+    dispatcher = airpointr_mpd.MPDDispatcher(
+        airpointr_mpd.MPDConnection('127.0.0.1', mpd.port))
+    dispatcher.notify('play')
+    dispatcher.notify('bogus')
+    dispatcher.notify('next')
+    dispatcher.start()
+    dispatcher.stop()
+    # MPD stops at the failing command, the batch counts as failed
+    assert mpd.commands == [('play',), ('bogus',)]
+    assert dispatcher.failed == 3
+
+def test_status_cache_follows_idle(mpd):
+    cache = airpointr_mpd.MPDStatusCache('127.0.0.1', mpd.port,
+                                         retry_interval = 60)
+    cache.start()
+    try:
+        assert wait_until(lambda: cache.state == 'stop')
+        assert cache.volume == 50
+        mpd.set_state('play')
+        assert wait_until(lambda: cache.state == 'play')
+        updates = cache.updates
+        mpd.drop()
+        assert wait_until(lambda: cache.status == {})
+        assert cache.updates == updates
+    finally:
+        # stop must not wait for the reconnect back-off
+        cache.stop()
+
+def test_status_cache_idles_longer_than_connect_timeout(mpd):
+    cache = airpointr_mpd.MPDStatusCache('127.0.0.1', mpd.port, timeout = 0.1)
+    cache.start()
+    try:
+        assert wait_until(lambda: cache.state == 'stop')
+        time.sleep(0.3)
+        mpd.set_state('play')
+        assert wait_until(lambda: cache.state == 'play')
+        assert cache.connection.connects == 1
+    finally:
+        cache.stop()
+
+def test_status_cache_stops_during_login():
+    # accepts, but never greets
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    cache = airpointr_mpd.MPDStatusCache('127.0.0.1',
+                                         server.getsockname()[1],
+                                         retry_interval = 60, timeout = 0.5)
+    try:
+        cache.start()
+        time.sleep(0.1)
+        start = time.monotonic()
+        cache.stop()
+        assert time.monotonic() - start < 0.4
+        assert cache.status == {}
+    finally:
+        server.close()
+
+def test_backend_actions(mpd):
+    backend = airpointr_mpd.MPDBackend('127.0.0.1', mpd.port)
+    backend.open()
+    try:
+        assert wait_until(lambda: backend.status.state == 'stop')
+        backend.forward()
+        assert wait_until(lambda: backend.status.state == 'play')
+        assert ('play',) in mpd.commands
+        backend.forward()
+        assert wait_until(lambda: ('next',) in mpd.commands)
+        backend.backward()
+        assert wait_until(lambda: backend.status.state == 'pause')
+        backend.backward()
+        assert wait_until(lambda: ('previous',) in mpd.commands)
+        backend.set_volume(70)
+        assert wait_until(lambda: backend.volume() == 70)
+    finally:
+        backend.close()
+    assert backend.reconnects() == 0
@@ -0,0 +1,60 @@
+'''
+Recording and replay of datagram logs.
+'''
+
+import pytest
+
+import airpointr_record
+
+DATAGRAMS = [b'{"type":"pointer"}', b'', b'x' * 1000]
+
+def record(path, datagrams, addr = ('127.0.0.1', 8981)):
+    recorder = airpointr_record.Recorder(str(path))
+    for i, data in enumerate(datagrams):
+        recorder.record(data, addr, 1000 * i)
+    recorder.close()
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'log'
+    record(path, DATAGRAMS)
+    assert list(airpointr_record.read_log(str(path))) == [
+        (1000 * i, ('127.0.0.1', 8981), data)
+        for i, data in enumerate(DATAGRAMS)]
+    replayed = []
+    replayer = airpointr_record.Replayer(str(path), speed = 0)
+    assert replayer.replay(lambda data, addr: replayed.append(data)) == 3
+    assert replayed == DATAGRAMS
+
+def test_host_names_are_resolved(tmp_path):
+    path = tmp_path / 'log'
+    record(path, [b'a'], ('localhost', 8981))
+    t_ns, addr, data = next(airpointr_record.read_log(str(path)))
+    assert addr[1] == 8981 and addr[0].startswith('127.')
+
+def test_truncated_tail_is_cut_before_appending(tmp_path):
+    path = tmp_path / 'log'
+    record(path, DATAGRAMS)
+    complete = path.stat().st_size
+    # a crash in the middle of the last record
+    with open(str(path), 'ab') as f:
+        f.write(airpointr_record.RECORD.pack(5000, b'\0' * 4, 1, 100) + b'y')
+    assert len(list(airpointr_record.read_log(str(path)))) == 3
+    record(path, [b'after the crash'])
+    assert path.stat().st_size == complete + airpointr_record.RECORD.size + 15
+    records = list(airpointr_record.read_log(str(path)))
+    assert [data for t_ns, addr, data in records] == \
+           DATAGRAMS + [b'after the crash']
+
+def test_cut_in_magic(tmp_path):
+    path = tmp_path / 'log'
+    path.write_bytes(airpointr_record.MAGIC[:3])
+    record(path, [b'a'])
+    assert [data for t_ns, addr, data in
+            airpointr_record.read_log(str(path))] == [b'a']
+
+def test_foreign_file_is_refused(tmp_path):
+    path = tmp_path / 'log'
+    path.write_bytes(b'not a log at all')
+    with pytest.raises(ValueError):
+        airpointr_record.Recorder(str(path))
+    assert path.read_bytes() == b'not a log at all'
@@ -0,0 +1,75 @@
+'''
+Compilation of gesture mappings.
+'''
+
+import json
+import os
+
+import pytest
+
+import airpointr_media
+import airpointr_rules
+
+MAPPINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                        'mappings')
+
+@pytest.mark.parametrize('name', ['swipe.json', 'smartcircle.json'])
+def test_shipped_mappings_compile(name):
+    table = airpointr_rules.load_mapping(os.path.join(MAPPINGS, name),
+                                         airpointr_media.ACTIONS)
+    assert table.volume != None
+
+def test_lookups():
+    table = airpointr_rules.compile_rules([
+        { 'event': 'rwipe', 'action': 'forward' },
+        { 'smart': 1, 'action': 'next' },
+        { 'segment': 2, 'action': 'stop' },
+        { 'segment': 2, 'turns': 2, 'action': 'play' }])
+    assert table.event_action('rwipe') == 'forward'
+    assert table.event_action('lwipe') == None
+    assert table.smart_action(1) == 'next'
+    assert table.segment_action(2, 0) == 'stop'
+    assert table.segment_action(2 + 8, -1.5) == 'stop'
+    assert table.segment_action(2, 5) == 'play'
+    assert table.segment_action(3, 5) == None
+    assert table.volume == None
+
+@pytest.mark.parametrize('rules', [
+    [{ 'event': 'rwipe' }],
+    [{ 'action': 'play' }],
+    [{ 'event': 'rwipe', 'smart': 0, 'action': 'play' }],
+    [{ 'smart': 4, 'action': 'play' }],
+    [{ 'smart': True, 'action': 'play' }],
+    [{ 'segment': 8, 'action': 'play' }],
+    [{ 'event': 'rwipe', 'turns': 1, 'action': 'play' }],
+    [{ 'event': 'rwipe', 'action': 'play' },
+     { 'event': 'rwipe', 'action': 'stop' }],
+    [{ 'event': 'rwipe', 'action': 'dance' }],
+])
+def test_bad_rules_are_rejected(rules):
+    with pytest.raises(ValueError):
+        airpointr_rules.compile_rules(rules,
+                                      actions = airpointr_media.ACTIONS)
+
+@pytest.mark.parametrize('volume', [
+    [2, 2], { 'turns': -1 }, { 'turns': 101 }, { 'step': 0 },
+    { 'step': '2' }, { 'turns': True },
+])
+def test_bad_volume_is_rejected(volume):
+    with pytest.raises(ValueError):
+        airpointr_rules.compile_rules([], volume)
+
+def test_volume_defaults():
+    table = airpointr_rules.compile_rules([], {})
+    assert table.volume == { 'turns': 0, 'step': 2 }
+
+def test_load_mapping_names_the_file(tmp_path):
+    path = tmp_path / 'bad.json'
+    path.write_text(json.dumps({ 'rules': [{ 'smart': 9,
+                                             'action': 'play' }] }))
+    with pytest.raises(ValueError) as e:
+        airpointr_rules.load_mapping(str(path))
+    assert str(path) in str(e.value)
+    path.write_text('[]')
+    with pytest.raises(ValueError):
+        airpointr_rules.load_mapping(str(path))
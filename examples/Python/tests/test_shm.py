@@ -0,0 +1,98 @@
+'''
+Frame records and the shared memory ring.
+'''
+
+import json
+
+import pytest
+
+import airpointr_shm
+
+from test_listener import pointer
+
+def record(seq):
+    return (1000 + seq, seq, 0.5, 0.25, 1.0, airpointr_shm.FLAG_ACTIVE, 1,
+            1, 2, 0, 2)
+
+@pytest.fixture
+def ring(tmp_path):
+    path = str(tmp_path / 'ring')
+    writer = airpointr_shm.RingWriter(path, slots = 8)
+    reader = airpointr_shm.RingReader(path)
+    yield writer, reader
+    reader.close()
+    writer.close()
+
+def seqs(records):
+    return [r[1] for r in records]
+
+def test_record_round_trip():
+    j = json.loads(pointer(events = ['rwipe'], seq = 7, ts = 123))
+    r = airpointr_shm.frame_record(j)
+    assert airpointr_shm.record_message(r) == j
+    frame = airpointr_shm.record_frame(r)
+    assert frame.events == ('rwipe',) and frame.y == 0.75
+
+def test_reader_follows_writer(ring):
+    writer, reader = ring
+    assert reader.read() == []
+    for seq in range(1, 6):
+        writer.write_record(record(seq))
+    assert reader.pending() == 5
+    assert reader.read(limit = 2) == [record(1), record(2)]
+    assert seqs(reader.read()) == [3, 4, 5]
+    assert reader.lost == 0
+
+def test_reader_behind_loses_oldest_frames(ring):
+    writer, reader = ring
+    for seq in range(1, 4):
+        writer.write_record(record(seq))
+    assert seqs(reader.read()) == [1, 2, 3]
+    # the ring wraps around twice and a half
+    for seq in range(4, 24):
+        writer.write_record(record(seq))
+    assert seqs(reader.read()) == list(range(16, 24))
+    assert reader.lost == 12
+    assert reader.latest() == record(23)
+
+def test_overwritten_slot_is_not_returned(ring):
+    writer, reader = ring
+    writer.write_record(record(1))
+    for seq in range(2, 10):
+        writer.write_record(record(seq))
+    # frame 0 (seq 1) was in the slot of frame 8 (seq 9)
+    assert reader.read_slot(0) == None
+    assert reader.read_slot(8) == record(9)
+
+def test_frame_count_wraps_around(ring):
+    writer, reader = ring
+    writer.count = 2 ** 32 - 3
+    writer.write_record(record(0))
+    reader.close()
+    reader = airpointr_shm.RingReader(writer.path)
+    for seq in range(1, 7):
+        writer.write_record(record(seq))
+    assert reader.pending() == 6
+    assert seqs(reader.read()) == [1, 2, 3, 4, 5, 6]
+    assert reader.lost == 0
+    reader.close()
+
+def test_reader_follows_replaced_ring(ring):
+    writer, reader = ring
+    writer.write_record(record(1))
+    assert seqs(reader.read()) == [1]
+    # the relay restarts and replaces the ring
+    restarted = airpointr_shm.RingWriter(writer.path, slots = 16)
+    try:
+        restarted.write_record(record(100))
+        reader.check_interval = 0
+        assert seqs(reader.read()) == [100]
+        assert reader.reopens == 1 and reader.slots == 16
+        restarted.write_record(record(101))
+        assert seqs(reader.read()) == [101]
+    finally:
+        restarted.close()
+
+def test_slots_must_be_power_of_two(tmp_path):
+    with pytest.raises(ValueError):
+        airpointr_shm.RingWriter(str(tmp_path / 'ring'), slots = 100)
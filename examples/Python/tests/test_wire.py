@@ -0,0 +1,61 @@
+'''
+Binary wire format of the pointer frames.
+'''
+
+import json
+
+import pytest
+
+import airpointr_wire
+
+from test_listener import pointer
+
+def message(**fields):
+    return json.loads(pointer(**fields))
+
+def test_round_trip():
+    j = message(events = ['lwipe'], seq = 3, ts = 99)
+    data = airpointr_wire.encode(j)
+    assert airpointr_wire.is_binary(data)
+    assert len(data) == airpointr_wire.FRAME_SIZE
+    assert airpointr_wire.decode(data) == j
+    frame = airpointr_wire.decode_frame(data, 5)
+    assert frame.events == ('lwipe',) and frame.recv_ns == 5
+    assert frame.circle.smart.enabled
+
+def test_json_format_stays_json():
+    j = message()
+    data = airpointr_wire.encode(j, airpointr_wire.JSON)
+    assert not airpointr_wire.is_binary(data)
+    assert airpointr_wire.decode(data) == j
+
+@pytest.mark.parametrize('j', [
+    message(events = ['rwipe', 'rwipe']),
+    message(events = ['rwipe', 'lwipe', 'rwipe']),
+    message(events = ['lwipe', 'rwipe']),
+    message(events = ['pinch']),
+    message(license = 'expired'),
+    message(seq = 2 ** 40),
+    message(extra = 1),
+    { 'type': 'pointer', 'x': 0.1 },
+    { 'op': 'register', 'success': True },
+])
+def test_inexact_messages_fall_back_to_json(j):
+    data = airpointr_wire.encode(j)
+    assert not airpointr_wire.is_binary(data)
+    assert airpointr_wire.decode(data) == j
+
+def test_message_without_circle_falls_back_to_json():
+    j = message()
+    del j['circle']
+    assert airpointr_wire.decode(airpointr_wire.encode(j)) == j
+
+def test_truncated_frame_is_refused():
+    data = airpointr_wire.encode(message())
+    with pytest.raises(ValueError):
+        airpointr_wire.decode(data[:-1])
+
+def test_requests():
+    assert airpointr_wire.parse_request(
+        airpointr_wire.request(airpointr_wire.BINARY)) == airpointr_wire.BINARY
+    assert airpointr_wire.parse_request(b'register') == None